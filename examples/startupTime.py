@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+"""Measures how long it takes to create the mac80211_hwsim radios and
+to bring up a network with 10, 100 and 1000 stations.
+Usage: sudo python startupTime.py [n_radios ...] [-w max_workers]"""
+
+import sys
+from time import time
+
+from mininet.log import setLogLevel, info
+from mn_iot.mac80211.module import module
+from mn_iot.mac80211.net import Mininet_wifi
+
+
+def startup(n_radios):
+    "Returns the time to configure the wifi nodes and to build the network"
+    net = Mininet_wifi()
+    for n in range(1, n_radios + 1):
+        net.addStation('sta%s' % n)
+
+    t0 = time()
+    net.configureWifiNodes()
+    t1 = time()
+    net.build()
+    t2 = time()
+    net.stop()
+    return t1 - t0, t2 - t1
+
+
+def benchmark(sizes):
+    results = []
+    for n_radios in sizes:
+        info("*** Starting %s radios\n" % n_radios)
+        results.append((n_radios,) + startup(n_radios))
+
+    info("\n%8s %12s %10s\n" % ('radios', 'radios (s)', 'build (s)'))
+    for n_radios, radios, build in results:
+        info("%8s %12.2f %10.2f\n" % (n_radios, radios, build))
+
+
+if __name__ == '__main__':
+    setLogLevel('info')
+    args = sys.argv[1:]
+    if '-w' in args:
+        idx = args.index('-w')
+        module.max_workers = int(args[idx + 1])
+        del args[idx:idx + 2]
+    benchmark([int(arg) for arg in args] or [10, 100, 1000])
@@ -1,4 +1,5 @@
 import sys
+from getopt import getopt, GetoptError
 
 from mininet.cli import CLI
 from mininet.log import output, error
@@ -49,6 +50,35 @@ class CLI_wifi(CLI):
             elif len(args) == 3 and args[2] == 'up':
                 plot2d.showLine(nodes[0], nodes[1])
 
+    def do_iperfmulti(self, line):
+        """Run concurrent iperf3 flows from many clients to a server.
+           Usage: iperfmulti [-u udpBw] [-t seconds] [-s stagger] [-o file]
+                  [server client1 client2 ...]
+           Without nodes, every station sends to the first host"""
+        try:
+            opts, args = getopt(line.split(), 'u:t:s:o:')
+        except GetoptError as e:
+            error('%s\n' % e)
+            return
+        opts = dict(opts)
+        if len(args) == 1:
+            error('usage: iperfmulti [-u udpBw] [-t seconds] [-s stagger] '
+                  '[-o file] [server client1 client2 ...]\n')
+            return
+        pairs = None
+        if args:
+            for arg in args:
+                if arg not in self.mn:
+                    error('node \'%s\' not in network\n' % arg)
+                    return
+            server = self.mn[args[0]]
+            pairs = [(self.mn[client], server) for client in args[1:]]
+        self.mn.iperfMulti(pairs, l4Type='UDP' if '-u' in opts else 'TCP',
+                           udpBw=opts.get('-u', '10M'),
+                           seconds=int(opts.get('-t', 10)),
+                           stagger=float(opts.get('-s', 0)),
+                           filename=opts.get('-o'))
+
     def do_dpctl(self, line):
         """Run dpctl (or ovs-ofctl) command on all switches.
            Usage: dpctl command [arg1] [arg2] ..."""
@@ -0,0 +1,354 @@
+"""In-process collector of interface statistics, rssi and position.
+
+The interface counters of each node are read from /proc/<pid>/net/dev,
+which shows the network namespace of the node, so no process is spawned
+per sample. Counters that are not a column of that file are read from
+the statistics dir of the interface, from the namespace of the node.
+Samples are kept in ring buffers and may
+be exported to CSV, JSON-lines or Parquet files without any GUI."""
+
+import csv
+import json
+import os
+import threading
+from subprocess import PIPE
+from threading import Thread as thread, Event
+from time import time
+
+import numpy as np
+
+from mininet.log import debug, error
+
+# columns of /proc/net/dev after the interface name that are equal to
+# the statistics counter of the same name. The other columns are sums of
+# counters (e.g. rx_dropped + rx_missed_errors), so those counters are
+# read from STATS
+NET_DEV = {'rx_bytes': 0, 'rx_packets': 1, 'rx_errors': 2,
+           'rx_fifo_errors': 4, 'rx_compressed': 6, 'multicast': 7,
+           'tx_bytes': 8, 'tx_packets': 9, 'tx_errors': 10, 'tx_dropped': 11,
+           'tx_fifo_errors': 12, 'collisions': 13, 'tx_compressed': 15}
+STATS = '/sys/class/ieee80211/*/device/net/{}/statistics/{}'
+
+
+class ringBuffer(object):
+    "Preallocated buffer of the last size samples"
+
+    def __init__(self, size, width=1):
+        self.size = size
+        self.times = np.zeros(size)
+        if width == 1:
+            self.values = np.zeros(size)
+        else:
+            self.values = np.zeros((size, width))
+        self.count = 0  # number of samples ever added
+
+    def append(self, t, value):
+        idx = self.count % self.size
+        self.times[idx] = t
+        self.values[idx] = value
+        self.count += 1
+
+    def get(self, since=0):
+        """Returns the times and values of the samples, oldest first
+        :param since: skips the samples added before this count"""
+        idx = np.arange(max(since, self.count - self.size),
+                        self.count) % self.size
+        return self.times[idx], self.values[idx]
+
+    def last(self):
+        "Returns the value of the last sample"
+        return self.values[(self.count - 1) % self.size]
+
+
+class statsCollector(object):
+    """Samples the data types of the nodes at a fixed rate
+    :param nodes: list of nodes
+    :param data_types: statistics counters (e.g. tx_packets, see
+    /sys/class/net/<iface>/statistics), rssi or position
+    :param interval: sampling interval (s)
+    :param size: number of samples kept per node interface
+    :param nice: niceness added to the collector thread, so that it does
+    not compete with the emulated nodes"""
+
+    def __init__(self, nodes, data_types, interval=1.0, size=3600, nice=0):
+        self.nodes = nodes
+        self.data_types = data_types
+        self.interval = interval
+        self.size = size
+        self.nice = nice
+        self.buffers = {}  # (node, wif, data_type) -> ringBuffer
+        self.listeners = []  # called with the time of each sample
+        self.start_time = time()
+        self.stopped = Event()
+        self.thread_ = None
+        self.last_duration = 0  # time spent in the last sample (s)
+        self.busy = 0  # time spent sampling (s)
+        self.samples = 0
+        self.drift = 0  # delay of the last sample from its schedule (s)
+        self.max_drift = 0
+        self.failed = set()  # (node, wif, data_type) that could not be read
+        for node in nodes:
+            for wif in range(len(node.params['wif'])):
+                for data_type in data_types:
+                    width = 3 if data_type == 'position' else 1
+                    self.buffers[(node, wif, data_type)] = \
+                        ringBuffer(size, width)
+
+    @staticmethod
+    def read_net_dev(node):
+        "Returns the /proc/net/dev counters of the namespace of node"
+        counters = {}
+        with open('/proc/%s/net/dev' % node.pid) as f:
+            for line in f.readlines()[2:]:
+                iface, values = line.split(':', 1)
+                counters[iface.strip()] = values.split()
+        return counters
+
+    @staticmethod
+    def read_stats(node, iface, data_type):
+        "Reads a statistics counter of iface from the namespace of node"
+        proc = node.popen('cat %s' % STATS.format(iface, data_type),
+                          shell=True, stdout=PIPE, stderr=PIPE)
+        out, err = proc.communicate()
+        if proc.returncode:
+            raise OSError(err.decode(errors='replace').strip())
+        return float(out)
+
+    def get_value(self, node, wif, data_type, net_dev):
+        if data_type == 'rssi':
+            if 'rssi' in node.params and 'associatedTo' in node.params \
+                    and node.params['associatedTo'][wif]:
+                return float(node.params['rssi'][wif])
+            return 0
+        if data_type == 'position':
+            return [float(c) for c in node.params['position'][:3]]
+        iface = node.params['wif'][wif]
+        if data_type not in NET_DEV:
+            return self.read_stats(node, iface, data_type)
+        if node not in net_dev:
+            net_dev[node] = self.read_net_dev(node)
+        return float(net_dev[node][iface][NET_DEV[data_type]])
+
+    def sample(self, scheduled=None):
+        """Reads all the data types once
+        :param scheduled: time the sample was scheduled for"""
+        t0 = time()
+        now = t0 - self.start_time
+        net_dev = {}
+        for (node, wif, data_type), buffer in self.buffers.items():
+            try:
+                value = self.get_value(node, wif, data_type, net_dev)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                key = (node, wif, data_type)
+                if key in self.failed:
+                    debug('telemetry: %s %s: %s\n' % (node, data_type, e))
+                else:
+                    self.failed.add(key)
+                    error('*** telemetry: cannot read %s of %s: %s\n'
+                          % (data_type, node.params['wif'][wif], e))
+                continue
+            buffer.append(now, value)
+        for listener in self.listeners:
+            listener(now)
+        self.last_duration = time() - t0
+        self.busy += self.last_duration
+        self.samples += 1
+        if scheduled is not None:
+            self.drift = t0 - scheduled
+            self.max_drift = max(self.max_drift, self.drift)
+
+    def set_priority(self):
+        "Lowers the priority of the calling thread (Linux only)"
+        if not self.nice or not hasattr(os, 'setpriority') \
+                or not hasattr(threading, 'get_native_id'):
+            return
+        try:
+            tid = threading.get_native_id()
+            os.setpriority(os.PRIO_PROCESS, tid,
+                           os.getpriority(os.PRIO_PROCESS, tid) + self.nice)
+        except OSError as e:
+            debug('telemetry: cannot change the priority: %s\n' % e)
+
+    def get_stats(self):
+        """Returns the overhead of the collector: the share of time spent
+        sampling, the mean duration of a sample and the drift from the
+        sampling schedule"""
+        elapsed = time() - self.start_time
+        return {'samples': self.samples,
+                'overhead': self.busy / elapsed if elapsed else 0,
+                'mean_duration': self.busy / self.samples
+                if self.samples else 0,
+                'drift': self.drift,
+                'max_drift': self.max_drift}
+
+    def run(self):
+        self.set_priority()
+        next_sample = time()
+        while not self.stopped.is_set():
+            self.sample(next_sample)
+            next_sample += self.interval
+            delay = next_sample - time()
+            if delay < 0:
+                # too slow for the interval: skip the missed samples
+                next_sample = time()
+                delay = 0
+            self.stopped.wait(delay)
+
+    def start(self):
+        self.thread_ = thread(name='telemetryCollector', target=self.run)
+        self.thread_.daemon = True
+        self.thread_.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread_:
+            self.thread_.join()
+
+    def get(self, node, wif, data_type, since=0):
+        """Returns the times and values collected for a node interface
+        :param since: skips the samples added before this count"""
+        return self.buffers[(node, wif, data_type)].get(since)
+
+    def count(self, node, wif, data_type):
+        "Returns the number of samples ever collected"
+        return self.buffers[(node, wif, data_type)].count
+
+
+class telemetryExporter(object):
+    """Writes the samples of a statsCollector to files in batches. Each
+    row holds the time, node, wif, data types, associated AP and, if
+    position is collected, x, y and z
+    :param collector: statsCollector
+    :param filename: prefix of the files
+    :param format: csv, jsonl or parquet (requires pyarrow)
+    :param batch_size: rows buffered before they are written
+    :param max_rows: rows per file before a new one is started (0: no
+    rotation)"""
+
+    formats = ['csv', 'jsonl', 'parquet']
+
+    def __init__(self, collector, filename='mn-telemetry', format='csv',
+                 batch_size=100, max_rows=0):
+        if format not in self.formats:
+            raise ValueError('telemetry: unknown format %s' % format)
+        if format == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+                self.pyarrow = pyarrow
+            except ImportError:
+                error('telemetry: pyarrow is not installed. '
+                      'Exporting to csv\n')
+                format = 'csv'
+        self.collector = collector
+        self.filename = filename
+        self.format = format
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.columns = ['time', 'node', 'wif']
+        for data_type in collector.data_types:
+            if data_type == 'position':
+                self.columns += ['x', 'y', 'z']
+            else:
+                self.columns.append(data_type)
+        self.columns.append('associatedTo')
+        self.batch = dict((column, []) for column in self.columns)
+        self.rows = 0  # rows in the batch
+        self.file_rows = 0  # rows in the current file
+        self.file_id = 0
+        self.file = None
+        self.writer = None
+        self.is_open = False
+        self.lock = threading.Lock()
+        collector.listeners.append(self.add_rows)
+
+    def get_filename(self):
+        ext = {'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet'}
+        if self.max_rows:
+            return '%s-%03d.%s' % (self.filename, self.file_id,
+                                   ext[self.format])
+        return '%s.%s' % (self.filename, ext[self.format])
+
+    def add_rows(self, now):
+        "Adds a row per node interface with the last samples"
+        batch = self.batch
+        for node in self.collector.nodes:
+            for wif in range(len(node.params['wif'])):
+                batch['time'].append(round(now, 6))
+                batch['node'].append(node.name)
+                batch['wif'].append(wif)
+                for data_type in self.collector.data_types:
+                    value = self.collector.buffers[(node, wif,
+                                                    data_type)].last()
+                    if data_type == 'position':
+                        for column, coord in zip('xyz', value):
+                            batch[column].append(float(coord))
+                    else:
+                        batch[data_type].append(float(value))
+                ap = node.params.get('associatedTo', [])
+                ap = ap[wif] if wif < len(ap) else None
+                batch['associatedTo'].append(ap.name if ap else '')
+                self.rows += 1
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def open(self):
+        # the parquet writer is created with the schema of the first batch
+        if self.format != 'parquet':
+            self.file = open(self.get_filename(), 'w')
+            if self.format == 'csv':
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(self.columns)
+        self.file_rows = 0
+        self.is_open = True
+
+    def close_file(self):
+        if self.format == 'parquet':
+            self.writer.close()
+        else:
+            self.file.close()
+        self.file = self.writer = None
+        self.file_id += 1
+        self.is_open = False
+
+    def flush(self):
+        "Writes the buffered rows, starting a new file when it is full"
+        with self.lock:
+            start = 0
+            while start < self.rows:
+                if not self.is_open:
+                    self.open()
+                end = self.rows
+                if self.max_rows:
+                    end = min(end, start + self.max_rows - self.file_rows)
+                self.write(start, end)
+                self.file_rows += end - start
+                start = end
+                if self.max_rows and self.file_rows >= self.max_rows:
+                    self.close_file()
+            self.batch = dict((column, []) for column in self.columns)
+            self.rows = 0
+
+    def write(self, start, end):
+        columns = [self.batch[column][start:end] for column in self.columns]
+        if self.format == 'csv':
+            self.writer.writerows(zip(*columns))
+        elif self.format == 'jsonl':
+            for row in zip(*columns):
+                self.file.write(json.dumps(dict(zip(self.columns, row))))
+                self.file.write('\n')
+        else:
+            pa = self.pyarrow
+            table = pa.table(dict(zip(self.columns, columns)))
+            if self.writer is None:
+                self.writer = pa.parquet.ParquetWriter(self.get_filename(),
+                                                       table.schema)
+            self.writer.write_table(table)
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        "Writes the remaining rows and closes the file"
+        self.flush()
+        if self.is_open:
+            self.close_file()
@@ -0,0 +1,186 @@
+"""Concurrent iperf3 flows. All flows run at the same time, so that the
+aggregate capacity of the wireless medium under contention is measured,
+and the rssi and associated AP of each client are sampled while the
+flows run"""
+
+import json
+from subprocess import PIPE, DEVNULL
+from threading import Thread as thread, Event
+from time import time, sleep
+
+from mininet.log import debug, error, output
+
+
+class iperfFlows(object):
+    """Runs iperf3 flows between many (client, server) pairs at once
+    :param pairs: list of (client, server)
+    :param l4Type: TCP or UDP
+    :param udpBw: bandwidth target of each UDP flow
+    :param seconds: duration of each flow (s)
+    :param stagger: delay between the starts of two flows (s)
+    :param port: port of the first flow, the others use the next ones
+    :param interval: rssi sampling interval (s)"""
+
+    def __init__(self, pairs, l4Type='TCP', udpBw='10M', seconds=10,
+                 stagger=0, port=5201, interval=1.0):
+        if l4Type not in ['TCP', 'UDP']:
+            raise Exception('Unexpected l4 type: %s' % l4Type)
+        self.pairs = pairs
+        self.l4Type = l4Type
+        self.udpBw = udpBw
+        self.seconds = seconds
+        self.stagger = stagger
+        self.port = port
+        self.interval = interval
+        self.servers = []
+        self.samples = [[] for _ in pairs]
+        self.stopped = Event()
+
+    @staticmethod
+    def get_link(node, wif=0):
+        "Returns the rssi and the name of the AP the node is associated to"
+        rssi = node.params.get('rssi', [None])
+        ap = node.params.get('associatedTo', [None])
+        rssi = rssi[wif] if wif < len(rssi) else None
+        ap = ap[wif] if wif < len(ap) else None
+        return rssi, getattr(ap, 'name', None)
+
+    def sample(self, start):
+        "Samples the link state of the clients until the flows end"
+        while True:
+            now = round(time() - start, 3)
+            for i, (client, _) in enumerate(self.pairs):
+                rssi, ap = self.get_link(client)
+                self.samples[i].append({'time': now, 'rssi': rssi,
+                                        'associatedTo': ap})
+            if self.stopped.wait(self.interval):
+                break
+
+    def start_servers(self):
+        ports = {}  # server -> ports
+        for i, (_, server) in enumerate(self.pairs):
+            port = self.port + i
+            # the server reports every second: its output is not read, so
+            # it must not go to a pipe that would fill up and block it
+            self.servers.append(server.popen(
+                ['iperf3', '-s', '-p', str(port)], stdout=DEVNULL,
+                stderr=DEVNULL))
+            ports.setdefault(server, []).append(port)
+        # waits until all servers of each node are listening
+        for server, server_ports in ports.items():
+            for _ in range(50):
+                listening = server.cmd('ss -Hltn')
+                if all(':%d ' % port in listening for port in server_ports):
+                    break
+                sleep(0.1)
+            else:
+                error('*** iperf3 servers not listening on %s\n' % server)
+
+    def stop_servers(self):
+        for proc in self.servers:
+            proc.terminate()
+            proc.communicate()
+        self.servers = []
+
+    def get_args(self, i, server):
+        args = ['iperf3', '-J', '-c', server.IP(), '-p', str(self.port + i),
+                '-t', str(self.seconds)]
+        if self.l4Type == 'UDP':
+            args += ['-u', '-b', self.udpBw]
+        return args
+
+    def parse(self, out):
+        """Parses the JSON output of an iperf3 client
+        :return: dict of bps, jitter_ms, lost_percent and retransmits"""
+        data = json.loads(out)
+        if 'error' in data:
+            return {'error': data['error']}
+        end = data['end']
+        if self.l4Type == 'UDP':
+            udp = end['sum']
+            return {'bps': udp['bits_per_second'],
+                    'jitter_ms': udp.get('jitter_ms'),
+                    'lost_packets': udp.get('lost_packets'),
+                    'packets': udp.get('packets'),
+                    'lost_percent': udp.get('lost_percent')}
+        return {'bps': end['sum_received']['bits_per_second'],
+                'sent_bps': end['sum_sent']['bits_per_second'],
+                'retransmits': end['sum_sent'].get('retransmits')}
+
+    def run(self):
+        """Runs the flows
+        :return: dict with the result of each flow and the aggregate"""
+        self.start_servers()
+        start = time()
+        sampler = thread(name='iperfSampler', target=self.sample,
+                         args=(start,))
+        sampler.daemon = True
+        sampler.start()
+        clients = []
+        try:
+            for i, (client, server) in enumerate(self.pairs):
+                if i and self.stagger:
+                    sleep(self.stagger)
+                clients.append((round(time() - start, 3), client.popen(
+                    self.get_args(i, server), stdout=PIPE, stderr=PIPE)))
+            flows = []
+            for i, (started, proc) in enumerate(clients):
+                out, err = proc.communicate()
+                if isinstance(out, bytes):
+                    out = out.decode(errors='replace')
+                client, server = self.pairs[i]
+                debug('iperf3 %s -> %s: %s\n' % (client, server, out))
+                try:
+                    flow = self.parse(out)
+                except (ValueError, KeyError) as e:
+                    flow = {'error': 'could not parse iperf3 output: %s' % e}
+                flow.update({'client': client.name, 'server': server.name,
+                             'port': self.port + i, 'start': started,
+                             'link': self.samples[i]})
+                flows.append(flow)
+        finally:
+            self.stopped.set()
+            sampler.join()
+            for _, proc in clients:
+                if proc.poll() is None:
+                    proc.kill()
+            self.stop_servers()
+        return {'l4Type': self.l4Type, 'seconds': self.seconds,
+                'flows': flows, 'aggregate': self.aggregate(flows)}
+
+    @staticmethod
+    def report(result, filename=None):
+        "Prints the throughput of each flow and saves the result as JSON"
+        for flow in result['flows']:
+            output(' %s -> %s: ' % (flow['client'], flow['server']))
+            if 'error' in flow:
+                output('error: %s\n' % flow['error'])
+                continue
+            output('%.2f Mbits/sec' % (flow['bps'] / 1e6))
+            if flow.get('jitter_ms') is not None:
+                output(', jitter %.3f ms, lost %.2f%%'
+                       % (flow['jitter_ms'], flow['lost_percent'] or 0))
+            output('\n')
+        aggregate = result['aggregate']
+        output('*** Aggregate: %.2f Mbits/sec over %d flows (%d failed)\n'
+               % (aggregate['bps'] / 1e6, aggregate['flows'],
+                  aggregate['failed']))
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(result, f, indent=2, default=str)
+
+    @staticmethod
+    def aggregate(flows):
+        "Sums the throughput and averages the jitter of the flows"
+        ok = [flow for flow in flows if 'error' not in flow]
+        result = {'flows': len(flows), 'failed': len(flows) - len(ok),
+                  'bps': sum(flow['bps'] for flow in ok)}
+        jitter = [flow['jitter_ms'] for flow in ok
+                  if flow.get('jitter_ms') is not None]
+        if jitter:
+            result['jitter_ms'] = sum(jitter) / len(jitter)
+        packets = sum(flow.get('packets') or 0 for flow in ok)
+        if packets:
+            lost = sum(flow.get('lost_packets') or 0 for flow in ok)
+            result['lost_percent'] = 100.0 * lost / packets
+        return result
@@ -5,10 +5,13 @@ author:
 
 import os
 import re
+import math
 import subprocess
+import threading
 from time import sleep
 from sys import version_info as py_version_info
 from six import string_types
+import numpy as np
 
 from mininet.log import info, error, debug
 from mn_iot.mac80211.devices import GetRate
@@ -96,6 +99,7 @@ class IntfWireless(object):
 
     def setChanParam(self, channel, wif):
         self.node.params['channel'][wif] = str(channel)
+        self.node.clear_freq(wif)
         self.node.params['freq'][wif] = self.node.get_freq(wif)
 
     def setModeParam(self, mode, wif):
@@ -473,6 +477,7 @@ class TCWirelessLink(IntfWireless):
 
         # Execute all the commands in our node
         debug("at map stage w/cmds: %s\n" % cmds)
+        linkShaper.forget(self.node, self.name)
         tcoutputs = [ self.tc(cmd) for cmd in cmds ]
         for output in tcoutputs:
             if output != '':
@@ -916,14 +921,82 @@ class set_snr(object):
                                           node[0].params['rssi'][0] - (-91)))
 
 
-class wirelessLink (object):
+class channelEquation(object):
+    """Channel equation compiled once. Results are memoized per distance,
+    rounded to the given number of digits
+    :param equation: expression of dist (and custombw)
+    :param prefix: prepended to equation, e.g. 'custombw' for equationBw"""
+
+    max_size = 100000  # max number of memoized results
+    namespace = {'math': math, 'np': np}
+
+    def __init__(self, equation, prefix='', digits=2):
+        self.equation = equation
+        self.code = compile(prefix + equation, '<channel equation>', 'eval')
+        self.digits = digits
+        self.cache = {}
+
+    def __call__(self, dist, custombw=None):
+        dist = round(dist, self.digits)
+        key = (dist, custombw)
+        if key not in self.cache:
+            if len(self.cache) >= self.max_size:
+                self.cache.clear()
+            self.cache[key] = eval(self.code, self.namespace,
+                                   {'dist': dist, 'custombw': custombw})
+        return self.cache[key]
+
+    def evaluate(self, dists, custombw=None):
+        """Evaluates the equation for an array of distances at once
+        :param dists: distances
+        :param custombw: custombw (for equationBw)"""
+        dists = np.round(np.asarray(dists, dtype=float), self.digits)
+        try:
+            values = eval(self.code, self.namespace,
+                          {'dist': dists, 'custombw': custombw})
+            return np.broadcast_to(values, dists.shape).astype(float)
+        except (TypeError, ValueError):
+            # equation does not support arrays (e.g. math functions)
+            return np.array([self(dist, custombw) for dist in dists.flat],
+                            dtype=float).reshape(dists.shape)
+
+
+class channelEquations(object):
+    "Keeps the channel equations of a class compiled"
 
-    dist = 0
-    noise = 0
     equationLoss = '(dist * 2) / 1000'
     equationDelay = '(dist / 10) + 1'
     equationLatency = '(dist / 10)/2'
     equationBw = ' * (1.01 ** -dist)'
+
+    @classmethod
+    def get_equation(cls, name):
+        """Returns the compiled equation. It is compiled again when the
+        equation string has been changed
+        :param name: equationLoss, equationDelay, equationLatency or
+        equationBw"""
+        equation = getattr(cls, name)
+        compiled = cls.__dict__.get('compiled', {}).get(name)
+        if compiled is None or compiled.equation != equation:
+            prefix = 'custombw' if name == 'equationBw' else ''
+            compiled = channelEquation(equation, prefix)
+            if 'compiled' not in cls.__dict__:
+                cls.compiled = {}
+            cls.compiled[name] = compiled
+        return compiled
+
+    @classmethod
+    def compile_equations(cls):
+        "Compiles all the equations"
+        for name in ['equationLoss', 'equationDelay',
+                     'equationLatency', 'equationBw']:
+            cls.get_equation(name)
+
+
+class wirelessLink (channelEquations):
+
+    dist = 0
+    noise = 0
     ifb = False
 
     def __init__(self, sta=None, ap=None, dist=0, **params):
@@ -939,18 +1012,18 @@ class wirelessLink (object):
 
     def getDelay(self, dist):
         "Based on RandomPropagationDelayModel"
-        return eval(self.equationDelay)
+        return self.get_equation('equationDelay')(dist)
 
     def getLatency(self, dist):
-        return eval(self.equationLatency)
+        return self.get_equation('equationLatency')(dist)
 
     def getLoss(self, dist):
-        return eval(self.equationLoss)
+        return self.get_equation('equationLoss')(dist)
 
     def getBW(self, sta=None, ap=None, dist=0, **params):
         value = GetRate(sta=sta, ap=ap, **params)
         custombw = value.rate
-        rate = eval(str(custombw) + self.equationBw)
+        rate = self.get_equation('equationBw')(dist, custombw)
 
         if rate <= 0.0:
             rate = 0.1
@@ -981,7 +1054,28 @@ class wirelessLink (object):
 
     @classmethod
     def tc(cls, node, iface, bw, loss, latency):
-        cmd = "tc qdisc replace dev %s root handle 2: netem " % iface
+        linkShaper.apply(node, iface, bw, loss, latency)
+
+
+class linkShaper(object):
+    """Applies netem settings to interfaces. The last settings applied to
+    each interface are cached, so that unchanged settings are not applied
+    again, and the commands are written to a long-lived 'tc -batch'
+    process running in the namespace of each node instead of forking tc
+    for each of them"""
+    applied = {}  # (node, iface) -> last applied tc command
+    procs = {}  # node -> tc process
+    written = {}  # node -> {line of the batch: (iface, command)}
+    max_written = 4096  # lines kept to match the errors of tc -batch
+    use_batch = True
+    skipped = 0  # number of unchanged settings
+    lock = threading.Lock()  # guards the dicts, never held on a pipe
+    node_locks = {}  # node -> lock held while writing to its tc process
+    local = threading.local()  # nodes with pending commands in a batch
+
+    @classmethod
+    def get_cmd(cls, iface, bw, loss, latency):
+        cmd = "qdisc replace dev %s root handle 2: netem " % iface
         rate = "rate %.4fmbit " % bw
         cmd += rate
         if latency > 0.1:
@@ -990,7 +1084,158 @@ class wirelessLink (object):
         if loss > 0.1:
             loss = "loss %.1f%% " % loss
             cmd += loss
-        node.pexec(cmd)
+        return cmd
+
+    @classmethod
+    def apply(cls, node, iface, bw, loss, latency):
+        """Applies netem settings if they have changed
+        :param node: node
+        :param iface: interface
+        :param bw: bandwidth (mbps)
+        :param loss: loss (%)
+        :param latency: latency (ms)"""
+        cmd = cls.get_cmd(iface, bw, loss, latency)
+        # the node lock keeps the lines written to the tc process in the
+        # order they are recorded, while the reader thread of its errors
+        # only needs cls.lock, which is released before writing
+        with cls.get_node_lock(node):
+            with cls.lock:
+                if cls.applied.get((node, iface)) == cmd:
+                    cls.skipped += 1
+                    return
+                cls.applied[(node, iface)] = cmd
+                proc = cls.get_process(node)
+                if proc:
+                    cls.add_written(node, iface, cmd)
+            if proc:
+                try:
+                    proc.stdin.write((cmd + '\n').encode())
+                    pending = getattr(cls.local, 'nodes', None)
+                    if pending is None:
+                        proc.stdin.flush()
+                    else:
+                        pending.add(node)
+                    return
+                except (IOError, OSError, ValueError):
+                    with cls.lock:
+                        cls.procs.pop(node, None)
+        _, err, exitcode = node.pexec('tc ' + cmd)
+        if exitcode:
+            error('*** tc %s: %s\n' % (cmd.strip(), err.strip()))
+            cls.failed(node, iface, cmd)
+
+    @classmethod
+    def get_node_lock(cls, node):
+        with cls.lock:
+            if node not in cls.node_locks:
+                cls.node_locks[node] = threading.Lock()
+            return cls.node_locks[node]
+
+    @classmethod
+    def add_written(cls, node, iface, cmd):
+        "Records the line of the batch cmd was written to"
+        written = cls.written.setdefault(node, {'lines': 0})
+        written['lines'] += 1
+        line = written['lines']
+        written[line] = (iface, cmd)
+        written.pop(line - cls.max_written, None)
+
+    @classmethod
+    def failed(cls, node, iface, cmd):
+        "Drops cmd from the cache, so that it is applied again next time"
+        with cls.lock:
+            if cls.applied.get((node, iface)) == cmd:
+                del cls.applied[(node, iface)]
+
+    @classmethod
+    def read_errors(cls, node, proc):
+        """Reads the errors of the tc process of node. tc reports
+        'Command failed -:<line>' after the message of each failed command"""
+        reason = ''
+        for line in iter(proc.stderr.readline, b''):
+            line = line.decode(errors='replace').strip()
+            match = re.match(r'Command failed -:(\d+)', line)
+            if not match:
+                reason = line
+                continue
+            with cls.lock:
+                written = cls.written.get(node, {})
+                entry = written.get(int(match.group(1)))
+            if entry:
+                iface, cmd = entry
+                error('*** tc %s: %s\n' % (cmd.strip(), reason))
+                cls.failed(node, iface, cmd)
+            reason = ''
+
+    @classmethod
+    def get_process(cls, node):
+        "Returns the tc process of node, starting it if needed"
+        if not cls.use_batch:
+            return None
+        proc = cls.procs.get(node)
+        if proc and proc.poll() is None:
+            return proc
+        try:
+            proc = node.popen('tc -force -batch -', stdin=subprocess.PIPE,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        except Exception:
+            debug('tc -batch is not available: using tc commands\n')
+            cls.use_batch = False
+            return None
+        cls.procs[node] = proc
+        cls.written[node] = {'lines': 0}
+        reader = threading.Thread(target=cls.read_errors, args=(node, proc))
+        reader.daemon = True
+        reader.start()
+        return proc
+
+    @classmethod
+    def start_batch(cls):
+        "Delays flushing the commands of the current thread until flush"
+        cls.local.nodes = set()
+
+    @classmethod
+    def flush(cls):
+        "Flushes the commands written since start_batch"
+        nodes = getattr(cls.local, 'nodes', None) or set()
+        cls.local.nodes = None
+        for node in nodes:
+            with cls.get_node_lock(node):
+                with cls.lock:
+                    proc = cls.procs.get(node)
+                if proc:
+                    try:
+                        proc.stdin.flush()
+                    except (IOError, OSError, ValueError):
+                        with cls.lock:
+                            cls.procs.pop(node, None)
+
+    @classmethod
+    def forget(cls, node, iface=None):
+        """Forgets the settings applied to node, e.g. after its qdisc has
+        been changed by other means"""
+        with cls.lock:
+            for key in list(cls.applied):
+                if key[0] == node and (iface is None or key[1] == iface):
+                    del cls.applied[key]
+
+    @classmethod
+    def stop(cls):
+        "Stops the tc processes"
+        with cls.lock:
+            procs = list(cls.procs.values())
+            cls.procs = {}
+            cls.node_locks = {}
+        for proc in procs:
+            try:
+                proc.stdin.close()
+                proc.wait()
+            except (IOError, OSError, ValueError):
+                pass
+        with cls.lock:
+            cls.written = {}
+            cls.applied = {}
 
 
 class ITSLink(IntfWireless):
@@ -1010,6 +1255,7 @@ class ITSLink(IntfWireless):
 
         node.params['channel'][wif] = channel
         node.func[wif] = 'its'
+        node.clear_freq(wif)
         node.params['freq'][wif] = node.get_freq(wif)
         self.name = intf
         self.set_ocb_mode()
@@ -1350,6 +1596,7 @@ class Association(IntfWireless):
     def updateParams(cls, sta, ap, wif):
         sta.params['freq'][wif] = ap.get_freq(0)
         sta.params['channel'][wif] = ap.params['channel'][0]
+        sta.clear_freq(wif)
         sta.params['mode'][wif] = ap.params['mode'][0]
 
     @classmethod
@@ -1381,6 +1628,17 @@ class Association(IntfWireless):
         node.params['rssi'][wif] = 0
         node.params['associatedTo'][wif] = ''
         node.params['channel'][wif] = 0
+        cls.forget_rssi(node, wif)
+
+    @staticmethod
+    def forget_rssi(sta, wif):
+        """Forgets the rssi of the last link update of wif, so that the
+        link of a new association is always updated (see
+        mobility.has_rssi_changed)"""
+        last_rssi = getattr(sta, 'lastRssi', {})
+        for key in list(last_rssi):
+            if key[1] == wif:
+                del last_rssi[key]
 
     @classmethod
     def associate_infra(cls, sta, ap, **params):
@@ -1518,4 +1776,6 @@ class Association(IntfWireless):
                 sta.params['associatedTo'][wif].params['assocStas'].remove(sta)
             cls.updateParams(sta, ap, wif)
             ap.params['assocStas'].append(sta)
+            if sta.params['associatedTo'][wif] != ap:
+                cls.forget_rssi(sta, wif)
             sta.params['associatedTo'][wif] = ap
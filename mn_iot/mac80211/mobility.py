@@ -1,17 +1,19 @@
 """Mininet-WiFi: A simple networking testbed for Wireless OpenFlow/SDWN!
    author: Ramon Fontes (ramonrf@dca.fee.unicamp.br)"""
 
-from threading import Thread as thread
+from threading import Thread as thread, Condition, Event
 from time import sleep, time
 import os
+import math
 import numpy as np
 from numpy.random import rand
 
 from mininet.log import debug, info
-from mn_iot.mac80211.link import wirelessLink, Association
+from mn_iot.mac80211.link import wirelessLink, Association, linkShaper
 from mn_iot.mac80211.associationControl import associationControl
 from mn_iot.mac80211.plot import plot2d, plot3d, plotGraph
-from mn_iot.mac80211.wmediumdConnector import w_cst, wmediumd_mode
+from mn_iot.mac80211.propagationModels import propagationMatrix
+from mn_iot.mac80211.wmediumdConnector import w_cst, wmediumd_mode, w_server
 
 
 class mobility(object):
@@ -25,6 +27,17 @@ class mobility(object):
     thread_ = None
     end_time = 0
     func = ['mesh', 'adhoc', 'its']
+    dirty = set()  # nodes whose links have to be reconfigured
+    cond = Condition()
+    resumed = Event()
+    resumed.set()
+    running = False  # whether the wifiParameters thread is running
+    max_rate = 10  # max number of link reconfigurations per second
+    # changes smaller than these are not propagated. They can also be set
+    # per node with the min_move and min_rssi params
+    min_move = 0  # meters
+    min_rssi = 0  # dB
+    suppressed = {'position': 0, 'wmediumd': 0, 'tc': 0, 'plot': 0}
 
     @classmethod
     def move_factor(cls, node, diff_time):
@@ -84,17 +97,83 @@ class mobility(object):
         diff_time = node.endTime - node.startTime
         node.moveFac = cls.move_factor(node, diff_time)
 
+    @classmethod
+    def set_params(cls, **kwargs):
+        "Sets max_rate, min_move and min_rssi"
+        for arg in ['max_rate', 'min_move', 'min_rssi']:
+            if arg in kwargs:
+                setattr(cls, arg, float(kwargs[arg]))
+
+    @classmethod
+    def get_threshold(cls, node, param):
+        return float(node.params.get(param, getattr(cls, param)))
+
+    @classmethod
+    def has_moved(cls, node, pos):
+        "Whether node has moved more than min_move since the last update"
+        min_move = cls.get_threshold(node, 'min_move')
+        last_pos = getattr(node, 'lastMovedPos', None)
+        if min_move and last_pos is not None:
+            dist = math.sqrt(sum([(float(pos[n]) - float(last_pos[n])) ** 2
+                                  for n in range(3)]))
+            if dist <= min_move:
+                return False
+        node.lastMovedPos = pos
+        return True
+
+    @classmethod
+    def has_rssi_changed(cls, sta, ap, wif, rssi):
+        "Whether rssi has changed more than min_rssi since the last update"
+        min_rssi = cls.get_threshold(sta, 'min_rssi')
+        if not hasattr(sta, 'lastRssi'):
+            sta.lastRssi = {}
+        last_rssi = sta.lastRssi.get((ap, wif))
+        if min_rssi and last_rssi is not None \
+                and abs(rssi - last_rssi) <= min_rssi:
+            return False
+        sta.lastRssi[(ap, wif)] = rssi
+        return True
+
     @classmethod
     def set_pos(cls, node, pos):
+        """Sets the position of node. Returns False if the movement is
+        below min_move and has not been propagated"""
         node.params['position'] = pos
+        spatialIndex.update(node)
+        if not cls.has_moved(node, pos):
+            cls.suppressed['position'] += 1
+            if wmediumd_mode.mode == w_cst.INTERFERENCE_MODE:
+                cls.suppressed['wmediumd'] += 1
+            return False
         if wmediumd_mode.mode == w_cst.INTERFERENCE_MODE \
                 and mobility.thread_._keep_alive:
             node.set_pos_wmediumd(pos)
+        cls.set_dirty([node])
+        return True
+
+    @classmethod
+    def set_dirty(cls, nodes):
+        "Marks nodes whose links have to be reconfigured"
+        with cls.cond:
+            cls.dirty.update(nodes)
+            cls.cond.notify_all()
+
+    @classmethod
+    def pause(cls):
+        "Pauses the mobility models"
+        cls.pause_simulation = True
+        cls.resumed.clear()
+
+    @classmethod
+    def resume(cls):
+        "Resumes the mobility models"
+        cls.pause_simulation = False
+        cls.resumed.set()
 
     @classmethod
     def set_wifi_params(cls):
         "Opens a thread for wifi parameters"
-        if cls.allAutoAssociation:
+        if cls.allAutoAssociation and not cls.running:
             thread_ = thread(name='wifiParameters', target=cls.parameters)
             thread_.daemon = True
             thread_.start()
@@ -153,7 +232,7 @@ class mobility(object):
     @classmethod
     def ap_in_range(cls, sta, ap, wif, dist):
         "When ap is in range"
-        rssi = sta.get_rssi(ap, wif, dist)
+        rssi = linkState.get_rssi(sta, ap, wif, dist)
         sta.params['apsInRange'][ap] = rssi
         ap.params['stasInRange'][sta] = rssi
         if ap == sta.params['associatedTo'][wif]:
@@ -164,6 +243,11 @@ class mobility(object):
                 if 'bgscan_threshold' in sta.params or 'active_scan' in sta.params \
                 and ('encrypt' in sta.params and 'wpa' in sta.params['encrypt'][wif]):
                     pass
+                elif not cls.has_rssi_changed(sta, ap, wif, rssi):
+                    if wmediumd_mode.mode == w_cst.WRONG_MODE:
+                        cls.suppressed['tc'] += 1
+                    elif wmediumd_mode.mode == w_cst.SNR_MODE:
+                        cls.suppressed['wmediumd'] += 1
                 else:
                     if wmediumd_mode.mode != w_cst.WRONG_MODE:
                         if wmediumd_mode.mode == w_cst.SNR_MODE:
@@ -174,7 +258,7 @@ class mobility(object):
 
     @classmethod
     def check_in_range(cls, sta, ap, wif, ap_wif):
-        dist = sta.get_distance_to(ap)
+        dist = linkState.get_distance(sta, ap, wif)
         if dist > ap.params['range'][0]:
             cls.ap_out_of_range(sta, ap, wif, ap_wif)
             return 0
@@ -184,7 +268,7 @@ class mobility(object):
     @classmethod
     def set_handover(cls, sta, aps, wif, ap_wif):
         for ap in aps:
-            dist = sta.get_distance_to(ap)
+            dist = linkState.get_distance(sta, ap, wif)
             cls.do_handover(sta, ap, wif, ap_wif)
             cls.ap_in_range(sta, ap, wif, dist)
 
@@ -203,23 +287,67 @@ class mobility(object):
 
     @classmethod
     def configLinks(cls, node=None):
-        "Applies channel params and handover"
+        """Applies channel params and handover. If the wifiParameters
+        thread is running, it is done by the thread"""
         from mn_iot.mac80211.node import AP
         if node:
             if isinstance(node, AP) or node in cls.aps:
-                nodes = cls.stations
+                spatialIndex.update(node)
+                nodes = [node]
+                if not cls.running:
+                    nodes = cls.stations
             else:
                 nodes = [node]
         else:
             nodes = cls.stations
-        cls.configureLinks(nodes)
+        if cls.running:
+            cls.set_dirty(nodes)
+        else:
+            cls.configureLinks(nodes)
+
+    @classmethod
+    def get_neighbours(cls, ap):
+        "Returns the stations which may be affected by changes in ap"
+        stas = set(ap.params['stasInRange']) | set(ap.params['assocStas'])
+        if 'position' in ap.params:
+            dist = max(ap.params['range']) if ap.params['range'] else 0
+            for sta in cls.stations:
+                if sta not in stas and 'position' in sta.params \
+                        and sta.get_distance_to(ap) <= dist:
+                    stas.add(sta)
+        return stas
+
+    @classmethod
+    def get_dirty_nodes(cls):
+        "Waits for nodes to be marked as dirty and returns them"
+        with cls.cond:
+            while not cls.dirty and mobility.thread_._keep_alive:
+                cls.cond.wait(1)
+            dirty, cls.dirty = cls.dirty, set()
+        nodes = set()
+        for node in dirty:
+            if node in cls.aps:
+                nodes.update(cls.get_neighbours(node))
+            elif node in cls.stations or node in cls.mobileNodes:
+                nodes.add(node)
+        return [node for node in cls.stations if node in nodes] + \
+               [node for node in nodes if node not in cls.stations]
 
     @classmethod
     def parameters(cls):
-        "Applies channel params and handover"
-        mobileNodes = list(set(cls.mobileNodes) - set(cls.aps))
-        while mobility.thread_._keep_alive:
-            cls.configureLinks(mobileNodes)
+        "Applies channel params and handover to the nodes marked as dirty"
+        cls.running = True
+        cls.set_dirty(set(cls.mobileNodes) - set(cls.aps))
+        try:
+            while mobility.thread_._keep_alive:
+                nodes = cls.get_dirty_nodes()
+                start = time()
+                if nodes:
+                    cls.configureLinks(nodes)
+                if cls.max_rate:
+                    sleep(max(0, 1.0 / cls.max_rate - (time() - start)))
+        finally:
+            cls.running = False
 
     @classmethod
     def associate_interference_mode(cls, node, ap, wif, ap_wif):
@@ -237,15 +365,35 @@ class mobility(object):
             ack = cls.check_in_range(node, ap, wif, ap_wif)
             return ack
 
+    @classmethod
+    def get_aps_nearby(cls, node, wif):
+        """Returns the aps that have to be checked against node:
+        aps in the neighbouring cells plus the ones node already knows"""
+        if 'bgscan_threshold' in node.params or 'active_scan' in node.params:
+            return cls.aps
+        aps = set(spatialIndex.nearby(node))
+        aps.update(node.params['apsInRange'])
+        ap = node.params['associatedTo'][wif]
+        if ap in spatialIndex.order:
+            aps.add(ap)
+        aps = [ap for ap in aps if ap in spatialIndex.order]
+        if len(aps) < len(cls.aps) and not node.params['associatedTo'][wif]:
+            # there are aps out of range
+            node.params['rssi'][wif] = 0
+        return sorted(aps, key=spatialIndex.order.get)
+
     @classmethod
     def configureLinks(cls, nodes):
+        spatialIndex.sync(cls.aps)
+        linkState.update(nodes, cls.aps)
+        linkShaper.start_batch()
         for node in nodes:
             for wif in range(len(node.params['wif'])):
                 if node.func[wif] in cls.func:
                     pass
                 else:
                     aps = []
-                    for ap in cls.aps:
+                    for ap in cls.get_aps_nearby(node, wif):
                         for ap_wif in range(len(ap.params['wif'])):
                             if ap.func[ap_wif] not in cls.func:
                                 if wmediumd_mode.mode == w_cst.INTERFERENCE_MODE:
@@ -255,7 +403,154 @@ class mobility(object):
                                 if ack and ap not in aps:
                                     aps.append(ap)
                     cls.set_handover(node, aps, wif, ap_wif=0)
-        sleep(0.0001)
+        linkShaper.flush()
+
+
+class spatialIndex(object):
+    """Uniform grid of aps keyed on their position. The cell size is the
+    largest ap range, so the aps which may reach a node are always in
+    the cell of the node or in one of its neighbouring cells"""
+    aps = []
+    order = {}  # ap -> index in mobility.aps
+    grid = {}  # cell -> list of aps
+    cells = {}  # ap -> cell
+    unplaced = []  # aps without position
+    size = 0
+
+    @classmethod
+    def get_size(cls, aps):
+        size = 0
+        for ap in aps:
+            if 'range' in ap.params and ap.params['range']:
+                size = max(size, max(float(r) for r in ap.params['range']))
+        return size or 1
+
+    @classmethod
+    def get_cell(cls, pos):
+        return (int(math.floor(float(pos[0]) / cls.size)),
+                int(math.floor(float(pos[1]) / cls.size)),
+                int(math.floor(float(pos[2]) / cls.size)))
+
+    @classmethod
+    def build(cls, aps):
+        "Builds the grid from scratch"
+        cls.aps = list(aps)
+        cls.order = dict((ap, idx) for idx, ap in enumerate(aps))
+        cls.grid, cls.cells, cls.unplaced = {}, {}, []
+        cls.size = cls.get_size(aps)
+        for ap in aps:
+            cls.add(ap)
+
+    @classmethod
+    def sync(cls, aps):
+        "Rebuilds the grid if the list of aps has changed"
+        if aps != cls.aps:
+            cls.build(aps)
+
+    @classmethod
+    def add(cls, ap):
+        if 'position' not in ap.params:
+            cls.unplaced.append(ap)
+            return
+        cell = cls.get_cell(ap.params['position'])
+        cls.cells[ap] = cell
+        cls.grid.setdefault(cell, []).append(ap)
+
+    @classmethod
+    def remove(cls, ap):
+        if ap in cls.unplaced:
+            cls.unplaced.remove(ap)
+        cell = cls.cells.pop(ap, None)
+        if cell is not None:
+            cls.grid[cell].remove(ap)
+            if not cls.grid[cell]:
+                del cls.grid[cell]
+
+    @classmethod
+    def update(cls, node):
+        "Moves node to its new cell. Nodes not indexed are ignored"
+        if node not in cls.cells and node not in cls.unplaced:
+            return
+        if cls.get_size([node]) > cls.size:
+            cls.build(cls.aps)
+        elif 'position' in node.params and \
+                cls.cells.get(node) != cls.get_cell(node.params['position']):
+            cls.remove(node)
+            cls.add(node)
+
+    @classmethod
+    def nearby(cls, node):
+        "Returns the aps in the cell of node and in the neighbouring cells"
+        aps = list(cls.unplaced)
+        if 'position' not in node.params:
+            return aps + list(cls.cells)
+        x, y, z = cls.get_cell(node.params['position'])
+        for i in (x - 1, x, x + 1):
+            for j in (y - 1, y, y + 1):
+                for k in (z - 1, z, z + 1):
+                    if (i, j, k) in cls.grid:
+                        aps += cls.grid[(i, j, k)]
+        return aps
+
+
+class linkState(object):
+    """Distance and rssi of every (station, ap) pair, computed at once
+    with numpy. Rows are (station, wif) and columns are aps"""
+    # rows: (sta, wif) -> row, cols: ap -> column, dist and rssi matrices
+    state = ({}, {}, None, None)
+
+    @classmethod
+    def update(cls, nodes, aps):
+        "Gathers node params into arrays and computes dist and rssi matrices"
+        rows, cols = {}, {}
+        try:
+            pos, freq, gr, hr = [], [], [], []
+            for node in nodes:
+                if 'position' not in node.params:
+                    continue
+                for wif in range(len(node.params['wif'])):
+                    rows[(node, wif)] = len(pos)
+                    pos.append(node.params['position'][:3])
+                    freq.append(node.params['freq'][wif])
+                    gr.append(node.params['antennaGain'][wif])
+                    hr.append(node.params['antennaHeight'][wif])
+            ap_pos, pt, gt, ht = [], [], [], []
+            for ap in aps:
+                if 'position' not in ap.params:
+                    continue
+                cols[ap] = len(ap_pos)
+                ap_pos.append(ap.params['position'][:3])
+                pt.append(ap.params['txpower'][0])
+                gt.append(ap.params['antennaGain'][0])
+                ht.append(ap.params['antennaHeight'][0])
+            if not pos or not ap_pos:
+                cls.state = ({}, {}, None, None)
+                return
+            col = lambda values: np.array(values, dtype=float)[:, np.newaxis]
+            row = lambda values: np.array(values, dtype=float)[np.newaxis, :]
+            diff = np.array(pos, dtype=float)[:, np.newaxis, :] - \
+                   np.array(ap_pos, dtype=float)[np.newaxis, :, :]
+            dist = np.round(np.sqrt((diff ** 2).sum(axis=2)), 2)
+            rssi = propagationMatrix.rssi(dist, col(freq), col(gr), col(hr),
+                                          row(pt), row(gt), row(ht))
+            cls.state = (rows, cols, dist, rssi)
+        except (KeyError, IndexError, TypeError, ValueError):
+            # nodes not fully configured: per-pair calculation is used
+            cls.state = ({}, {}, None, None)
+
+    @classmethod
+    def get_distance(cls, sta, ap, wif):
+        rows, cols, dist, _ = cls.state
+        if (sta, wif) in rows and ap in cols:
+            return float(dist[rows[(sta, wif)], cols[ap]])
+        return sta.get_distance_to(ap)
+
+    @classmethod
+    def get_rssi(cls, sta, ap, wif, dist):
+        rows, cols, _, rssi = cls.state
+        if (sta, wif) in rows and ap in cols:
+            return float(rssi[rows[(sta, wif)], cols[ap]])
+        return sta.get_rssi(ap, wif, dist)
 
 
 class model(mobility):
@@ -265,6 +560,7 @@ class model(mobility):
 
     def start_thread(self, **kwargs):
         debug('Starting mobility thread...\n')
+        mobility.set_params(**kwargs)
         mobility.thread_ = thread(name='mobModel', target=self.models,
                                   kwargs=dict(kwargs, ))
         mobility.thread_.daemon = True
@@ -349,9 +645,7 @@ class model(mobility):
             else:
                 raise Exception("Mobility Model not defined or doesn't exist!")
 
-            current_time = time()
-            while (time() - current_time) < kwargs['time']:
-                pass
+            sleep(kwargs['time'])
 
             self.start_mob_mod(mob, kwargs['nodes'], kwargs['DRAW'])
 
@@ -361,19 +655,24 @@ class model(mobility):
         :param nodes: list of nodes
         """
         for xy in mob:
-            for idx, node in enumerate(nodes):
-                pos = round(xy[idx][0], 2), \
-                      round(xy[idx][1], 2), \
-                      0.0
-                mobility.set_pos(node, pos)
-                if graph:
-                    plot2d.update(node)
+            w_server.start_batch()
+            try:
+                for idx, node in enumerate(nodes):
+                    pos = round(xy[idx][0], 2), \
+                          round(xy[idx][1], 2), \
+                          0.0
+                    if not mobility.set_pos(node, pos):
+                        if graph:
+                            mobility.suppressed['plot'] += 1
+                    elif graph:
+                        plot2d.update(node)
+            finally:
+                w_server.flush_batch()
             if graph:
                 plot2d.pause()
             else:
                 sleep(0.5)
-            while mobility.pause_simulation:
-                pass
+            mobility.resumed.wait()
 
 
 class tracked(mobility):
@@ -385,6 +684,7 @@ class tracked(mobility):
 
     def start_thread(self, **kwargs):
         debug('Starting mobility thread...\n')
+        mobility.set_params(**kwargs)
         mobility.thread_ = thread(target=self.configure, kwargs=(kwargs))
         mobility.thread_.daemon = True
         mobility.thread_._keep_alive = True
@@ -446,24 +746,34 @@ class tracked(mobility):
                         mobility.thread_._keep_alive = False
                 if (t2 - t1) >= kwargs['init_time']:
                     if t2 - t1 >= i:
-                        for node in mobility.mobileNodes:
-                            if (t2 - t1) >= node.startTime and node.time <= node.endTime:
-                                if hasattr(node, 'coord'):
-                                    node.matrix_id += 1
-                                    if node.matrix_id < len(node.points):
-                                        pos = node.points[node.matrix_id]
+                        w_server.start_batch()
+                        try:
+                            for node in mobility.mobileNodes:
+                                moved = True
+                                if (t2 - t1) >= node.startTime and node.time <= node.endTime:
+                                    if hasattr(node, 'coord'):
+                                        node.matrix_id += 1
+                                        if node.matrix_id < len(node.points):
+                                            pos = node.points[node.matrix_id]
+                                        else:
+                                            pos = node.points[len(node.points) - 1]
                                     else:
-                                        pos = node.points[len(node.points) - 1]
-                                else:
-                                    pos = self.move_node(node)
-                                mobility.set_pos(node, pos)
-                                node.time += 1
-                            if kwargs['DRAW']:
-                                plot.update(node)
-                                if kwargs['max_z'] == 0:
-                                    plot2d.updateCircleRadius(node)
+                                        pos = self.move_node(node)
+                                    moved = mobility.set_pos(node, pos)
+                                    node.time += 1
+                                if kwargs['DRAW'] and not moved:
+                                    mobility.suppressed['plot'] += 1
+                                elif kwargs['DRAW']:
+                                    plot.update(node)
+                                    if kwargs['max_z'] == 0:
+                                        plot2d.updateCircleRadius(node)
+                        finally:
+                            w_server.flush_batch()
                         plot.pause()
                         i += 1
+                # sleeps until the next step
+                next_step = min(max(i, kwargs['init_time']), mobility.end_time)
+                sleep(max(next_step - (time() - t1), 0.001))
 
     def move_node(self, node):
         x = round(node.params['position'][0], 2) + round(node.moveFac[0], 2)
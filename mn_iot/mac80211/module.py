@@ -6,6 +6,7 @@ import os
 import re
 import subprocess
 import logging
+from multiprocessing.pool import ThreadPool
 from sys import version_info as py_version_info
 from mininet.log import debug, info, error
 
@@ -16,6 +17,7 @@ class module(object):
     prefix = ""
     externally_managed = False
     devices_created_dynamically = False
+    max_workers = 16  # parallel hwsim_mgmt and iw processes at startup
 
     def __init__(self, nodes, n_radios, alt_module, **params):
         self.start(nodes, n_radios, alt_module, **params)
@@ -73,18 +75,9 @@ class module(object):
     def __create_hwsim_mgmt_devices(self, n_radios, nodes, **params):
         # generate prefix
         num = 0
-        hwsim_ids = []
         numokay = False
         self.prefix = ""
-        cmd = "find /sys/kernel/debug/ieee80211 " \
-              "-name hwsim | cut -d/ -f 6 | sort"
-
-        if py_version_info < (3, 0):
-            phys = subprocess.check_output\
-                (cmd, shell=True).split("\n")
-        else:
-            phys = subprocess.check_output\
-                (cmd, shell=True).decode('utf-8').split("\n")
+        phys = self.get_hwsim_phys()
 
         while not numokay:
             self.prefix = "mn%02ds" % num
@@ -99,52 +92,101 @@ class module(object):
             self.docker_config(n_radios=n_radios, nodes=nodes, num=num, **params)
         else:
             try:
-                for i in range(0, n_radios):
-                    p = subprocess.Popen(["hwsim_mgmt", "-c", "-n", self.prefix +
-                                          ("%02d" % i)], stdin=subprocess.PIPE,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE, bufsize=-1)
-                    output, err_out = p.communicate()
-                    if p.returncode == 0:
-                        if py_version_info < (3, 0):
-                            m = re.search("ID (\d+)", output)
-                        else:
-                            m = re.search("ID (\d+)", output.decode())
-                        debug("Created mac80211_hwsim device with ID %s\n" % m.group(1))
-                        hwsim_ids.append(m.group(1))
-                    else:
-                        error("\nError on creating mac80211_hwsim device with name %s"
-                              % (self.prefix + ("%02d" % i)))
-                        error("\nOutput: %s" % output)
-                        error("\nError: %s" % err_out)
+                names = [self.prefix + ("%02d" % i) for i in range(n_radios)]
+                self.run_parallel(self.create_hwsim_device, names)
             except:
                 info("Warning! If you already had Mininet-WiFi installed "
                      "please run util/install.sh -W and then sudo make install.\n")
 
+    @classmethod
+    def run_parallel(cls, func, args):
+        """Calls func for each item of args with at most max_workers
+        threads. func must not share state between calls
+        :return: list of results, in the order of args"""
+        if len(args) < 2:
+            return [func(arg) for arg in args]
+        pool = ThreadPool(min(cls.max_workers, len(args)))
+        try:
+            return pool.map(func, args)
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def create_hwsim_device(name):
+        """Creates a mac80211_hwsim radio. Radios are matched to interfaces
+        by phy name, so they may be created in any order
+        :param name: name of the phy"""
+        p = subprocess.Popen(["hwsim_mgmt", "-c", "-n", name],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, bufsize=-1)
+        output, err_out = p.communicate()
+        if p.returncode == 0:
+            if py_version_info < (3, 0):
+                m = re.search("ID (\d+)", output)
+            else:
+                m = re.search("ID (\d+)", output.decode())
+            debug("Created mac80211_hwsim device with ID %s\n" % m.group(1))
+            return m.group(1)
+        error("\nError on creating mac80211_hwsim device with name %s" % name)
+        error("\nOutput: %s" % output)
+        error("\nError: %s" % err_out)
+
+    @staticmethod
+    def get_hwsim_phys():
+        "Gets the sorted names of the mac80211_hwsim phys"
+        debugfs = '/sys/kernel/debug/ieee80211'
+        if os.path.isdir(debugfs):
+            return sorted(phy for phy in os.listdir(debugfs)
+                          if os.path.isdir(os.path.join(debugfs, phy, 'hwsim')))
+        # debugfs is not mounted: check the driver of each phy
+        phys = []
+        sysfs = '/sys/class/ieee80211'
+        if os.path.isdir(sysfs):
+            for phy in os.listdir(sysfs):
+                driver = os.path.realpath(os.path.join(sysfs, phy,
+                                                       'device', 'driver'))
+                if os.path.basename(driver) == 'mac80211_hwsim':
+                    phys.append(phy)
+        return sorted(phys)
+
+    @staticmethod
+    def get_wireless_ifaces():
+        """Gets the wireless interfaces of the root namespace with a single
+        scan of /sys/class/net
+        :return: dict of interface -> phy"""
+        ifaces = {}
+        sysfs = '/sys/class/net'
+        for iface in os.listdir(sysfs):
+            try:
+                with open(os.path.join(sysfs, iface, 'phy80211', 'name')) as f:
+                    ifaces[iface] = f.read().strip()
+            except (IOError, OSError):
+                pass
+        return ifaces
+
+    @staticmethod
+    def get_rfkill_ids():
+        """Gets the rfkill switch of each phy
+        :return: dict of phy -> rfkill id"""
+        ids = {}
+        sysfs = '/sys/class/rfkill'
+        if os.path.isdir(sysfs):
+            for rfkill in os.listdir(sysfs):
+                try:
+                    with open(os.path.join(sysfs, rfkill, 'name')) as f:
+                        ids[f.read().strip()] = rfkill.replace('rfkill', '')
+                except (IOError, OSError):
+                    pass
+        return ids
+
     def get_physical_wif(self):
         'Gets the list of physical wifs that already exist'
-        if py_version_info < (3, 0):
-            wifs = (subprocess.check_output("iw dev 2>&1 | grep Interface "
-                                                 "| awk '{print $2}'",
-                                                 shell=True)).split("\n")
-        else:
-            wifs = (subprocess.check_output("iw dev 2>&1 | grep Interface "
-                                                 "| awk '{print $2}'",
-                                                 shell=True)).decode('utf-8').split("\n")
-        wifs.pop()
-        return wifs
+        return list(self.get_wireless_ifaces())
 
     def get_phy(self):
         'Gets all phys after starting the wireless module'
-        if py_version_info < (3, 0):
-            phy = subprocess.check_output("find /sys/kernel/debug/ieee80211 -name "
-                                          "hwsim | cut -d/ -f 6 | sort",
-                                          shell=True).split("\n")
-        else:
-            phy = subprocess.check_output("find /sys/kernel/debug/ieee80211 -name "
-                                          "hwsim | cut -d/ -f 6 | sort",
-                                          shell=True).decode('utf-8').split("\n")
-        phy.pop()
+        phy = self.get_hwsim_phys()
         phy.sort(key=len, reverse=False)
         return phy
 
@@ -196,6 +238,20 @@ class module(object):
         os.system("ssh %s@%s \'chmod +x %s%s; %s%s\'"
                   % (params['ssh_user'], ip, dir, file, dir, file))
 
+    @staticmethod
+    def move_phy(args):
+        """Unblocks a phy and moves it to the namespace of a node
+        :param args: phy, pid of the node and rfkill id of the phy"""
+        phy, pid, rfkill = args
+        if rfkill is not None:
+            debug('rfkill unblock %s\n' % rfkill)
+            try:
+                with open('/sys/class/rfkill/rfkill%s/soft' % rfkill, 'w') as f:
+                    f.write('0')
+            except (IOError, OSError):
+                os.system('rfkill unblock %s' % rfkill)
+        os.system('iw phy %s set netns %s' % (phy, pid))
+
     def rename(self, node, wintf, newname):
         "Rename interface"
         node.pexec('ip link set %s down' % wintf)
@@ -224,43 +280,47 @@ class module(object):
                 for phy in range(0, len(phys)):
                     wif_list.append('wif%s' % phy)
             else:
-                wif_list = self.get_wif_iface(physicalwifs)
+                wif_list = self.get_wif_iface(physicalwifs, phys)
             if ifb:
                 self.load_ifb(len(wif_list))
                 ifbID = 0
             debug("\n*** Configuring interfaces with appropriated network"
                   "-namespaces...\n")
             phyID = 0
+            radios = {}  # node -> list of (wif, phy, interface, ifb ID)
             for node in nodes:
                 if ifb:
                     node.ifb = []
+                radios[node] = []
                 for wif in range(0, len(node.params['wif'])):
                     node.phyID[wif] = phyID
                     phyID += 1
+                    radio = [wif, phys.pop(0), wif_list.pop(0), None]
+                    if ifb and not (isinstance(node, AP) and
+                                    'inNamespace' not in node.params):
+                        radio[3] = ifbID
+                        ifbID += 1
+                    radios[node].append(radio)
+
+            if 'docker' not in params:
+                rfkill = self.get_rfkill_ids()
+                moves = [(phy, node.pid, rfkill.get(phy))
+                         for node in nodes for _, phy, _, _ in radios[node]
+                         if not isinstance(node, AP)
+                         or 'inNamespace' in node.params]
+                self.run_parallel(self.move_phy, moves)
+
+            def config_node(node):
+                for wif, _, iface, ifb_id in radios[node]:
                     if isinstance(node, AP) and 'inNamespace' not in node.params:
-                        self.rename(node, wif_list[0], node.params['wif'][wif])
+                        self.rename(node, iface, node.params['wif'][wif])
                     else:
-                        if 'docker' not in params:
-                            if py_version_info < (3, 0):
-                                rfkill = subprocess.check_output(
-                                    'rfkill list | grep %s | awk \'{print $1}\''
-                                    '| tr -d ":"' % phys[0], shell=True).split('\n')
-                            else:
-                                rfkill = subprocess.check_output(
-                                    'rfkill list | grep %s | awk \'{print $1}\''
-                                    '| tr -d ":"' % phys[0],
-                                    shell=True).decode('utf-8').split('\n')
-                            debug('rfkill unblock %s\n' % rfkill[0])
-                            os.system('rfkill unblock %s' % rfkill[0])
-                            os.system('iw phy %s set netns %s' % (phys[0], node.pid))
-                        node.cmd('ip link set %s down' % wif_list[0])
+                        node.cmd('ip link set %s down' % iface)
                         node.cmd('ip link set %s name %s'
-                                 % (wif_list[0], node.params['wif'][wif]))
-                        if ifb:
-                            node.ifbSupport(wif, ifbID)  # Adding Support to IFB
-                            ifbID += 1
-                    wif_list.pop(0)
-                    phys.pop(0)
+                                 % (iface, node.params['wif'][wif]))
+                        if ifb_id is not None:
+                            node.ifbSupport(wif, ifb_id)  # Adding Support to IFB
+            self.run_parallel(config_node, nodes)
         except:
             logging.exception("Warning:")
             info("Warning! Error when loading mac80211_hwsim. "
@@ -275,22 +335,20 @@ class module(object):
                             format='%(asctime)s - %(levelname)s - %(message)s',
                            )
 
-    def get_wif_iface(self, physicalwif):
+    def get_wif_iface(self, physicalwif, phys=None):
         """Build a new wif list removing the physical wif
 
-        :param physicalwifs: list of Physical wifs"""
+        :param physicalwifs: list of Physical wifs
+        :param phys: list of phys. If given, the wif of each phy is
+        returned in the same order"""
+        ifaces = self.get_wireless_ifaces()
+        if phys:
+            phy_ifaces = dict((phy, iface) for iface, phy in ifaces.items()
+                              if iface not in physicalwif)
+            if all(phy in phy_ifaces for phy in phys):
+                return [phy_ifaces[phy] for phy in phys]
         wif_list = []
-
-        if py_version_info < (3, 0):
-            iface_list = subprocess.check_output("iw dev 2>&1 | grep Interface | "
-                                                 "awk '{print $2}'",
-                                                 shell=True).split('\n')
-
-        else:
-            iface_list = subprocess.check_output("iw dev 2>&1 | grep Interface | "
-                                                 "awk '{print $2}'",
-                                                 shell=True).decode('utf-8').split('\n')
-        for iface in iface_list:
+        for iface in ifaces:
             if iface and iface not in physicalwif:
                 wif_list.append(iface)
         wif_list = sorted(wif_list)
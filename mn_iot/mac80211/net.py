@@ -34,7 +34,8 @@ from mn_iot.mac80211.wmediumdConnector import w_starter, w_server, \
     error_prob, snr, interference
 from mn_iot.mac80211.link import wirelessLink, wmediumd, Association, \
     _4address, TCWirelessLink, TCLinkWirelessStation, ITSLink, \
-    wifiDirectLink, adhoc, mesh, physicalMesh, physicalWifiDirectLink
+    wifiDirectLink, adhoc, mesh, physicalMesh, physicalWifiDirectLink, \
+    linkShaper
 from mn_iot.mac80211.clean import Cleanup as cleanup_mnwifi
 from mn_iot.mac80211.devices import GetRate, GetRange
 from mn_iot.mac80211.telemetry import parseData, telemetry as run_telemetry
@@ -42,6 +43,8 @@ from mn_iot.mac80211.mobility import tracked as trackedMob, \
     model as mobModel, mobility as mob
 from mn_iot.mac80211.plot import plot2d, plot3d, plotGraph
 from mn_iot.mac80211.module import module
+from mn_iot.mac80211.pinger import pinger
+from mn_iot.mac80211.iperf import iperfFlows
 from mn_iot.mac80211.propagationModels import propagationModel
 from mn_iot.mac80211.vanet import vanet
 from mn_iot.mac802154.node import Sixlowpan
@@ -930,6 +933,7 @@ class Mininet_wifi(Mininet):
     def stop(self):
         'Stop Mininet-WiFi'
         self.stopGraphParams()
+        linkShaper.stop()
         info('*** Stopping %i controllers\n' % len(self.controllers))
         for controller in self.controllers:
             info(controller.name + ' ')
@@ -1034,16 +1038,17 @@ class Mininet_wifi(Mininet):
         if not hosts:
             hosts = self.hosts + self.stations
             output('*** Ping: testing ping reachability\n')
+        pairs = [(node, dest) for node in hosts for dest in hosts
+                 if node != dest and dest.intfs]
+        results = {}
+        for node, dest, result in pinger.run(pairs, 'ping', timeout):
+            results[(node, dest)] = result
         for node in hosts:
             output('%s -> ' % node.name)
             for dest in hosts:
                 if node != dest:
-                    opts = ''
-                    if timeout:
-                        opts = '-W %s' % timeout
-                    if dest.intfs:
-                        result = node.cmdPrint('ping -c1 %s %s'
-                                               % (opts, dest.IP()))
+                    if (node, dest) in results:
+                        result = results[(node, dest)]
                         sent, received = self._parsePing(result)
                     else:
                         sent, received = 0, 0
@@ -1104,22 +1109,24 @@ class Mininet_wifi(Mininet):
         """Ping between all specified hosts and return all data.
            hosts: list of hosts
            timeout: time to wait for a response, as string
-           returns: all ping data; see function body."""
+           returns: all ping data; see function body.
+           The pings run concurrently (see pinger)"""
         # should we check if running?
         # Each value is a tuple: (src, dsd, [all ping outputs])
         all_outputs = []
         if not hosts:
             hosts = self.hosts
             output('*** Ping: testing ping reachability\n')
+        pairs = [(node, dest) for node in hosts for dest in hosts
+                 if node != dest]
+        results = {}
+        for node, dest, result in pinger.run(pairs, 'ping', timeout):
+            results[(node, dest)] = self._parseFull(result)
         for node in hosts:
             output('%s -> ' % node.name)
             for dest in hosts:
                 if node != dest:
-                    opts = ''
-                    if timeout:
-                        opts = '-W %s' % timeout
-                    result = node.cmd('ping -c1 %s %s' % (opts, dest.IP()))
-                    outputs = self._parsePingFull(result)
+                    outputs = results[(node, dest)]
                     sent, received, rttmin, rttavg, rttmax, rttdev = outputs
                     all_outputs.append((node, dest, outputs))
                     output(('%s ' % dest.name) if received else 'X ')
@@ -1133,6 +1140,14 @@ class Mininet_wifi(Mininet):
                    (rttmin, rttavg, rttmax, rttdev))
         return all_outputs
 
+    def rttMatrix(self, hosts=None, timeout=None):
+        """Ping between all specified hosts.
+           returns: matrix of average rtt (ms) between hosts, in the order
+           of hosts, NaN where no reply was received"""
+        if not hosts:
+            hosts = self.hosts + self.stations
+        return pinger.rtt_matrix(hosts, self.pingFull(hosts, timeout))
+
     def pingAll(self, timeout=None):
         """Ping between all hosts.
            returns: ploss packet loss percentage"""
@@ -1242,6 +1257,31 @@ class Mininet_wifi(Mininet):
         output('*** Results: %s\n' % result)
         return result
 
+    def iperfMulti(self, pairs=None, l4Type='TCP', udpBw='10M', seconds=10,
+                   stagger=0, port=5201, filename=None):
+        """Run many iperf3 flows at once.
+           pairs: list of (client, server); if None, every station
+           sends to the first host
+           l4Type: string, one of [ TCP, UDP ]
+           udpBw: bandwidth target of each UDP flow
+           seconds: duration of each flow
+           stagger: delay between the starts of two flows (s)
+           port: port of the first flow
+           filename: saves the result as JSON
+           returns: dict with the throughput, jitter, loss and link state
+           of each flow and the aggregate"""
+        if not pairs:
+            if not self.hosts:
+                raise Exception('iperfMulti: no host to send to')
+            pairs = [(sta, self.hosts[0]) for sta in self.stations]
+        output('*** Iperf: testing', l4Type, 'bandwidth of %d flows\n'
+               % len(pairs))
+        result = iperfFlows(pairs, l4Type=l4Type, udpBw=udpBw,
+                            seconds=seconds, stagger=stagger,
+                            port=port).run()
+        iperfFlows.report(result, filename)
+        return result
+
     def runCpuLimitTest(self, cpu, duration=5):
         """run CPU limit test with 'while true' processes.
         cpu: desired CPU fraction of each host
@@ -1358,6 +1398,7 @@ class Mininet_wifi(Mininet):
                     sta.pexec('iw dev %s connect %s %s'
                               % (sta.params['wif'][wif],
                                  ap.params['ssid'][0], ap.params['mac'][0]))
+                    Association.forget_rssi(sta, wif)
                     sta.params['associatedTo'][wif] = ap
                     ap.params['assocStas'].append(sta)
 
@@ -1941,12 +1982,12 @@ class Mininet_wifi(Mininet):
     @staticmethod
     def stop_simulation():
         "Pause the simulation"
-        mob.pause_simulation = True
+        mob.pause()
 
     @staticmethod
     def start_simulation():
         "Start the simulation"
-        mob.pause_simulation = False
+        mob.resume()
 
     @staticmethod
     def configureMobility(*args, **kwargs):
@@ -1977,12 +2018,14 @@ class Mininet_wifi(Mininet):
             wirelessLink.equationLatency = params['latency']
         if 'loss' in params:
             wirelessLink.equationLoss = params['loss']
+        wirelessLink.compile_equations()
 
     @staticmethod
     def stopGraphParams():
         "Stop the graph"
         if parseData.thread_:
             parseData.thread_._keep_alive = False
+        run_telemetry.stop()
         if mob.thread_:
             mob.thread_._keep_alive = False
         if mobSensor.thread_:
@@ -24,7 +24,9 @@ import re
 import math
 from re import findall
 import fileinput
-from time import sleep
+import socket
+from multiprocessing.pool import ThreadPool
+from time import sleep, time
 from distutils.version import StrictVersion
 from sys import version_info as py_version_info
 from six import string_types
@@ -37,11 +39,29 @@ from mininet.node import Node
 from mininet.moduledeps import moduleDeps, pathCheck, TUN
 from mininet.link import Intf, OVSIntf
 from mn_iot.mac80211.link import TCWirelessLink, TCLinkWirelessAP,\
-    Association, wirelessLink, adhoc, mesh, physicalMesh, ITSLink
+    Association, wirelessLink, adhoc, mesh, physicalMesh, ITSLink, \
+    linkShaper
 from mn_iot.mac80211.wmediumdConnector import w_server, w_pos, w_txpower, \
     w_gain, w_height, w_cst, wmediumd_mode
 from mn_iot.mac80211.propagationModels import GetSignalRange, \
-    GetPowerGivenRange, propagationModel
+    propagationModel, propagationCache
+
+
+# channel -> frequency (GHz): 2.4 GHz, 5 GHz and 802.11p (172-184)
+CHAN_FREQ = dict(zip(
+    [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14,
+     36, 40, 44, 48, 52, 56, 60, 64, 100, 104, 108, 112, 116, 120, 124,
+     128, 132, 136, 140, 144, 149, 153, 157, 161, 165, 169, 171, 172, 173,
+     174, 175, 176, 177, 178, 179, 180, 181, 182, 183, 184, 185],
+    [2.412, 2.417, 2.422, 2.427, 2.432, 2.437, 2.442, 2.447, 2.452, 2.457,
+     2.462, 2.467, 2.472, 2.484,
+     5.18, 5.2, 5.22, 5.24, 5.26, 5.28, 5.30, 5.32, 5.50, 5.52, 5.54, 5.56,
+     5.58, 5.6, 5.62, 5.64, 5.66, 5.68, 5.7, 5.72, 5.745, 5.765, 5.785,
+     5.805, 5.825, 5.845, 5.855, 5.86, 5.865, 5.87, 5.875, 5.88, 5.885,
+     5.89, 5.895, 5.9, 5.905, 5.91, 5.915, 5.92, 5.925]))
+# 6 GHz channels (band=6), whose numbers overlap with the ones above
+CHAN_FREQ_6GHZ = dict([(chan, round(5.95 + chan * 0.005, 3))
+                       for chan in range(1, 234, 4)] + [(2, 5.935)])
 
 
 class Node_wifi(Node):
@@ -75,6 +95,7 @@ class Node_wifi(Node):
         self.nameToIntf = {}  # dict of interface names to Intfs
 
         self.func = []
+        self.freqs = {}  # wif -> (channel, band, freq) used by get_freq
         self.isStationary = True
 
         # Make pylint happy
@@ -215,9 +236,9 @@ class Node_wifi(Node):
         if not isinstance(self, Station) and not isinstance(self, Car) \
                 and not isinstance(self, AP):
             self = self.params['associatedTo'][0]
-        value = GetSignalRange(self, wif, interference_enabled)
+        dist = propagationCache.get_range(self, wif, interference_enabled)
 
-        return int(value.dist)
+        return int(dist)
 
     def setRange(self, value, intf=None):
         "Set Signal Range"
@@ -244,9 +265,7 @@ class Node_wifi(Node):
             cls = plot3d
         if cls.fig_exists():
             cls.updateCircleRadius(self)
-            cls.updateLine(self)
             cls.update(self)
-            cls.pause()
 
     def setPosition(self, pos):
         "Set Position"
@@ -303,29 +322,25 @@ class Node_wifi(Node):
     def get_freq(self, wif):
         """Gets frequency based on channel number
         :param wif: wif ID"""
-        channel = int(self.params['channel'][wif])
-        chan_list_2ghz = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-        chan_list_5ghz = [36, 40, 44, 48, 52, 56, 60, 64, 100,
-                          104, 108, 112, 116, 120, 124, 128, 132,
-                          136, 140, 149, 153, 157, 161, 165,
-                          169, 171, 172, 173, 174, 175, 176,
-                          177, 178, 179, 180, 181, 182, 183, 184,
-                          185]
-        freq_list_2ghz = [2.412, 2.417, 2.422, 2.427, 2.432, 2.437,
-                          2.442, 2.447, 2.452, 2.457, 2.462]
-        freq_list_5ghz = [5.18, 5.2, 5.22, 5.24, 5.26, 5.28, 5.30, 5.32,
-                          5.50, 5.52, 5.54, 5.56, 5.58, 5.6, 5.62,
-                          5.64, 5.66, 5.68, 5.7, 5.745, 5.765, 5.785,
-                          5.805, 5.825, 5.845, 5.855, 5.86, 5.865, 5.87,
-                          5.875, 5.88, 5.885, 5.89, 5.895, 5.9, 5.905,
-                          5.91, 5.915, 5.92, 5.925]
-        all_chan = chan_list_2ghz + chan_list_5ghz
-        all_freq = freq_list_2ghz + freq_list_5ghz
-        if channel in all_chan:
-            idx = all_chan.index(channel)
-            return all_freq[idx]
+        channel = self.params['channel'][wif]
+        band = self.params.get('band')
+        cached = self.freqs.get(wif)
+        if cached and cached[0] == channel and cached[1] == band:
+            return cached[2]
+        if str(band) == '6':
+            freq = CHAN_FREQ_6GHZ.get(int(channel), 5.955)
         else:
-            return 2.412
+            freq = CHAN_FREQ.get(int(channel), 2.412)
+        self.freqs[wif] = (channel, band, freq)
+        return freq
+
+    def clear_freq(self, wif=None):
+        """Invalidates the frequency cached by get_freq
+        :param wif: wif ID (all of them if None)"""
+        if wif is None:
+            self.freqs.clear()
+        else:
+            self.freqs.pop(wif, None)
 
     def get_rssi(self, node=None, wif=0, dist=0):
         value = propagationModel(self, node, dist, wif)
@@ -370,9 +385,9 @@ class Node_wifi(Node):
         interference_enabled = False
         if wmediumd_mode.mode == w_cst.INTERFERENCE_MODE:
             interference_enabled = True
-        value = GetPowerGivenRange(self, wif, self.params['range'][wif],
-                                   interference_enabled)
-        return int(value.txpower)
+        txpower = propagationCache.get_txpower(
+            self, wif, self.params['range'][wif], interference_enabled)
+        return int(txpower)
 
     def get_txpower(self, iface):
         connected = self.cmd('iw dev %s link | awk \'{print $1}\'' % iface)
@@ -861,9 +876,14 @@ class AccessPoint(AP):
     running (or has execed?) an OpenFlow switch."""
 
     write_mac = False
+    max_workers = 16  # hostapd daemons started at once
+    ctrl_interface = '/var/run/hostapd'
+    hostapd_timeout = 10  # time to wait for the control sockets (s)
+    acs_timeout = 30  # time to wait for ACS to pick the channels (s)
 
     def __init__(self, aps, driver, link, setMaster=False, config=False):
         'configure ap'
+        self.hostapds = []  # (ap, wif, intf, phywlan, link) to be started
         if config:
             self.check_nm(aps, driver, setMaster)
         else:
@@ -906,6 +926,11 @@ class AccessPoint(AP):
                     self.setConfig(ap, aps, wif, link)
                     if 'vssids' in ap.params:
                         break
+        if self.hostapds:
+            self.start_hostapds(self.hostapds)
+            for ap, wif, _, phywlan, link in self.hostapds:
+                self.setHostapdIntfs(ap, wif, phywlan, link)
+            self.hostapds = []
 
     def setConfig(self, ap, aplist=None, wif=0, link=None, ssid=None):
         """Configure AP
@@ -949,8 +974,9 @@ class AccessPoint(AP):
                 self.setHostapdConfig(ap, wif, aplist, link)
 
     def setHostapdConfig(self, ap, wif, aplist=None, link=None):
-        "Set hostapd config"
-        cmd = ("echo \'")
+        """Writes the hostapd config file. hostapd is started later on,
+        together with the one of the other APs"""
+        cmd = ""
         args = ['max_num_sta', 'beacon_int', 'rsn_preauth']
 
         if 'phywlan' in ap.params:
@@ -1088,10 +1114,14 @@ class AccessPoint(AP):
                         cmd = cmd + ("\nwep_default_key=0")
                         cmd = cmd + self.verifyWepKey(ap.wep_key0)
                 ap.params['mac'][i] = ap.params['mac'][wif][:-1] + str(i)
-        cmd = cmd + ("\nctrl_interface=/var/run/hostapd")
+        cmd = cmd + ("\nctrl_interface=%s" % self.ctrl_interface)
         cmd = cmd + ("\nctrl_interface_group=0")
-        self.APConfigFile(cmd, ap, wif)
+        intf = self.APConfigFile(cmd, ap, wif)
+        phywlan = ap.params.pop('phywlan', None)
+        self.hostapds.append((ap, wif, intf, phywlan, link))
 
+    def setHostapdIntfs(self, ap, wif, phywlan=None, link=None):
+        "Sets up the interfaces of an AP once hostapd is running"
         if 'vssids' in ap.params:
             for i in range(1, ap.params['vssids']+1):
                 wif = i
@@ -1100,10 +1130,7 @@ class AccessPoint(AP):
                 intf = ap.params['wif'][wif]
                 TCLinkWirelessAP(ap, intfName1=intf)
 
-        iface = ap.params['wif'][wif]
-        if 'phywlan' in ap.params:
-            iface = ap.params['phywlan']
-            ap.params.pop('phywlan', None)
+        iface = phywlan or ap.params['wif'][wif]
 
         setTC = True
         if link:
@@ -1121,6 +1148,7 @@ class AccessPoint(AP):
         bw = self.getRate(node, wif)
         if 'bw' in node.params:
             bw = node.params['bw'][wif]
+        linkShaper.forget(node, iface)
         node.cmd("tc qdisc replace dev %s \
                 root handle 2: tbf rate %sMbit burst 15000 "
                  "latency 1ms" % (iface, bw))
@@ -1230,27 +1258,87 @@ class AccessPoint(AP):
             print(line.rstrip())
 
     def APConfigFile(self, cmd, ap, wif):
-        "run an Access Point and create the config file"
-        intf = ap.params['wif'][wif]
-        if 'phywlan' in ap.params:
-            intf = ap.params['phywlan']
-            ap.cmd('ip link set %s down' % intf)
-            ap.cmd('ip link set %s up' % intf)
+        """Creates the config file of an Access Point
+        :return: interface hostapd runs on"""
+        intf = ap.params.get('phywlan', ap.params['wif'][wif])
         apconfname = "mn%d_%s.apconf" % (os.getpid(), intf)
-        content = cmd + ("\' > %s" % apconfname)
-        ap.cmd(content)
-        cmd = self.get_hostapd_cmd(ap, intf)
+        with open(apconfname, 'w') as f:
+            f.write(cmd + '\n')
+        return intf
+
+    def start_hostapds(self, hostapds):
+        """Starts hostapd on all APs concurrently and waits until it is
+        running on every interface
+        :param hostapds: list of (ap, wif, intf, phywlan, link)"""
+        intfs = {}  # ap -> interfaces, started one after the other
+        for ap, _, intf, phywlan, _ in hostapds:
+            intfs.setdefault(ap, []).append((intf, phywlan))
+
+        def start(ap):
+            for intf, phywlan in intfs[ap]:
+                if phywlan:
+                    ap.cmd('ip link set %s down' % intf)
+                    ap.cmd('ip link set %s up' % intf)
+                ap.cmd(self.get_hostapd_cmd(ap, intf))
+
+        pool = ThreadPool(min(self.max_workers, len(intfs)))
         try:
-            ap.cmd(cmd)
-            if int(ap.params['channel'][wif]) == 0 \
-                    or ap.params['channel'][wif] == 'acs_survey':
-                info("*** Waiting for ACS... It takes 10 seconds.\n")
-                sleep(10)
+            pool.map(start, list(intfs))
         except:
             info("*** error with hostapd. Please, run sudo mn -c in order " \
             "to fix it or check if hostapd is working properly in " \
             "your system.")
             exit(1)
+        finally:
+            pool.close()
+            pool.join()
+
+        started = [intf for _, _, intf, _, _ in hostapds]
+        self.wait_hostapd(started, 'PING', 'PONG', self.hostapd_timeout)
+        acs = [intf for ap, wif, intf, _, _ in hostapds
+               if str(ap.params['channel'][wif]) in ['0', 'acs_survey']]
+        if acs:
+            info("*** Waiting for ACS on %s interface(s)\n" % len(acs))
+            self.wait_hostapd(acs, 'STATUS', 'state=ENABLED',
+                              self.acs_timeout)
+
+    def wait_hostapd(self, intfs, request, reply, timeout):
+        """Sends request to the control socket of each interface until
+        reply is received or timeout expires
+        :return: interfaces that did not reply"""
+        pending = list(intfs)
+        deadline = time() + timeout
+        while True:
+            pending = [intf for intf in pending
+                       if reply not in self.ctrl_request(intf, request)]
+            if not pending or time() > deadline:
+                break
+            sleep(0.1)
+        if pending:
+            error("*** hostapd did not reply to %s on %s\n"
+                  % (request, ' '.join(pending)))
+        return pending
+
+    def ctrl_request(self, intf, request, timeout=0.5):
+        """Sends a request to the hostapd control socket of intf
+        :return: reply or an empty string"""
+        path = os.path.join(self.ctrl_interface, intf)
+        local = '/tmp/mn%d_%s.ctrl' % (os.getpid(), intf)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            if os.path.exists(local):
+                os.unlink(local)
+            sock.bind(local)
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.send(request.encode())
+            return sock.recv(4096).decode(errors='replace')
+        except (socket.error, OSError):
+            return ''
+        finally:
+            sock.close()
+            if os.path.exists(local):
+                os.unlink(local)
 
     def get_hostapd_cmd(self, node, iface):
         apconfname = "mn%d_%s.apconf" % (os.getpid(), iface)
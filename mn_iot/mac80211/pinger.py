@@ -0,0 +1,66 @@
+"""Concurrent ping between pairs of nodes. Each ping runs as its own
+process in the namespace of the source node, so a reachability test
+takes about one round trip (or timeout) per batch of max_workers pings
+instead of one per pair"""
+
+from multiprocessing.pool import ThreadPool
+from subprocess import PIPE, STDOUT
+
+import numpy as np
+
+from mininet.log import debug
+
+
+class pinger(object):
+    "Runs the pings of a reachability test concurrently"
+
+    max_workers = 256  # ping processes running at once
+
+    @classmethod
+    def ping(cls, pair, cmd='ping', timeout=None):
+        """Pings dest from src once
+        :param pair: (src, dest)
+        :param cmd: ping or ping6
+        :param timeout: time to wait for a response (s)
+        :return: (src, dest, output)"""
+        src, dest = pair
+        args = [cmd, '-c1']
+        if timeout:
+            args += ['-W', str(timeout)]
+        args.append(dest.IP())
+        proc = src.popen(args, stdout=PIPE, stderr=STDOUT)
+        result = proc.communicate()[0]
+        if isinstance(result, bytes):
+            result = result.decode(errors='replace')
+        debug('%s -> %s: %s\n' % (src, dest, result))
+        return src, dest, result
+
+    @classmethod
+    def run(cls, pairs, cmd='ping', timeout=None):
+        """Pings all pairs concurrently
+        :param pairs: list of (src, dest)
+        :return: iterator of (src, dest, output), as the pings complete"""
+        if not pairs:
+            return
+        pool = ThreadPool(min(cls.max_workers, len(pairs)))
+        try:
+            for result in pool.imap_unordered(
+                    lambda pair: cls.ping(pair, cmd, timeout), pairs):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def rtt_matrix(hosts, all_outputs):
+        """Returns the matrix of average rtt (ms) between hosts, NaN where
+        no reply was received
+        :param all_outputs: list of (src, dest, parsed ping output) as
+        returned by pingFull"""
+        idx = dict((host, i) for i, host in enumerate(hosts))
+        matrix = np.full((len(hosts), len(hosts)), np.nan)
+        for src, dest, outputs in all_outputs:
+            sent, received, rttmin, rttavg, rttmax, rttdev = outputs
+            if received:
+                matrix[idx[src], idx[dest]] = rttavg
+        return matrix
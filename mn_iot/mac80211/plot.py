@@ -7,17 +7,77 @@ author: Ramon Fontes (ramonrf@dca.fee.unicamp.br)
 
 """
 
+from threading import Thread as thread, Event, Lock
+from time import time, sleep
+
 import numpy as np
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba
+from matplotlib.markers import MarkerStyle
 from mpl_toolkits.mplot3d import Axes3D
-from mininet.log import debug
+from mininet.log import debug, error
+
+
+class renderer(object):
+    """Redraws the graph from its own thread at a fixed rate. The mobility
+    threads only record the new positions (plot.update), so they never
+    wait for the drawing"""
+    fps = 25
+    plot = None
+    thread_ = None
+    stopped = None
+
+    @classmethod
+    def start(cls, plot):
+        cls.plot = plot
+        if cls.thread_ and cls.thread_.is_alive():
+            return
+        cls.stopped = Event()
+        cls.thread_ = thread(name='renderer', target=cls.run)
+        cls.thread_.daemon = True
+        cls.thread_.start()
+
+    @classmethod
+    def stop(cls):
+        if cls.thread_:
+            cls.stopped.set()
+            cls.thread_.join()
+        cls.thread_ = None
+
+    @classmethod
+    def is_running(cls):
+        return cls.thread_ is not None and cls.thread_.is_alive()
+
+    @classmethod
+    def interval(cls):
+        return 1.0 / cls.fps
+
+    @classmethod
+    def run(cls):
+        last_error = None
+        while not cls.stopped.is_set():
+            t0 = time()
+            try:
+                cls.plot.render()
+                last_error = None
+            except Exception as e:
+                # a persistent error is logged once, not on every frame
+                if str(e) != last_error:
+                    error('*** Error drawing the graph: %s\n' % e)
+                    last_error = str(e)
+                else:
+                    debug('renderer: %s\n' % e)
+            cls.stopped.wait(max(cls.interval() - (time() - t0), 0))
 
 
 class plot3d (object):
     'Plot 3d Graphs'
     ax = None
     is3d = False
+    lock = Lock()
+    dirty = set()  # nodes moved since the last frame
 
     @classmethod
     def instantiateGraph(cls, MIN_X, MIN_Y, MIN_Z, MAX_X, MAX_Y, MAX_Z):
@@ -74,19 +134,36 @@ class plot3d (object):
 
     @classmethod
     def pause(cls):
-        plt.pause(0.0001)
+        "Waits one frame: the graph is redrawn by the renderer"
+        if renderer.is_running():
+            sleep(renderer.interval())
+        else:
+            plt.pause(0.0001)
 
     @classmethod
     def update(cls, node):
-        "Graph Update"
-        node.pltNode.remove()
-        node.pltCircle.remove()
-        node.plttxt.remove()
+        "Graph Update: the node is redrawn in the next frame"
+        with cls.lock:
+            cls.dirty.add(node)
+        renderer.start(cls)
 
-        cls.instantiateCircle(node)
-        cls.instantiateNode(node)
-        cls.instantiateAnnotate(node)
-        cls.draw()
+    @classmethod
+    def render(cls):
+        "Redraws the nodes moved since the last frame"
+        with cls.lock:
+            nodes = cls.dirty
+            cls.dirty = set()
+        for node in nodes:
+            node.pltNode.remove()
+            node.pltCircle.remove()
+            node.plttxt.remove()
+
+            cls.instantiateCircle(node)
+            cls.instantiateNode(node)
+            cls.instantiateAnnotate(node)
+        if nodes:
+            cls.draw()
+        cls.ax.figure.canvas.flush_events()
 
     @classmethod
     def draw(cls):
@@ -94,6 +171,7 @@ class plot3d (object):
 
     @classmethod
     def closePlot(cls):
+        renderer.stop()
         try:
             plt.close()
         except:
@@ -134,13 +212,32 @@ class plot3d (object):
 
 
 class plot2d (object):
-    'Plot 2d Graphs'
+    """Plot 2d Graphs. The markers of all nodes are drawn by one
+    PathCollection and the links by one LineCollection. update() only
+    records the position in a shared array, which the renderer reads to
+    redraw the animated artists with blitting"""
     ax = None
     q_lock = ''
-    lines = {}
+    lock = Lock()
+    nodes = []  # nodes in the order of their markers
+    positions = np.zeros((0, 2))
+    radius = np.zeros(0)
+    colors = np.zeros((0, 4))
+    paths = []
+    nodecol = None
+    lines = {}  # 'src-dst' -> index of the link in linecol
+    link_nodes = []  # (src index, dst index) of each link
+    link_colors = []
+    link_styles = []
+    linecol = None
+    blit = False
+    background = None
+    dirty = False  # positions changed since the last frame
+    redraw = False  # the background must be drawn again
 
     @classmethod
     def closePlot(cls):
+        renderer.stop()
         try:
             plt.close()
         except:
@@ -165,24 +262,86 @@ class plot2d (object):
 
     @classmethod
     def update(cls, node):
-        "Graph Update"
+        "Graph Update: records the position drawn in the next frame"
         x, y = cls.getxy(node)
-        cls.text(node, x, y)
-        node.pltNode.set_data(x, y)
-        node.pltCircle.center = x, y
-        # Enable the update of the wired links when the nodes have mobility
-        cls.updateLine(node)
+        with cls.lock:
+            cls.positions[node.pltIdx] = x, y
+            cls.dirty = True
+        renderer.start(cls)
+
+    @classmethod
+    def render(cls):
+        "Draws the positions recorded since the last frame"
+        with cls.lock:
+            dirty, redraw = cls.dirty, cls.redraw
+            cls.dirty = cls.redraw = False
+            if dirty or redraw:
+                positions = cls.positions.copy()
+                radius = cls.radius.copy()
+        canvas = cls.ax.figure.canvas
+        if dirty or redraw:
+            cls.nodecol.set_offsets(positions)
+            for node in cls.nodes:
+                x, y = positions[node.pltIdx]
+                if hasattr(node, 'plttxt'):
+                    cls.text(node, x, y)
+                if hasattr(node, 'pltCircle'):
+                    cls.circle(node, x, y)
+                    node.pltCircle.set_radius(radius[node.pltIdx])
+            if cls.link_nodes:
+                ends = np.array(cls.link_nodes)
+                cls.linecol.set_segments(np.stack([positions[ends[:, 0]],
+                                                   positions[ends[:, 1]]],
+                                                  axis=1))
+            if not cls.blit:
+                canvas.draw_idle()
+            else:
+                if redraw or cls.background is None:
+                    # the animated artists are not drawn by canvas.draw
+                    canvas.draw()
+                    cls.background = canvas.copy_from_bbox(cls.ax.bbox)
+                canvas.restore_region(cls.background)
+                for artist in cls.get_animated():
+                    cls.ax.draw_artist(artist)
+                canvas.blit(cls.ax.bbox)
+        canvas.flush_events()
+
+    @classmethod
+    def get_animated(cls):
+        artists = [cls.linecol]
+        for node in cls.nodes:
+            if hasattr(node, 'pltCircle'):
+                artists.append(node.pltCircle)
+        artists.append(cls.nodecol)
+        for node in cls.nodes:
+            if hasattr(node, 'plttxt'):
+                artists.append(node.plttxt)
+        return artists
+
+    @classmethod
+    def set_dirty(cls, redraw=False):
+        with cls.lock:
+            cls.dirty = True
+            cls.redraw = cls.redraw or redraw
 
     @classmethod
     def pause(cls):
-        plt.pause(0.001)
+        "Waits one frame: the graph is redrawn by the renderer"
+        if renderer.is_running():
+            sleep(renderer.interval())
+        else:
+            plt.pause(0.001)
 
     @classmethod
     def draw(cls):
-        plt.draw()
+        if renderer.is_running():
+            cls.set_dirty(redraw=True)
+        else:
+            plt.draw()
 
     @classmethod
     def scatter(cls, nodesx, nodesy):
+        cls.set_dirty(redraw=True)
         return plt.scatter(nodesx, nodesy, color='red', marker='s')
 
     @classmethod
@@ -198,12 +357,14 @@ class plot2d (object):
     def line(cls, line):
         ax = cls.ax
         ax.add_line(line)
+        cls.set_dirty(redraw=True)
 
     @classmethod
     def instantiateGraph(cls, MIN_X, MIN_Y, MAX_X, MAX_Y):
         "instantiateGraph"
+        renderer.stop()
         plt.ion()
-        plt.figure(10)
+        fig = plt.figure(10)
         plt.title("Mininet-IoT Graph")
         cls.ax = plt.subplot(111)
         cls.ax.set_xlabel('meters')
@@ -212,15 +373,56 @@ class plot2d (object):
         cls.ax.set_ylim([MIN_Y, MAX_Y])
         cls.ax.grid(True)
 
+        cls.blit = getattr(fig.canvas, 'supports_blit', False)
+        cls.background = None
+        cls.nodes = []
+        cls.positions = np.zeros((0, 2))
+        cls.radius = np.zeros(0)
+        cls.colors = np.zeros((0, 4))
+        cls.paths = []
+        cls.lines = {}
+        cls.link_nodes = []
+        cls.link_colors = []
+        cls.link_styles = []
+        cls.nodecol = cls.ax.scatter([], [], s=25, marker='.',
+                                     animated=cls.blit, zorder=3)
+        cls.linecol = LineCollection([], animated=cls.blit)
+        cls.ax.add_collection(cls.linecol)
+        fig.canvas.mpl_connect('resize_event',
+                               lambda event: cls.set_dirty(redraw=True))
+
     @classmethod
     def fig_exists(cls):
         return plt.fignum_exists(10)
 
     @classmethod
-    def instantiateNode(cls, node):
+    def get_path(cls, marker):
+        marker = MarkerStyle(marker)
+        return marker.get_path().transformed(marker.get_transform())
+
+    @classmethod
+    def instantiateNode(cls, node, color='black'):
         "instantiateNode"
-        ax = cls.ax
-        node.pltNode, = ax.plot(1, 1, marker='.', ms=5, color='black')
+        pos = node.params.get('position', (0, 0))
+        with cls.lock:
+            if getattr(node, 'pltIdx', None) is None \
+                    or node.pltIdx >= len(cls.nodes) \
+                    or cls.nodes[node.pltIdx] is not node:
+                node.pltIdx = len(cls.nodes)
+                cls.nodes.append(node)
+                cls.positions = np.vstack([cls.positions, [0, 0]])
+                cls.radius = np.append(cls.radius, 0)
+                cls.colors = np.vstack([cls.colors, [0, 0, 0, 0]])
+                cls.paths.append(cls.get_path('.'))
+            cls.positions[node.pltIdx] = float(pos[0]), float(pos[1])
+            cls.colors[node.pltIdx] = to_rgba(color)
+            if 'range' in node.params:
+                cls.radius[node.pltIdx] = max(node.params['range'])
+            cls.nodecol.set_offsets(cls.positions)
+            cls.nodecol.set_facecolors(cls.colors)
+            cls.nodecol.set_edgecolors(cls.colors)
+            cls.nodecol.set_paths(cls.paths)
+            cls.dirty = True
 
     @classmethod
     def instantiateCircle(cls, node):
@@ -230,7 +432,8 @@ class plot2d (object):
 
         node.pltCircle = ax.add_patch(
             patches.Circle((0, 0), max(node.params['range']),
-                           fill=True, alpha=0.1, color=color))
+                           fill=True, alpha=0.1, color=color,
+                           animated=cls.blit))
 
     @classmethod
     def set_def_color(cls, node):
@@ -247,44 +450,42 @@ class plot2d (object):
 
     @classmethod
     def instantiateAnnotate(cls, node):
-        node.plttxt = cls.ax.annotate(node, xy=(0, 0))
+        node.plttxt = cls.ax.annotate(node, xy=(0, 0), animated=cls.blit)
 
     @classmethod
     def updateCircleRadius(cls, node):
-        node.pltCircle.set_radius(max(node.params['range']))
-
-    @classmethod
-    def updateLine(cls, node):
-        pos = [node.params['position'][0], node.params['position'][1]]
-        for line in cls.lines:
-            if node.name in line:
-                for n in range(len(line)):
-                    if '-' == line[n]:
-                        node1 = line[:n]
-                        #node2 = line[n + 1:]
-                pos_ = cls.lines[line].get_data()
-                if node.name == node1:
-                    cls.lines[line].set_data([pos[0], pos_[0][1]],
-                                             [pos[1], pos_[1][1]])
-                else:
-                    cls.lines[line].set_data([pos_[0][0], pos[0]],
-                                             [pos_[1][0], pos[1]])
+        with cls.lock:
+            cls.radius[node.pltIdx] = max(node.params['range'])
+            cls.dirty = True
 
     @classmethod
     def setCircleColor(cls, node, color):
         node.pltCircle.set_color(color)
+        cls.set_dirty()
 
     @classmethod
     def setAnnotateColor(cls, node, color):
         node.plttxt.set_color(color)
+        cls.set_dirty()
+
+    @classmethod
+    def set_marker_color(cls, node, rgba):
+        with cls.lock:
+            cls.colors[node.pltIdx] = rgba
+            cls.nodecol.set_facecolors(cls.colors)
+            cls.nodecol.set_edgecolors(cls.colors)
+            cls.dirty = True
 
     @classmethod
     def setNodeColor(cls, node, color):
-        node.pltNode.set_c(color)
+        cls.set_marker_color(node, to_rgba(color))
 
     @classmethod
     def setNodeMarker(cls, node, marker=''):
-        node.pltNode.set_marker(marker)
+        with cls.lock:
+            cls.paths[node.pltIdx] = cls.get_path(marker or 'None')
+            cls.nodecol.set_paths(cls.paths)
+            cls.dirty = True
 
     @classmethod
     def instantiateNodes(cls, node):
@@ -300,7 +501,6 @@ class plot2d (object):
         for node in nodes:
             x, y = cls.getxy(node)
             cls.instantiateNodes(node)
-            node.pltNode.set_data(x, y)
             cls.text(node, x, y)
             cls.circle(node, x, y)
 
@@ -315,35 +515,51 @@ class plot2d (object):
     def hideNode(cls, node):
         node.pltCircle.set_visible(False)
         node.plttxt.set_visible(False)
-        node.pltNode.set_visible(False)
+        node.pltColor = tuple(cls.colors[node.pltIdx])
+        cls.set_marker_color(node, (0, 0, 0, 0))
 
     @classmethod
     def showNode(cls, node):
         node.pltCircle.set_visible(True)
         node.plttxt.set_visible(True)
-        node.pltNode.set_visible(True)
+        cls.set_marker_color(node, getattr(node, 'pltColor',
+                                           to_rgba('black')))
+
+    @classmethod
+    def set_line_visible(cls, src, dst, visible):
+        conn_ = src.name + '-' + dst.name
+        if conn_ not in cls.lines:
+            conn_ = dst.name + '-' + src.name
+        idx = cls.lines[conn_]
+        with cls.lock:
+            cls.link_colors[idx] = to_rgba('b', 1 if visible else 0)
+            cls.linecol.set_color(cls.link_colors)
+            cls.dirty = True
 
     @classmethod
     def hideLine(cls, src, dst):
-        conn_ = src.name + dst.name
-        cls.lines[conn_].set_visible(False)
+        cls.set_line_visible(src, dst, False)
 
     @classmethod
     def showLine(cls, src, dst):
-        conn_ = src.name + dst.name
-        cls.lines[conn_].set_visible(True)
+        cls.set_line_visible(src, dst, True)
 
     @classmethod
     def addLine(cls, src, dst, ls='-'):
-        src_x = round(src.params['position'][0], 2)
-        src_y = round(src.params['position'][1], 2)
-        dst_x = round(dst.params['position'][0], 2)
-        dst_y = round(dst.params['position'][1], 2)
-        line = cls.line2d([src_x, dst_x],
-                          [src_y, dst_y], 'b', ls=ls)
+        "Adds a link, which then follows the positions of src and dst"
+        for node in (src, dst):
+            if getattr(node, 'pltIdx', None) is None:
+                # nodes without marker, e.g. wired nodes
+                cls.instantiateNode(node, color=(0, 0, 0, 0))
         conn_ = src.name + '-' + dst.name
-        cls.lines[conn_] = line
-        cls.line(line)
+        with cls.lock:
+            cls.lines[conn_] = len(cls.link_nodes)
+            cls.link_nodes.append((src.pltIdx, dst.pltIdx))
+            cls.link_colors.append(to_rgba('b'))
+            cls.link_styles.append(ls)
+            cls.linecol.set_color(cls.link_colors)
+            cls.linecol.set_linestyles(cls.link_styles)
+            cls.dirty = True
 
 
 class plotGraph(object):
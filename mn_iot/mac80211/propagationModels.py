@@ -9,9 +9,13 @@
                 Two-Ray-Ground Propagation Model"""
 
 import math
+from collections import OrderedDict
 from random import gauss
+from threading import Lock
 from time import sleep
 
+import numpy as np
+
 
 class propagationModel(object):
     "Propagation Models"
@@ -30,8 +34,18 @@ class propagationModel(object):
 
     def __init__(self, node1=None, node2=None, dist=0, wif=0):
         if self.model in dir(self):
-            self.__getattribute__(self.model)(node1=node1, node2=node2,
-                                              dist=dist, wif=wif)
+            key = propagationCache.get_rssi_key(node1, node2, dist, wif)
+            if key is None:
+                self.__getattribute__(self.model)(node1=node1, node2=node2,
+                                                  dist=dist, wif=wif)
+                return
+            rssi = propagationCache.get(key)
+            if rssi is None:
+                dist = key[-1]
+                rssi = self.__getattribute__(self.model)(
+                    node1=node1, node2=node2, dist=dist, wif=wif)
+                propagationCache.set(key, rssi)
+            self.rssi = rssi
 
     @classmethod
     def setAttr(cls, **kwargs):
@@ -54,6 +68,7 @@ class propagationModel(object):
             cls.noise_threshold = kwargs['noise_threshold']
         if 'cca_threshold' in kwargs:
             cls.cca_threshold = kwargs['cca_threshold']
+        propagationCache.clear()
 
     def pathLoss(self, node1, dist, wif):
         """Path Loss Model:
@@ -210,6 +225,242 @@ class propagationModel(object):
 ppm = propagationModel
 
 
+class propagationCache(object):
+    """LRU cache of the rssi given by the propagation model and tables of
+    txpower given the range and range given the txpower. Keys include the
+    model attributes, so the entries are never stale; setAttr clears the
+    cache anyway"""
+
+    max_size = 10000  # max number of rssi entries
+    max_tables = 64  # max number of txpower and range tables
+    digits = 2  # distances are rounded to this number of digits
+    max_range = 1000  # txpower tables cover the ranges 0 to max_range (m)
+    max_txpower = 100  # range tables cover the txpowers 0 to max_txpower
+    cache = OrderedDict()
+    tables = OrderedDict()
+    lock = Lock()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.cache.clear()
+            cls.tables.clear()
+
+    @classmethod
+    def get_model_key(cls):
+        return (ppm.model, ppm.exp, ppm.sL, ppm.lF, ppm.pL, ppm.nFloors,
+                ppm.gRandom, ppm.noise_threshold)
+
+    @classmethod
+    def get_rssi_key(cls, node1, node2, dist, wif):
+        """Returns the key of the rssi between node1 and node2 or None when
+        the nodes do not have all the params used by the models"""
+        try:
+            return (cls.get_model_key(),
+                    node1.params['freq'][wif],
+                    node1.params['antennaGain'][wif],
+                    node1.params.get('antennaHeight', [None] * (wif + 1))[wif],
+                    node2.params['txpower'][0],
+                    node2.params['antennaGain'][0],
+                    node2.params.get('antennaHeight', [None])[0],
+                    round(dist, cls.digits))
+        except (AttributeError, KeyError, IndexError, TypeError):
+            return None
+
+    @classmethod
+    def get(cls, key):
+        with cls.lock:
+            value = cls.cache.get(key)
+            if value is None:
+                cls.misses += 1
+            else:
+                cls.hits += 1
+                cls.cache.move_to_end(key)
+            return value
+
+    @classmethod
+    def set(cls, key, value):
+        with cls.lock:
+            cls.cache[key] = value
+            cls.cache.move_to_end(key)
+            while len(cls.cache) > cls.max_size:
+                cls.cache.popitem(last=False)
+
+    @classmethod
+    def get_table_node(cls, node, wif, txpower=None):
+        """Returns a node holding the params used by GetSignalRange and
+        GetPowerGivenRange, or None when they are missing"""
+        params = {}
+        for param in ['freq', 'antennaGain', 'antennaHeight',
+                      'txpower', 'rssi']:
+            try:
+                params[param] = [node.params[param][wif]]
+            except (KeyError, IndexError, TypeError):
+                if param in ['freq', 'antennaGain']:
+                    return None
+        if txpower is not None:
+            params['txpower'] = [txpower]
+        return tableNode(params)
+
+    @classmethod
+    def get_table(cls, kind, node, wif):
+        """Returns the txpower (kind='txpower') or range (kind='range')
+        table of the node. The table is indexed by range or txpower"""
+        table_node = cls.get_table_node(node, wif)
+        if table_node is None:
+            return None
+        params = table_node.params
+        key = (kind, cls.get_model_key(), params['freq'][0],
+               params['antennaGain'][0],
+               params.get('antennaHeight', [None])[0])
+        if ppm.model == 'twoRayGround':
+            # only twoRayGround depends on the rssi of the node
+            key += (params.get('rssi', [None])[0],)
+            if kind == 'txpower':
+                # and its txpower on the current txpower
+                key += (params.get('txpower', [None])[0],)
+        with cls.lock:
+            table = cls.tables.get(key)
+            if table is not None:
+                cls.tables.move_to_end(key)
+        if table is None:
+            table = []
+            if kind == 'txpower':
+                for dist in range(cls.max_range + 1):
+                    table.append(cls.compute(GetPowerGivenRange, table_node,
+                                             dist=dist))
+            else:
+                for txpower in range(cls.max_txpower + 1):
+                    table.append(cls.compute(
+                        GetSignalRange,
+                        cls.get_table_node(node, wif, txpower)))
+            with cls.lock:
+                cls.tables[key] = table
+                # twoRayGround keys change with rssi and txpower, so
+                # keep only the most recently used tables
+                while len(cls.tables) > cls.max_tables:
+                    cls.tables.popitem(last=False)
+        return table
+
+    @staticmethod
+    def compute(model, node, **kwargs):
+        try:
+            value = model(node, 0, enable_interference=False, **kwargs)
+        except (ValueError, ZeroDivisionError, OverflowError):
+            return None
+        if model is GetPowerGivenRange:
+            return value.txpower
+        return value.dist
+
+    @classmethod
+    def use_tables(cls):
+        # logNormalShadowing draws a new gaussian random variable every time
+        return ppm.model != 'logNormalShadowing'
+
+    @classmethod
+    def get_txpower(cls, node, wif, dist, interference=False):
+        """Returns the txpower given the range
+        :param node: node
+        :param wif: wif id
+        :param dist: signal range"""
+        if cls.use_tables() and dist == int(dist) \
+                and 0 <= dist <= cls.max_range:
+            table = cls.get_table('txpower', node, wif)
+            if table and table[int(dist)] is not None:
+                return table[int(dist)]
+        return GetPowerGivenRange(node, wif, dist, interference).txpower
+
+    @classmethod
+    def get_range(cls, node, wif, interference=False):
+        """Returns the signal range given the txpower
+        :param node: node
+        :param wif: wif id"""
+        txpower = node.params['txpower'][wif]
+        if cls.use_tables() and txpower == int(txpower) \
+                and 0 <= txpower <= cls.max_txpower:
+            table = cls.get_table('range', node, wif)
+            if table and table[int(txpower)] is not None:
+                return table[int(txpower)]
+        return GetSignalRange(node, wif, interference).dist
+
+
+class tableNode(object):
+    "Holds the params of a node used to build the propagation tables"
+
+    def __init__(self, params):
+        self.params = params
+
+
+class propagationMatrix(object):
+    """Vectorized version of propagationModel: the rssi of many pairs of
+    nodes is computed at once. Parameters of node1 (receiver) are column
+    vectors, parameters of node2 (transmitter) are row vectors and dist
+    is the matrix of distances between them"""
+
+    models = ['friis', 'twoRayGround', 'logDistance',
+              'logNormalShadowing', 'ITU', 'young']
+
+    @classmethod
+    def rssi(cls, dist, freq, gr, hr, pt, gt, ht):
+        """:param dist: distance matrix (m)
+        :param freq: frequency of node1 (GHz)
+        :param gr: antenna gain of node1
+        :param hr: antenna height of node1
+        :param pt: txpower of node2
+        :param gt: antenna gain of node2
+        :param ht: antenna height of node2"""
+        if ppm.model not in cls.models:
+            return np.full(dist.shape, float(ppm.rssi))
+        d = np.where(dist == 0, 0.1, dist)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return getattr(cls, ppm.model)(d, freq, gr, hr, pt, gt, ht)
+
+    @classmethod
+    def pathLoss(cls, freq, dist):
+        f = freq * 10 ** 9  # Convert Ghz to Hz
+        c = 299792458.0
+        lambda_ = c / f  # lambda: wavelength (m)
+        numerator = (4 * math.pi * dist) ** 2 * ppm.sL
+        return 10 * np.log10(numerator / lambda_ ** 2)
+
+    @classmethod
+    def friis(cls, d, freq, gr, hr, pt, gt, ht):
+        return (pt + gt + gr) - np.trunc(cls.pathLoss(freq, d))
+
+    @classmethod
+    def twoRayGround(cls, d, freq, gr, hr, pt, gt, ht):
+        pldb = (pt * gt * gr * ht ** 2 * hr ** 2) / (d ** 4 * ppm.sL)
+        return (pt + gt + gr) - np.trunc(pldb)
+
+    @classmethod
+    def logDistance(cls, d, freq, gr, hr, pt, gt, ht):
+        pl = np.trunc(cls.pathLoss(freq, 1))
+        pldb = np.trunc(10 * ppm.exp * np.log10(d))
+        return (pt + gt + gr) - (pl + pldb)
+
+    @classmethod
+    def logNormalShadowing(cls, d, freq, gr, hr, pt, gt, ht):
+        pl = np.trunc(cls.pathLoss(freq, 1))
+        pldb = np.trunc(10 * ppm.exp * np.log10(d) + ppm.gRandom)
+        return (pt + gt + gr) - (pl + pldb)
+
+    @classmethod
+    def ITU(cls, d, freq, gr, hr, pt, gt, ht):
+        f = freq * 10 ** 3
+        N = np.where(d > 16, 38, 28)  # Power Loss Coefficient
+        if ppm.pL != 0:
+            N = ppm.pL
+        pldb = 20 * np.log10(f) + N * np.log10(d) + ppm.lF * ppm.nFloors - 28
+        return (pt + gt + gr) - np.trunc(pldb)
+
+    @classmethod
+    def young(cls, d, freq, gr, hr, pt, gt, ht):
+        cf = 0.01075  # clutter factor
+        return np.trunc(d ** 4 / (gt * gr) * (ht * hr) ** 2 * cf)
+
+
 class GetSignalRange(object):
 
     dist = 0
@@ -9,7 +9,10 @@ author: Ramon Fontes (ramonrf@dca.fee.unicamp.br)
 
 from time import time, sleep
 from threading import Thread as thread
+from collections import deque
+from heapq import heapify, heappush, heappop
 import random
+import numpy as np
 from pylab import math, cos, sin
 from mininet.log import info
 from mn_iot.mac80211.plot import plot2d, plot3d
@@ -17,39 +20,131 @@ from mn_iot.mac80211.mobility import mobility
 from mn_iot.mac80211.link import wirelessLink
 from mn_iot.mac80211.devices import GetRate
 from mn_iot.mac80211.node import Station, AP
+from mn_iot.mac80211.trace import traceCursor, binaryTrace, get_times
+
+
+class replayScheduler(object):
+    """Replays the traces of many nodes. The time of the next sample of
+    each node is kept in a min-heap and the thread sleeps until the
+    earliest one. The events due at the same instant are handled in one
+    batch and the lateness of each event is recorded
+    :param nodes: nodes with a traceCursor in node.trace
+    :param apply: called with the list of (node, sample index) due
+    :param max_wait: longest sleep (s), so that stopping is noticed
+    :param max_samples: number of lateness samples kept"""
+
+    def __init__(self, nodes, apply, max_wait=0.5, max_samples=100000):
+        self.nodes = [node for node in nodes if not node.trace.done()]
+        self.apply = apply
+        self.max_wait = max_wait
+        self.lateness = deque(maxlen=max_samples)
+        self.events = 0
+
+    def run(self, wait=sleep):
+        """Replays the traces until they are finished or the thread is
+        stopped
+        :param wait: function called with the time to sleep (s)"""
+        heap = [(node.trace.next_time(), i, node)
+                for i, node in enumerate(self.nodes)]
+        heapify(heap)
+        start = time()
+        while heap and mobility.thread_._keep_alive:
+            delay = heap[0][0] - (time() - start)
+            if delay > 0:
+                wait(min(delay, self.max_wait))
+                continue
+            now = time() - start
+            batch = []
+            while heap and heap[0][0] <= now:
+                due, i, node = heappop(heap)
+                self.lateness.append(now - due)
+                batch.append((node, node.trace.advance(now)))
+                if not node.trace.done():
+                    heappush(heap, (node.trace.next_time(), i, node))
+            self.events += len(batch)
+            self.apply(batch)
+
+    def get_stats(self):
+        "Returns the number of events and their lateness (s)"
+        if not self.lateness:
+            return {'events': self.events, 'p50': 0, 'p99': 0, 'max': 0}
+        lateness = np.array(self.lateness)
+        return {'events': self.events,
+                'p50': float(np.percentile(lateness, 50)),
+                'p99': float(np.percentile(lateness, 99)),
+                'max': float(lateness.max())}
+
+    def report(self):
+        stats = self.get_stats()
+        info('*** Replayed %d events, lateness p50 %.2fms, p99 %.2fms\n'
+             % (stats['events'], stats['p50'] * 1000, stats['p99'] * 1000))
+
+
+def get_traces(nodes, trace, *columns):
+    """Loads the traces of the nodes into traceCursors, from the binary
+    trace file if given or else from node.time and the node attributes
+    named after the columns
+    :return: the nodes with a trace"""
+    if trace:
+        trace = binaryTrace(trace)
+        nodes = [node for node in nodes if node.name in trace]
+        for node in nodes:
+            node.trace = trace.cursor(node.name, *columns)
+        return nodes
+    nodes = [node for node in nodes if hasattr(node, 'time')]
+    for node in nodes:
+        node.trace = traceCursor(node.time, **dict(
+            (column, getattr(node, column)) for column in columns))
+    return nodes
 
 
 class replayingMobility(object):
     'Replaying Mobility Traces'
     timestamp = False
+    scheduler = None
 
-    def __init__(self, Mininet_wifi, nodes=None):
+    def __init__(self, Mininet_wifi, nodes=None, trace=None):
+        """trace: binary trace file. Otherwise node.position (and node.time)
+        are replayed"""
         mobility.thread_ = thread(name='replayingMobility',
                                        target=self.mobility,
-                                       args=(nodes,Mininet_wifi,))
+                                       args=(nodes,Mininet_wifi,trace))
         mobility.thread_.daemon = True
         mobility.thread_._keep_alive = True
         mobility.thread_.start()
 
-    def timestamp_(self, node, time_):
-        if time_ >= float(node.time[0]):
-            pos = node.position[0]
-            del node.position[0]
-            del node.time[0]
-            mobility.set_pos(node, pos)
-
-    def notimestamp_(self, node, time_):
-        if time_ >= node.currentTime:
-            for n in range(0, node.params['speed']):
-                if len(node.position) > 0:
-                    pos = node.position[0]
-                    del node.position[0]
-                    node.currentTime += node.timestamp
-                    mobility.set_pos(node, pos)
-
-    def mobility(self, nodes, Mininet_wifi):
+    @classmethod
+    def get_pos(cls, pos):
+        "Accepts (x, y, z) or 'x,y,z' positions"
+        if isinstance(pos, str):
+            pos = pos.split(' ')[0].split(',')
+        pos = [float(p) for p in pos]
+        return pos + [0.0] * (3 - len(pos))
+
+    @classmethod
+    def load_trace(cls, node):
+        """Loads the positions of the node into a traceCursor. Without
+        node.time, int(speed) positions are replayed per second"""
+        positions = [cls.get_pos(pos) for pos in node.position]
+        if hasattr(node, 'time'):
+            times = node.time[:len(positions)]
+        else:
+            times = get_times(len(positions), node.params['speed'])
+        node.trace = traceCursor(times, position=positions)
+
+    def mobility(self, nodes, Mininet_wifi, trace=None):
         if nodes is None:
             nodes = Mininet_wifi.stations + Mininet_wifi.aps
+        if trace:
+            trace = binaryTrace(trace)
+            for node in nodes:
+                if node.name in trace:
+                    node.trace = trace.cursor(
+                        node.name, 'position',
+                        speed=node.params.get('speed', 1.0))
+                    if 'position' not in node.params:
+                        node.params['position'] = \
+                            list(node.trace.get('position', 0))
         for node in nodes:
             if isinstance(node, Station):
                 if 'position' in node.params and node not in mobility.stations:
@@ -65,34 +160,34 @@ class replayingMobility(object):
             if Mininet_wifi.max_z != 0:
                 plot = plot3d
 
-        currentTime = time()
+        replaying = []
         for node in nodes:
             if 'speed' not in node.params:
                 node.params['speed'] = 1.0
-            node.currentTime = 1 / node.params['speed']
             node.timestamp = float(1.0 / node.params['speed'])
             node.isStationary = False
             if hasattr(node, 'time'):
                 self.timestamp = True
-
-        calc_pos = self.notimestamp_
-        if self.timestamp:
-            calc_pos = self.timestamp_
-
-        while mobility.thread_._keep_alive:
-            time_ = time() - currentTime
-            if len(nodes) == 0:
-                break
-            for node in nodes:
-                if hasattr(node, 'position'):
-                    calc_pos(node, time_)
-                    if len(node.position) == 0:
-                        nodes.remove(node)
-                    mobility.configLinks()
-                    if Mininet_wifi.DRAW:
-                        plot.update(node)
+            if trace:
+                if node.name in trace:
+                    replaying.append(node)
+            elif hasattr(node, 'position'):
+                self.load_trace(node)
+                replaying.append(node)
+
+        def apply(batch):
+            for node, idx in batch:
+                pos = node.trace.get('position', idx)
+                mobility.set_pos(node, [float(p) for p in pos])
+            mobility.configLinks()
             if Mininet_wifi.DRAW:
-                plot.pause()
+                # the renderer thread draws the new positions
+                for node, _ in batch:
+                    plot.update(node)
+
+        self.scheduler = replayScheduler(replaying, apply)
+        self.scheduler.run()
+        self.scheduler.report()
 
     @classmethod
     def addNode(cls, node):
@@ -107,77 +202,65 @@ class replayingMobility(object):
 
 class replayingBandwidth(object):
     'Replaying Bandwidth Traces'
+    scheduler = None
 
-    def __init__(self, Mininet_wifi):
+    def __init__(self, Mininet_wifi, trace=None):
         mobility.thread_ = thread(name='replayingBandwidth',
-                                       target=self.throughput, args=(Mininet_wifi,))
+                                       target=self.throughput,
+                                       args=(Mininet_wifi, trace))
         mobility.thread_.daemon = True
         mobility.thread_._keep_alive = True
         mobility.thread_.start()
 
     @classmethod
-    def throughput(cls, Mininet_wifi):
-        currentTime = time()
-        stations = Mininet_wifi.stations
-        while mobility.thread_._keep_alive:
-            if len(stations) == 0:
-                break
-            time_ = time() - currentTime
-            for sta in stations:
-                if hasattr(sta, 'time'):
-                    if time_ >= sta.time[0]:
-                        wirelessLink.config_tc(sta, 0, sta.throughput[0], 0, 0)
-                        # pos = '%d, %d, %d' % (sta.throughput[0], sta.throughput[0], 0)
-                        # self.moveStationTo(sta, pos)
-                        del sta.throughput[0]
-                        del sta.time[0]
-                        #info('%s\n' % sta.time[0])
-                    if len(sta.time) == 1:
-                        stations.remove(sta)
-            # time.sleep(0.001)
+    def throughput(cls, Mininet_wifi, trace=None):
+        stations = get_traces(Mininet_wifi.stations, trace, 'throughput')
+
+        def apply(batch):
+            for sta, idx in batch:
+                wirelessLink.config_tc(
+                    sta, 0, sta.trace.get('throughput', idx), 0, 0)
+
+        cls.scheduler = replayScheduler(stations, apply)
+        cls.scheduler.run()
+        cls.scheduler.report()
         info("\nReplaying Process Finished!")
 
 
 class replayingNetworkConditions(object):
     'Replaying Network Conditions'
+    scheduler = None
 
-    def __init__(self, Mininet_wifi, **kwargs):
+    def __init__(self, Mininet_wifi, trace=None, **kwargs):
 
         mobility.thread_ = thread( name='replayingNetConditions',
-                                        target=self.behavior, args=(Mininet_wifi,) )
+                                        target=self.behavior,
+                                        args=(Mininet_wifi, trace) )
         mobility.thread_.daemon = True
         mobility.thread_._keep_alive = True
         mobility.thread_.start()
 
     @classmethod
-    def behavior(cls, Mininet_wifi):
+    def behavior(cls, Mininet_wifi, trace=None):
         seconds = 5
         info('Replaying process starting in %s seconds\n' % seconds)
         sleep(seconds)
         info('Replaying process has been started\n')
-        currentTime = time()
-        stations = Mininet_wifi.stations
-        for sta in stations:
+        stations = get_traces(Mininet_wifi.stations, trace, 'bw', 'loss',
+                              'latency')
+        for sta in Mininet_wifi.stations:
             sta.params['freq'][0] = sta.get_freq(0)
-        while mobility.thread_._keep_alive:
-            if len(stations) == 0:
-                break
-            time_ = time() - currentTime
-            for sta in stations:
-                if hasattr(sta, 'time'):
-                    if time_ >= sta.time[0]:
-                        if sta.params['associatedTo'][0] != '':
-                            bw = sta.bw[0]
-                            loss = sta.loss[0]
-                            latency = sta.latency[0]
-                            wirelessLink.config_tc(sta, 0, bw, loss, latency)
-                        del sta.bw[0]
-                        del sta.loss[0]
-                        del sta.latency[0]
-                        del sta.time[0]
-                    if len(sta.time) == 0:
-                        stations.remove(sta)
-            sleep(0.001)
+
+        def apply(batch):
+            for sta, idx in batch:
+                if sta.params['associatedTo'][0] != '':
+                    wirelessLink.config_tc(sta, 0, sta.trace.get('bw', idx),
+                                           sta.trace.get('loss', idx),
+                                           sta.trace.get('latency', idx))
+
+        cls.scheduler = replayScheduler(stations, apply)
+        cls.scheduler.run()
+        cls.scheduler.report()
         info('Replaying process has finished!')
 
     @classmethod
@@ -195,47 +278,44 @@ class replayingRSSI(object):
     print_loss = False
     print_latency = False
     print_distance = False
+    scheduler = None
 
     def __init__(self, Mininet_wifi, propagationModel='friis',
-                 n=32, **kwargs):
+                 n=32, trace=None, **kwargs):
         """ propagationModel = Propagation Model
-            n: Power Loss Coefficient """
+            n: Power Loss Coefficient
+            trace: binary trace file """
         for key in kwargs:
             setattr(self, key, kwargs[key])
 
         mobility.thread_ = thread(name='replayingRSSI', target=self.rssi,
-                                       args=(Mininet_wifi, propagationModel, n))
+                                       args=(Mininet_wifi, propagationModel,
+                                             n, trace))
         mobility.thread_.daemon = True
         mobility.thread_._keep_alive = True
         mobility.thread_.start()
 
-    def rssi(self, Mininet_wifi, propagationModel='', n=0):
-        currentTime = time()
-        staList = Mininet_wifi.stations
+    def rssi(self, Mininet_wifi, propagationModel='', n=0, trace=None):
+        staList = get_traces(Mininet_wifi.stations, trace, 'rssi')
         ang = {}
-        for sta in staList:
+        for sta in Mininet_wifi.stations:
             ang[sta] = random.uniform(0, 360)
             sta.params['freq'][0] = sta.get_freq(0)
-        while mobility.thread_._keep_alive:
-            if len(staList) == 0:
-                break
-            time_ = time() - currentTime
-            for sta in staList:
-                if hasattr(sta, 'time'):
-                    if time_ >= sta.time[0]:
-                        ap = sta.params['associatedTo'][0]  # get AP
-                        sta.params['rssi'][0] = sta.rssi[0]
-                        if ap != '':
-                            rssi = sta.rssi[0]
-                            dist = int('%d' % self.calculateDistance(sta, ap, rssi,
-                                                                     propagationModel, n))
-                            self.setPos(Mininet_wifi, sta, ap, dist, ang[sta])
-                            wirelessLink(sta, ap, dist, wif=0, ap_wif=0)
-                        del sta.rssi[0]
-                        del sta.time[0]
-                    if len(sta.time) == 0:
-                        staList.remove(sta)
-            sleep(0.01)
+
+        def apply(batch):
+            for sta, idx in batch:
+                ap = sta.params['associatedTo'][0]  # get AP
+                rssi = float(sta.trace.get('rssi', idx))
+                sta.params['rssi'][0] = rssi
+                if ap != '':
+                    dist = int('%d' % self.calculateDistance(sta, ap, rssi,
+                                                             propagationModel, n))
+                    self.setPos(Mininet_wifi, sta, ap, dist, ang[sta])
+                    wirelessLink(sta, ap, dist, wif=0, ap_wif=0)
+
+        self.scheduler = replayScheduler(staList, apply)
+        self.scheduler.run()
+        self.scheduler.report()
 
     @classmethod
     def setPos(cls, Mininet_wifi, sta, ap, dist, ang):
@@ -7,34 +7,54 @@ telemetry(nodes, **params)
 
 **params
    * single=True - opens a single window and put all nodes together
-   * data_type - refer to statistics dir at /sys/class/ieee80211/{}/device/net/{}/statistics/{}
+   * data_type - refer to statistics dir at /sys/class/net/{}/statistics/{}
             - other data_types: rssi - gets the rssi value
+   * headless=True - no graph: the samples are exported to files
+      * data_types - list of data types sampled together
+      * interval - sampling interval (s)
+      * filename - prefix of the files (default: mn-telemetry)
+      * format - csv, jsonl or parquet
+      * batch_size - rows written at once
+      * max_rows - rows per file before a new file is started
+      * nice - niceness added to the sampling thread
 """
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import os
-import os.path
-import time
-import subprocess
 import numpy
 
-from matplotlib import style
-from os import path
 from threading import Thread as thread
 from datetime import date
 from mn_iot.mac80211.node import AP
+from mn_iot.mac80211.collector import statsCollector, telemetryExporter
+from mininet.log import info
 
+# matplotlib is only imported to draw the graph (see import_pyplot), so
+# that the headless export works without it
+plt = None
+animation = None
 
 today = date.today()
-style.use('fivethirtyeight')
-start = time.time()
-util_dir = str(os.path.realpath(__file__))[:-21] + 'util/m'
+
+
+def import_pyplot():
+    "Imports matplotlib for the graph"
+    global plt, animation
+    if plt is None:
+        import matplotlib.pyplot as pyplot
+        import matplotlib.animation
+        from matplotlib import style
+        style.use('fivethirtyeight')
+        plt, animation = pyplot, matplotlib.animation
+
 
 class telemetry(object):
-    tx = {}
     nodes = []
+    collector = None
+    exporter = None
 
     def __init__(self, **kwargs):
+        if kwargs.pop('headless', False):
+            self.start_headless(**kwargs)
+            return
+        import_pyplot()
         parseData.thread_ = thread(target=self.start, kwargs=(kwargs))
         parseData.thread_.daemon = True
         parseData.thread_._keep_alive = True
@@ -71,94 +91,39 @@ class telemetry(object):
         parseData(nodes, fig, self.axes, single=single, data_type=data_type)
 
     @classmethod
-    def calc(cls, tx_bytes, n):
-        if n not in cls.tx:
-            a = 0
-        else:
-            a = tx_bytes - cls.tx[n]
-        cls.tx[n] = tx_bytes
-        return a
+    def start_headless(cls, nodes=None, data_types=None, data_type=None,
+                       interval=1, filename='mn-telemetry', format='csv',
+                       batch_size=100, max_rows=0, nice=10, **kwargs):
+        "Samples the data types and exports them without any graph"
+        if not data_types:
+            data_types = [data_type or 'tx_packets']
+        cls.nodes = nodes
+        cls.collector = statsCollector(nodes, data_types, interval=interval,
+                                       nice=nice)
+        cls.exporter = telemetryExporter(cls.collector, filename=filename,
+                                         format=format, batch_size=batch_size,
+                                         max_rows=max_rows)
+        cls.collector.start()
 
     @classmethod
-    def get_ifaces(cls, nodes, inNamespaceNodes, phys):
-        cmd = 'ls /sys/class/ieee80211/{}/device/net/'
-        ifaces = {}
-        j = 0
-        wif = 1
-        for phy in phys:
-            try:
-                ifaces_ = subprocess.check_output(cmd.format(phy), stderr=subprocess.PIPE,
-                                                  shell=True).split("\n")
-            except:
-                node = inNamespaceNodes[j]
-                ifaces_ = subprocess.check_output('%s %s %s' % (util_dir, node, cmd.format(phy)),
-                                                  shell=True).split("\n")
-            ifaces_.pop()
-            if nodes[j] not in ifaces:
-                ifaces[nodes[j]] = []
-            ifaces[nodes[j]].append(ifaces_.pop())
-
-            if wif == len(nodes[j].params['wif']):
-                j += 1
-                wif = 1
-            else:
-                wif += 1
-
-        return ifaces
-
-    @classmethod
-    def get_phys(cls, nodes, inNamespaceNodes):
-        cmd = 'ls /sys/class/ieee80211/'
-        isAP = False
-        phys = []
-        for node in nodes:
-            if isinstance(node, AP) and not isAP:
-                phys += subprocess.check_output(cmd,
-                                                shell=True).split("\n")
-                isAP = True
-            else:
-                if not isinstance(node, AP):
-                    phys += subprocess.check_output('%s %s %s' % (util_dir, node, cmd),
-                                                    shell=True).split("\n")
-        phy_list = []
-        phys = sorted(phys)
-        for phy in phys:
-            if 'mn' in phy:
-                phy_list.append(phy)
-
-        ifaces = cls.get_ifaces(nodes, inNamespaceNodes, phy_list)
-        return phy_list, ifaces
-
-def get_position(node, filename):
-    x = node.params['position'][0]
-    y = node.params['position'][1]
-    os.system("echo '%s,%s' >> %s" % (x, y, filename.format(node)))
-
-def get_rssi(node, iface, time, filename):
-    if isinstance(node, AP):
-        rssi = 0
-    else:
-        cmd = "{} {} iw dev {} link | grep signal | tr -d signal: | awk '{{print $1 $3}}'"
-        rssi = subprocess.check_output('%s' % (cmd.format(util_dir, node, iface)),
-                                       shell=True).split("\n")
-        if not rssi[0]:
-            rssi = 0
-        else:
-            rssi = rssi[0]
-    os.system("echo '%s,%s' >> %s" % (time, rssi, filename.format(node)))
-
-
-def get_values_from_statistics(tx_bytes, time, node, filename):
-    tx = telemetry.calc(float(tx_bytes[0]), node)
-    os.system("echo '%s,%s' >> %s" % (time, tx, filename.format(node)))
+    def stop(cls):
+        "Stops the headless export and reports the collector overhead"
+        if not cls.collector:
+            return
+        cls.collector.stop()
+        cls.exporter.close()
+        stats = cls.collector.get_stats()
+        info('*** Telemetry: %d samples, overhead %.2f%%, mean sample '
+             '%.2fms, max drift %.2fms\n'
+             % (stats['samples'], stats['overhead'] * 100,
+                stats['mean_duration'] * 1000, stats['max_drift'] * 1000))
+        cls.collector = cls.exporter = None
 
 
 class parseData(object):
 
     nodes = []
-    phys = []
     colors = []
-    ifaces = {}
     min_x = 0
     min_y = 0
     max_x = 100
@@ -170,28 +135,32 @@ class parseData(object):
     ani = None
     filename = None
     thread_ = None
-    dir = 'cat /sys/class/ieee80211/{}/device/net/{}/statistics/{}'
+    collector = None
+    files = {}  # node -> open file the samples are exported to
+    exported = {}  # (node, wif) -> number of samples already exported
 
     def __init__(self, nodes, fig, axes, single, data_type):
+        import_pyplot()
         self.start(nodes, fig, axes, single, data_type)
 
     @classmethod
     def fig_exists(cls):
-        return plt.fignum_exists(1)
+        return plt is not None and plt.fignum_exists(1)
 
     def animate(self, i):
         axes = self.axes
-        now = time.time() - start
         nodes_x = {}
         nodes_y = {}
         names = []
 
         if not self.thread_._keep_alive:
+            self.stop()
             try:
                 if self.data_type != 'position':
                     plt.close()
             except:
                 pass
+            return
 
         for node in self.nodes:
             for wif in range(0, len(node.params['wif'])):
@@ -199,40 +168,14 @@ class parseData(object):
                     if node.name not in names:
                         names.append(node.name)
                 else:
-                    names.append(self.ifaces[node][wif])
-                nodes_x[node] = []
-                nodes_y[node] = []
-                arr = self.nodes.index(node)
-
-                if self.data_type != 'rssi' and self.data_type != 'position':
-                    if isinstance(node, AP):
-                        tx_bytes = subprocess.check_output(
-                            ("%s" % self.dir).format(self.phys[arr],
-                                                     self.ifaces[node][wif],
-                                                     self.data_type),
-                            shell=True).split("\n")
-                    else:
-                        tx_bytes = subprocess.check_output(
-                            '%s %s ' % (util_dir, node) +
-                            ('%s' % self.dir).format(self.phys[arr],
-                                                     self.ifaces[node][wif],
-                                                     self.data_type),
-                            shell=True).split("\n")
-
-                if self.data_type == 'rssi':
-                    get_rssi(node, self.ifaces[node][wif], now, self.filename)
-                elif self.data_type == 'position':
-                    get_position(node, self.filename)
-                else:
-                    get_values_from_statistics(tx_bytes, now, node, self.filename)
-
-                graph_data = open('%s' % (self.filename.format(node)), 'r').read()
-                lines = graph_data.split('\n')
-                for line in lines:
-                    if len(line) > 1:
-                        x, y = line.split(',')
-                        nodes_x[node].append(float(x))
-                        nodes_y[node].append(float(y))
+                    names.append(node.params['wif'][wif])
+                times, values = self.collector.get(node, wif, self.data_type)
+                if self.data_type not in ['rssi', 'position']:
+                    # counters are plotted as the difference between samples
+                    times, values = times[1:], numpy.diff(values)
+                self.export(node, wif)
+                nodes_x[node] = times
+                nodes_y[node] = values
 
         if self.data_type == 'position':
             axes.clear()
@@ -267,6 +210,37 @@ class parseData(object):
                     node = self.nodes[id]
                     ax.plot(nodes_x[node], nodes_y[node], color=self.colors[id])
 
+    def stop(self):
+        "Stops the collector and closes the exported files"
+        self.collector.stop()
+        for file_ in self.files.values():
+            file_.close()
+        self.files.clear()
+
+    def export(self, node, wif):
+        "Appends the new samples to the file of the node"
+        since = self.exported.get((node, wif), 0)
+        self.exported[(node, wif)] = self.collector.count(node, wif,
+                                                          self.data_type)
+        if self.data_type == 'position':
+            pos = node.params['position']
+            lines = ['%s,%s\n' % (pos[0], pos[1])]
+        elif self.data_type == 'rssi':
+            times, values = self.collector.get(node, wif, self.data_type,
+                                               since=since)
+            lines = ['%s,%s\n' % (t, v) for t, v in zip(times, values)]
+        else:
+            # the previous sample is needed for the difference
+            times, values = self.collector.get(node, wif, self.data_type,
+                                               since=max(since - 1, 0))
+            lines = []
+            if since == 0 and len(times):
+                lines.append('%s,0\n' % times[0])
+            lines += ['%s,%s\n' % (t, v) for t, v
+                      in zip(times[1:], numpy.diff(values))]
+        self.files[node].writelines(lines)
+        self.files[node].flush()
+
     def start(self, nodes, fig, axes, single, data_type):
         self.nodes = nodes
         self.fig = fig
@@ -275,17 +249,15 @@ class parseData(object):
         self.data_type = data_type
         self.filename = '%s-{}-mn-telemetry.txt' % data_type
 
-        inNamespaceNodes = []
         for node in nodes:
             self.colors.append(numpy.random.rand(3,))
             node.circle = 'b'
             if not isinstance(node, AP):
-                inNamespaceNodes.append(node)
                 node.circle = 'g'
 
-        self.phys, self.ifaces = telemetry.get_phys(nodes, inNamespaceNodes)
         for node in nodes:
-            if path.exists('%s' % (self.filename.format(node))):
-                os.system('rm %s' % (self.filename.format(node)))
+            self.files[node] = open(self.filename.format(node), 'w')
+        self.collector = statsCollector(nodes, [data_type], interval=1)
+        self.collector.start()
         self.ani = animation.FuncAnimation(fig, self.animate, interval=1000)
         plt.show()
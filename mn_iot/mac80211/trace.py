@@ -0,0 +1,179 @@
+"""Traces replayed by the replaying classes: the samples of a node in
+numpy arrays (traceCursor) and the memory-mapped binary trace format.
+It only depends on numpy, so that traces may be converted without the
+rest of mn_iot (see util/convert_trace.py)"""
+
+import json
+import os
+import shutil
+import struct
+
+import numpy as np
+
+
+def get_times(count, speed):
+    """Returns the times of the samples of an untimed trace: int(speed)
+    samples are replayed per second, starting at 1/speed"""
+    return float(1.0 / speed) + \
+        np.arange(count) // max(int(speed), 1)
+
+
+class traceCursor(object):
+    """Trace of a node loaded into numpy arrays. The trace is not consumed:
+    an integer cursor points to the next sample and the samples due are
+    found by binary search on the times
+    :param times: time of each sample (s), in increasing order
+    :param columns: values of each sample, e.g. position=[(x, y, z), ...]"""
+
+    def __init__(self, times, **columns):
+        self.times = np.asarray(times, dtype=float)
+        self.columns = {}
+        for key, values in columns.items():
+            self.columns[key] = np.asarray(values, dtype=float)
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def done(self):
+        return self.cursor >= len(self.times)
+
+    def next_time(self):
+        "Returns the time of the next sample"
+        return self.times[self.cursor]
+
+    def advance(self, time_):
+        """Moves the cursor past the samples due at time_
+        :return: the index of the last sample due or None"""
+        if self.done() or self.times[self.cursor] > time_:
+            return None
+        end = self.cursor + int(np.searchsorted(self.times[self.cursor:],
+                                                time_, side='right'))
+        self.cursor = end
+        return end - 1
+
+    def get(self, key, idx):
+        return self.columns[key][idx]
+
+
+class binaryTrace(object):
+    """Memory-mapped binary trace. The file holds a JSON header with the
+    record dtype and the range of records of each node, followed by the
+    records sorted by node and time: node id, time, position (x, y, z)
+    and optional columns (bw, loss, latency, rssi, throughput). The
+    columns are read as views of the mapping, so no sample is loaded
+    before it is replayed
+    :param filename: trace file written by binaryTrace.convert/write"""
+
+    magic = b'MNTRACE1'
+    optional = ['bw', 'loss', 'latency', 'rssi', 'throughput']
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            if f.read(len(self.magic)) != self.magic:
+                raise ValueError('%s is not a binary trace' % filename)
+            size = struct.unpack('<I', f.read(4))[0]
+            header = json.loads(f.read(size).decode())
+        self.nodes = dict((name, tuple(rng))
+                          for name, rng in header['nodes'].items())
+        # untimed traces were converted without a time column
+        self.timed = header.get('timed', True)
+        self.dtype = self.get_dtype(header['columns'])
+        self.records = np.memmap(filename, dtype=self.dtype, mode='r',
+                                 offset=header['offset'],
+                                 shape=(header['count'],))
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    @classmethod
+    def get_dtype(cls, columns):
+        return np.dtype([('node', '<u4'), ('time', '<f8'),
+                         ('position', '<f8', (3,))] +
+                        [(column, '<f8') for column in columns])
+
+    def get(self, name):
+        "Returns the records of a node"
+        start, end = self.nodes[name]
+        return self.records[start:end]
+
+    def cursor(self, name, *columns, **kwargs):
+        """Returns a traceCursor over the records of a node
+        :param columns: columns replayed, e.g. 'position' or 'rssi'
+        :param speed: samples replayed per second if the trace is untimed,
+        as for the text traces"""
+        records = self.get(name)
+        times = records['time']
+        speed = kwargs.get('speed')
+        if speed and not self.timed:
+            times = get_times(len(records), speed)
+        return traceCursor(times, **dict(
+            (column, records[column]) for column in columns))
+
+    @classmethod
+    def write(cls, filename, traces, columns=(), timed=True):
+        """Writes a binary trace
+        :param traces: list of (node name, iterable of records), each record
+        being (time, x, y, z) followed by the values of columns
+        :param columns: optional columns of the records
+        :param timed: False if the times are only the sample order"""
+        dtype = cls.get_dtype(columns)
+        nodes = {}
+        count = 0
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as data:
+            for node_id, (name, records) in enumerate(traces):
+                arr = np.array([(node_id, r[0], r[1:4]) + tuple(r[4:])
+                                for r in records], dtype=dtype)
+                arr = arr[np.argsort(arr['time'], kind='stable')]
+                data.write(arr.tobytes())
+                nodes[name] = (count, count + len(arr))
+                count += len(arr)
+        header = {'columns': list(columns), 'nodes': nodes, 'count': count,
+                  'timed': timed}
+        # the offset depends on the header size, which includes the offset
+        size = len(json.dumps(dict(header, offset=0)))
+        offset = len(cls.magic) + 4 + size + 16
+        offset += -offset % 8
+        header['offset'] = offset
+        body = json.dumps(header).encode()
+        body += b' ' * (offset - len(cls.magic) - 4 - len(body))
+        with open(filename, 'wb') as f:
+            f.write(cls.magic)
+            f.write(struct.pack('<I', len(body)))
+            f.write(body)
+            with open(tmp, 'rb') as data:
+                shutil.copyfileobj(data, f)
+        os.remove(tmp)
+
+    @classmethod
+    def read_text(cls, filename, fields, interval=1.0):
+        """Reads a text trace with one sample per line
+        :param fields: name of each column of the file: time, x, y, z or
+        one of the optional columns
+        :param interval: time between samples if there is no time column"""
+        with open(filename) as f:
+            for i, line in enumerate(f):
+                values = line.replace(',', ' ').split()
+                if not values:
+                    continue
+                sample = dict(zip(fields, [float(v) for v in values]))
+                yield sample.get('time', (i + 1) * interval), sample
+
+    @classmethod
+    def convert(cls, filename, files, fields, interval=1.0):
+        """Converts text traces into a binary trace
+        :param files: dict of node name -> text trace
+        :param fields: name of each column of the text traces, e.g.
+        ['x', 'y'] for mobility or ['time', 'rssi']
+        :param interval: time between samples if there is no time column"""
+        columns = [field for field in fields if field in cls.optional]
+
+        def records(text):
+            for time_, sample in cls.read_text(text, fields, interval):
+                yield (time_, sample.get('x', 0), sample.get('y', 0),
+                       sample.get('z', 0)) + \
+                    tuple(sample[column] for column in columns)
+        cls.write(filename, [(name, records(text))
+                             for name, text in sorted(files.items())],
+                  columns, timed='time' in fields)
@@ -350,6 +350,7 @@ class vanet(object):
 
             car.params['position'] = pos_x, pos_y, 0
             car.set_pos_wmediumd(car.params['position'])
+            mobility.set_dirty([car])
             angle = car.prop[2]
 
             # calculate new position of the car
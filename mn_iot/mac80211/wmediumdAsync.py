@@ -0,0 +1,234 @@
+"""asyncio client for the wmediumd server (Python 3 only)"""
+
+import asyncio
+import concurrent.futures
+from collections import deque
+from threading import Thread as thread
+
+from mininet.log import error
+from mn_iot.mac80211.wmediumdConnector import w_cst, w_server, \
+    WmediumdException
+
+
+class w_async_server(object):
+    """Pipelines the requests to the wmediumd server through a send queue
+    and matches each response to its request by type and mac address.
+    The event loop runs in its own thread, so the synchronous methods
+    (send, send_batch, update_nowait) may be called from any other thread.
+    It is used by w_server when w_server.use_async is True"""
+
+    # request type -> size of the key (mac addresses or id) after the type
+    key_size = {
+        w_cst.WSERVER_SNR_UPDATE_REQUEST_TYPE: 12,
+        w_cst.WSERVER_DEL_BY_MAC_REQUEST_TYPE: 6,
+        w_cst.WSERVER_DEL_BY_ID_REQUEST_TYPE: 4,
+        w_cst.WSERVER_ADD_REQUEST_TYPE: 6,
+        w_cst.WSERVER_ERRPROB_UPDATE_REQUEST_TYPE: 12,
+        w_cst.WSERVER_SPECPROB_UPDATE_REQUEST_TYPE: 12,
+        w_cst.WSERVER_POS_UPDATE_REQUEST_TYPE: 6,
+        w_cst.WSERVER_TXPOWER_UPDATE_REQUEST_TYPE: 6,
+        w_cst.WSERVER_GAIN_UPDATE_REQUEST_TYPE: 6,
+        w_cst.WSERVER_HEIGHT_UPDATE_REQUEST_TYPE: 6,
+        w_cst.WSERVER_GAUSSIAN_RANDOM_UPDATE_REQUEST_TYPE: 6}
+    loop = None
+    thread_ = None
+    reader = None
+    writer = None
+    queue = None
+    tasks = []
+    pending = {}  # (response type, key) -> futures waiting for a response
+    closed = None  # exception raised by the requests once disconnected
+    timeout = 10  # seconds to wait for a response in the sync methods
+
+    @classmethod
+    def connect(cls, uds_address=w_cst.SOCKET_PATH):
+        """Starts the event loop and connects to the wmediumd server
+        :param uds_address: The UNIX domain socket"""
+        cls.loop = asyncio.new_event_loop()
+        cls.thread_ = thread(name='wmediumdAsync', target=cls.loop.run_forever)
+        cls.thread_.daemon = True
+        cls.thread_.start()
+        cls.run(cls.start(uds_address))
+
+    @classmethod
+    def disconnect(cls):
+        "Closes the connection and stops the event loop"
+        if not cls.closed:
+            cls.run(cls.stop())
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.thread_.join()
+        cls.loop.close()
+        cls.loop = None
+
+    @classmethod
+    def run(cls, coro):
+        "Runs coro in the event loop and waits for its result"
+        if cls.closed:
+            coro.close()
+            raise cls.closed
+        future = asyncio.run_coroutine_threadsafe(coro, cls.loop)
+        try:
+            return future.result(cls.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise WmediumdException("No response from wmediumd")
+
+    @classmethod
+    async def start(cls, uds_address):
+        cls.reader, cls.writer = \
+            await asyncio.open_unix_connection(uds_address)
+        cls.queue = asyncio.Queue()
+        cls.pending = {}
+        cls.closed = None
+        cls.tasks = [cls.loop.create_task(cls.sender()),
+                     cls.loop.create_task(cls.receiver())]
+
+    @classmethod
+    async def stop(cls):
+        cls.close(WmediumdException("Disconnected from wmediumd"))
+
+    @classmethod
+    def close(cls, exception):
+        """Closes the connection. The waiting and the later requests fail
+        with exception. It must be called from the event loop thread"""
+        if cls.closed:
+            return
+        cls.closed = exception
+        for task in cls.tasks:
+            if task is not asyncio.current_task(cls.loop):
+                task.cancel()
+        cls.writer.close()
+        cls.fail_pending(exception)
+
+    @classmethod
+    def fail_pending(cls, exception):
+        futures = [future for futures in cls.pending.values()
+                   for future in futures]
+        while not cls.queue.empty():
+            futures.append(cls.queue.get_nowait()[1])
+        for future in futures:
+            if not future.done():
+                future.set_exception(exception)
+        cls.pending = {}
+
+    @classmethod
+    def get_key(cls, request):
+        "Returns the (response type, key) of a request"
+        size = cls.key_size[request[0]]
+        return request[0] + 1, bytes(request[1:1 + size])
+
+    @classmethod
+    def get_response_key(cls, data):
+        "Returns the (response type, key) of a response"
+        resp_type = data[0]
+        size = cls.key_size[resp_type - 1]
+        # responses echo the request, except for specprob
+        offset = 2
+        if resp_type == w_cst.WSERVER_SPECPROB_UPDATE_RESPONSE_TYPE:
+            offset = 1
+        return resp_type, bytes(data[offset:offset + size])
+
+    @classmethod
+    async def sender(cls):
+        "Writes the queued requests to the socket"
+        while True:
+            request, future = await cls.queue.get()
+            cls.pending.setdefault(cls.get_key(request), deque()).append(future)
+            cls.writer.write(request)
+            if cls.queue.empty():
+                await cls.writer.drain()
+
+    @classmethod
+    async def receiver(cls):
+        "Reads the responses and wakes up the requests waiting for them"
+        try:
+            while True:
+                resp_type = (await cls.reader.readexactly(1))[0]
+                try:
+                    resp_struct = w_server.get_response_struct(resp_type)
+                except KeyError:
+                    # the size of the response is unknown, so the stream
+                    # cannot be resynchronized
+                    error('%s Received response of unknown type %d\n'
+                          % (w_cst.LOG_PREFIX, resp_type))
+                    cls.close(WmediumdException(
+                        "Received response of unknown type %d" % resp_type))
+                    return
+                data = bytes([resp_type]) + \
+                    await cls.reader.readexactly(resp_struct.size - 1)
+                key = cls.get_response_key(data)
+                futures = cls.pending.get(key)
+                if not futures:
+                    error('%s Received unexpected response of type %d\n'
+                          % (w_cst.LOG_PREFIX, resp_type))
+                    continue
+                future = futures.popleft()
+                if not futures:
+                    del cls.pending[key]
+                if not future.done():
+                    future.set_result(resp_struct.unpack(data))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            cls.close(WmediumdException("Connection to wmediumd lost"))
+
+    @classmethod
+    async def request(cls, request):
+        """Queues a packed request and waits for its response
+        :param request: request created by w_server
+        :return: the unpacked response"""
+        if cls.closed:
+            raise cls.closed
+        future = cls.loop.create_future()
+        cls.queue.put_nowait((request, future))
+        return await future
+
+    @classmethod
+    async def update(cls, update):
+        """Sends an update and waits for its response
+        :param update: w_pos, w_txpower, w_gain, w_height, WmediumdGRandom
+        or SNRLink object
+        :return: A WUPDATE_* constant"""
+        request = w_server.create_request(update)[0]
+        return (await cls.request(request))[-1]
+
+    @classmethod
+    async def update_all(cls, updates):
+        """Sends many updates at once
+        :return: list of WUPDATE_* constants"""
+        return await asyncio.gather(*[cls.update(update)
+                                      for update in updates])
+
+    @classmethod
+    def update_nowait(cls, update):
+        """Sends an update without waiting for its response. Errors are
+        logged. It may be called from any thread"""
+        future = asyncio.run_coroutine_threadsafe(cls.update(update), cls.loop)
+        future.add_done_callback(cls.check_update)
+
+    @classmethod
+    def check_update(cls, future):
+        try:
+            ret = future.result()
+        except Exception as e:
+            error('%s %s\n' % (w_cst.LOG_PREFIX, e))
+            return
+        if ret != w_cst.WUPDATE_SUCCESS:
+            error('%s Received error code from wmediumd: code %d\n'
+                  % (w_cst.LOG_PREFIX, ret))
+
+    @classmethod
+    def send(cls, request):
+        """Sends a packed request and waits for its response. It must not
+        be called from the event loop thread
+        :return: the unpacked response"""
+        return cls.run(cls.request(request))
+
+    @classmethod
+    def send_batch(cls, batch):
+        """Sends many packed requests at once
+        :param batch: list of (request, expected response type, response
+        struct)
+        :return: list of WUPDATE_* constants"""
+        async def requests():
+            return await asyncio.gather(*[cls.request(request)
+                                          for request, _, _ in batch])
+        return [resp[-1] for resp in cls.run(requests())]
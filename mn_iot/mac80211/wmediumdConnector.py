@@ -11,6 +11,7 @@ import subprocess
 import signal
 import time
 import struct
+import threading
 import pkg_resources
 from sys import version_info as py_version_info
 
@@ -241,101 +242,19 @@ class w_starter(object):
         if cls.is_connected:
             raise WmediumdException("w_starter is already connected")
 
-        mappedintf = {}
         mappedlinks = {}
         if wmediumd_mode.mode != w_cst.INTERFERENCE_MODE:
-            # Map all links using the interface id and check for missing
-            # interfaces in the  intfrefs list
-            for link in kwargs['links']:
-                link_id = link.sta1intf.id() + '/' + link.sta2intf.id()
-                mappedlinks[link_id] = link
-                found1 = False
-                found2 = False
-                for intfref in kwargs['intfrefs']:
-                    if link.sta1intf.get_station_name() == \
-                            intfref.get_station_name():
-                        if link.sta1intf.get_station_name() == \
-                                intfref.get_station_name():
-                            found1 = True
-                    if link.sta2intf.get_station_name() == \
-                            intfref.get_station_name():
-                        if link.sta2intf.get_station_name() == \
-                                intfref.get_station_name():
-                            found2 = True
-                if not found1:
-                    raise WmediumdException('%s is not part of the managed '
-                                            'interfaces'
-                                            % link.sta1intf.id())
-                    pass
-                if not found2:
-                    raise WmediumdException('%s is not part of the managed '
-                                            'interfaces'
-                                            % link.sta2intf.id())
-
-        if wmediumd_mode.mode is not w_cst.SPECPROB_MODE:
-            if wmediumd_mode.mode is not w_cst.INTERFERENCE_MODE:
-                for intfref1 in kwargs['intfrefs']:
-                    for intfref2 in kwargs['intfrefs']:
-                        if intfref1 is not intfref2:
-                            link_id = intfref1.id() + '/' + \
-                                      intfref2.id()
-                            if wmediumd_mode.mode == \
-                                    w_cst.ERRPROB_MODE:
-                                mappedlinks.setdefault(
-                                    link_id, ERRPROBLink(
-                                        intfref1, intfref2,
-                                        cls.default_auto_errprob))
-                            else:
-                                mappedlinks.setdefault(
-                                    link_id, SNRLink(
-                                        intfref1, intfref2,
-                                        cls.default_auto_snr))
+            mappedlinks = cls.get_mapped_links(kwargs['links'],
+                                               kwargs['intfrefs'])
 
+        if wmediumd_mode.mode != w_cst.SPECPROB_MODE:
             # Create wmediumd config
             wmd_config = tempfile.NamedTemporaryFile(
-                prefix='mn_wmd_config_', suffix='.cfg', delete=False)
+                mode='w', prefix='mn_wmd_config_', suffix='.cfg',
+                delete=False)
             cls.wmd_config_name = wmd_config.name
             debug("Name of wmediumd config: %s\n" % cls.wmd_config_name)
-            configstr = 'ifaces:\n{\n\tids = [\n'
-            intfref_id = 0
-            for intfref in kwargs['intfrefs']:
-                if intfref_id != 0:
-                    configstr += ', \n'
-                grepped_mac = intfref.get_mac()
-                configstr += '\t\t"%s"' % grepped_mac
-                mappedintf[intfref.id()] = intfref_id
-                intfref_id += 1
-
-            if wmediumd_mode.mode is w_cst.INTERFERENCE_MODE:
-                set_interference(configstr, kwargs['ppm'], kwargs['pos'],
-                                 kwargs['txpowers'], kwargs['fading_coefficient'],
-                                 kwargs['noise_threshold'], kwargs['isnodeaps'])
-                configstr = cls.configstr
-            else:
-                configstr += '\n\t];\n};\nmodel:\n{\n\ttype = "'
-                if wmediumd_mode.mode == w_cst.ERRPROB_MODE:
-                    configstr += 'prob'
-                else:
-                    configstr += 'snr'
-                configstr += '";\n\tdefault_prob = 1.0;\n\tlinks = ('
-                first_link = True
-                for mappedlink in mappedlinks.values():
-                    id1 = mappedlink.sta1intf.id()
-                    id2 = mappedlink.sta2intf.id()
-                    if first_link:
-                        first_link = False
-                    else:
-                        configstr += ','
-                    if wmediumd_mode.mode == w_cst.ERRPROB_MODE:
-                        configstr += '\n\t\t(%d, %d, %f)' % (
-                            mappedintf[id1], mappedintf[id2],
-                            mappedlink.errprob)
-                    else:
-                        configstr += '\n\t\t(%d, %d, %d)' % (
-                            mappedintf[id1], mappedintf[id2],
-                            mappedlink.snr)
-                configstr += '\n\t);\n};'
-            wmd_config.write(configstr.encode())
+            cls.write_config(wmd_config, mappedlinks, **kwargs)
             wmd_config.close()
         # Start wmediumd using the created config
         cmdline = ['wmediumd']
@@ -365,6 +284,76 @@ class w_starter(object):
                                            preexec_fn=os.setpgrp)
         cls.is_connected = True
 
+    @classmethod
+    def get_mapped_links(cls, links, intfrefs):
+        """Maps the links using the interface ids and checks for missing
+        interfaces in the intfrefs list
+        :param links: list of SNRLink or ERRPROBLink
+        :param intfrefs: list of WmediumdIntfRef"""
+        names = set(intfref.get_station_name() for intfref in intfrefs)
+        mappedlinks = {}
+        for link in links:
+            link_id = link.sta1intf.id() + '/' + link.sta2intf.id()
+            mappedlinks[link_id] = link
+            for intf in [link.sta1intf, link.sta2intf]:
+                if intf.get_station_name() not in names:
+                    raise WmediumdException('%s is not part of the managed '
+                                            'interfaces' % intf.id())
+        return mappedlinks
+
+    @classmethod
+    def write_config(cls, f, mappedlinks, **kwargs):
+        """Writes the wmediumd config to f. Only the given links are
+        written in errprob mode, default_prob covers the other ones. In
+        snr mode the default links are generated one row at a time
+        :param f: file
+        :param mappedlinks: dict of link id -> link"""
+        mappedintf = {}
+        f.write('ifaces:\n{\n\tids = [\n')
+        for intfref_id, intfref in enumerate(kwargs['intfrefs']):
+            if intfref_id != 0:
+                f.write(', \n')
+            f.write('\t\t"%s"' % intfref.get_mac())
+            mappedintf[intfref.id()] = intfref_id
+
+        if wmediumd_mode.mode == w_cst.INTERFERENCE_MODE:
+            set_interference('', kwargs['ppm'], kwargs['pos'],
+                             kwargs['txpowers'], kwargs['fading_coefficient'],
+                             kwargs['noise_threshold'], kwargs['isnodeaps'])
+            f.write(cls.configstr)
+            return
+
+        if wmediumd_mode.mode == w_cst.ERRPROB_MODE:
+            f.write('\n\t];\n};\nmodel:\n{\n\ttype = "prob";'
+                    '\n\tdefault_prob = %f;\n\tlinks = ('
+                    % cls.default_auto_errprob)
+        else:
+            f.write('\n\t];\n};\nmodel:\n{\n\ttype = "snr";'
+                    '\n\tdefault_prob = 1.0;\n\tlinks = (')
+        sep = '\n'
+        for mappedlink in mappedlinks.values():
+            id1 = mappedintf[mappedlink.sta1intf.id()]
+            id2 = mappedintf[mappedlink.sta2intf.id()]
+            if wmediumd_mode.mode == w_cst.ERRPROB_MODE:
+                f.write('%s\t\t(%d, %d, %f)' % (sep, id1, id2,
+                                                  mappedlink.errprob))
+            else:
+                f.write('%s\t\t(%d, %d, %d)' % (sep, id1, id2,
+                                                  mappedlink.snr))
+            sep = ',\n'
+        if wmediumd_mode.mode == w_cst.SNR_MODE:
+            # wmediumd has no default snr, so write the other links
+            ids = [intfref.id() for intfref in kwargs['intfrefs']]
+            for id1 in ids:
+                row = ['\t\t(%d, %d, %d)' % (mappedintf[id1], mappedintf[id2],
+                                             cls.default_auto_snr)
+                       for id2 in ids if id1 != id2
+                       and id1 + '/' + id2 not in mappedlinks]
+                if row:
+                    f.write(sep + ',\n'.join(row))
+                    sep = ',\n'
+        f.write('\n\t);\n};')
+
     @classmethod
     def start_managed(cls):
         """Start the connector in managed mode, which means disconnect and
@@ -715,8 +704,32 @@ class w_server(object):
     __station_add_response_struct = \
         struct.Struct('!' + __station_add_response_fmt)
 
+    __response_structs = {
+        w_cst.WSERVER_SNR_UPDATE_RESPONSE_TYPE: __snr_update_response_struct,
+        w_cst.WSERVER_POS_UPDATE_RESPONSE_TYPE: __pos_update_response_struct,
+        w_cst.WSERVER_TXPOWER_UPDATE_RESPONSE_TYPE:
+            __txpower_update_response_struct,
+        w_cst.WSERVER_GAIN_UPDATE_RESPONSE_TYPE: __gain_update_response_struct,
+        w_cst.WSERVER_GAUSSIAN_RANDOM_UPDATE_RESPONSE_TYPE:
+            __gaussian_random_update_response_struct,
+        w_cst.WSERVER_HEIGHT_UPDATE_RESPONSE_TYPE:
+            __height_update_response_struct,
+        w_cst.WSERVER_ERRPROB_UPDATE_RESPONSE_TYPE:
+            __errprob_update_response_struct,
+        w_cst.WSERVER_SPECPROB_UPDATE_RESPONSE_TYPE:
+            __specprob_update_response_struct,
+        w_cst.WSERVER_DEL_BY_MAC_RESPONSE_TYPE:
+            __station_del_by_mac_response_struct,
+        w_cst.WSERVER_DEL_BY_ID_RESPONSE_TYPE:
+            __station_del_by_id_response_struct,
+        w_cst.WSERVER_ADD_RESPONSE_TYPE: __station_add_response_struct}
+
     sock = None
     connected = False
+    use_async = False  # use w_async_server to talk to wmediumd
+    client = None  # w_async_server when it is connected
+    lock = threading.RLock()  # the socket is shared among threads
+    __local = threading.local()  # updates queued by start_batch
 
     @classmethod
     def connect(cls, uds_address=w_cst.SOCKET_PATH):
@@ -727,6 +740,14 @@ class w_server(object):
         """
         if cls.connected:
             raise WmediumdException("Already connected to wmediumd server")
+        if cls.use_async:
+            from mn_iot.mac80211.wmediumdAsync import w_async_server
+            info('*** Connecting to wmediumd server %s\n' % uds_address)
+            time.sleep(1)
+            w_async_server.connect(uds_address)
+            cls.client = w_async_server
+            cls.connected = True
+            return
         cls.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         info('*** Connecting to wmediumd server %s\n' % uds_address)
         time.sleep(1)
@@ -741,7 +762,11 @@ class w_server(object):
         """
         if not cls.connected:
             raise WmediumdException("Not yet connected to wmediumd server")
-        cls.sock.close()
+        if cls.client:
+            cls.client.disconnect()
+            cls.client = None
+        else:
+            cls.sock.close()
         cls.connected = False
 
     @classmethod
@@ -881,6 +906,140 @@ class w_server(object):
             raise WmediumdException("Received error code from wmediumd: "
                                     "code %d" % ret)
 
+    @classmethod
+    def start_batch(cls):
+        """
+        Queue the updates sent by the current thread until flush_batch is
+        called, instead of waiting for a response to each of them
+        """
+        cls.__local.batch = []
+
+    @classmethod
+    def flush_batch(cls):
+        # type: () -> None
+        """
+        Send the updates queued since start_batch. The current thread
+        leaves batch mode even if sending fails, so it must be called in
+        a finally clause
+        """
+        batch = getattr(cls.__local, 'batch', None)
+        cls.__local.batch = None
+        if batch:
+            cls.__check_responses(cls.__send_batch(batch))
+
+    @classmethod
+    def update_batch(cls, updates):
+        # type: (list) -> None
+        """
+        Send many updates at once and read their responses in bulk
+        :param updates: list of w_pos, w_txpower, w_gain, w_height,
+        WmediumdGRandom and SNRLink objects
+        """
+        batch = []
+        for update in updates:
+            batch.append(cls.create_request(update))
+        cls.__check_responses(cls.__send_batch(batch))
+
+    @classmethod
+    def create_request(cls, update):
+        # type: (object) -> (str, int, struct.Struct)
+        """
+        Pack an update
+        :param update: w_pos, w_txpower, w_gain, w_height, WmediumdGRandom
+        or SNRLink object
+        :return: the request, the expected response type and struct
+        """
+        if isinstance(update, w_pos):
+            pos = update.sta_pos
+            return (cls.__create_pos_update_request(
+                        update, pos[0], pos[1], pos[2]),
+                    w_cst.WSERVER_POS_UPDATE_RESPONSE_TYPE,
+                    cls.__pos_update_response_struct)
+        elif isinstance(update, w_txpower):
+            return (cls.__create_txpower_update_request(update),
+                    w_cst.WSERVER_TXPOWER_UPDATE_RESPONSE_TYPE,
+                    cls.__txpower_update_response_struct)
+        elif isinstance(update, w_gain):
+            return (cls.__create_gain_update_request(update),
+                    w_cst.WSERVER_GAIN_UPDATE_RESPONSE_TYPE,
+                    cls.__gain_update_response_struct)
+        elif isinstance(update, w_height):
+            return (cls.__create_height_update_request(update),
+                    w_cst.WSERVER_HEIGHT_UPDATE_RESPONSE_TYPE,
+                    cls.__height_update_response_struct)
+        elif isinstance(update, WmediumdGRandom):
+            return (cls.__create_gaussian_random_update_request(update),
+                    w_cst.WSERVER_GAUSSIAN_RANDOM_UPDATE_RESPONSE_TYPE,
+                    cls.__gaussian_random_update_response_struct)
+        elif isinstance(update, SNRLink):
+            return (cls.__create_snr_update_request(update),
+                    w_cst.WSERVER_SNR_UPDATE_RESPONSE_TYPE,
+                    cls.__snr_update_response_struct)
+        raise WmediumdException("Unsupported update %s" % update)
+
+    @classmethod
+    def get_response_struct(cls, resp_type):
+        # type: (int) -> struct.Struct
+        """
+        :param resp_type: A WSERVER_*_RESPONSE_TYPE constant
+        :return: The struct of the response
+        """
+        return cls.__response_structs[resp_type]
+
+    @classmethod
+    def __check_responses(cls, rets):
+        for ret in rets:
+            if ret != w_cst.WUPDATE_SUCCESS:
+                raise WmediumdException("Received error code from wmediumd: "
+                                        "code %d" % ret)
+
+    @classmethod
+    def __send_batch(cls, batch):
+        # type: (list) -> list
+        """
+        Send all requests with a single sendall and read the responses
+        :param batch: list of (request, expected response type, response
+        struct)
+        :return: list of WUPDATE_* constants
+        """
+        if not batch:
+            return []
+        if cls.client:
+            return cls.client.send_batch(batch)
+        size = sum([resp_struct.size for _, _, resp_struct in batch])
+        data = b''
+        with cls.lock:
+            cls.sock.sendall(b''.join([request for request, _, _ in batch]))
+            while len(data) < size:
+                recvd_data = cls.sock.recv(size - len(data))
+                if not recvd_data:
+                    raise WmediumdException("Connection to wmediumd closed")
+                data += recvd_data
+        rets = []
+        offset = 0
+        for _, expected_type, resp_struct in batch:
+            cls.__check_type(data, offset, expected_type)
+            rets.append(resp_struct.unpack_from(data, offset)[-1])
+            offset += resp_struct.size
+        return rets
+
+    @classmethod
+    def __send_request(cls, request, expected_type, resp_struct):
+        # type: (str, int, struct.Struct) -> int
+        """
+        Send a request, or queue it if start_batch has been called
+        :return: A WUPDATE_* constant
+        """
+        batch = getattr(cls.__local, 'batch', None)
+        if batch is not None:
+            batch.append((request, expected_type, resp_struct))
+            return w_cst.WUPDATE_SUCCESS
+        if cls.client:
+            return cls.client.send(request)[-1]
+        with cls.lock:
+            cls.sock.send(request)
+            return cls.__parse_response(expected_type, resp_struct)[-1]
+
     @classmethod
     def send_snr_update(cls, link):
         # type: (SNRLink) -> int
@@ -893,10 +1052,10 @@ class w_server(object):
         #      "value %d\n" % (w_cst.LOG_PREFIX,
         #                      link.sta1intf.get_mac(),
         #                      link.sta2intf.get_mac(), link.snr))
-        cls.sock.send(cls.__create_snr_update_request(link))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_snr_update_request(link),
             w_cst.WSERVER_SNR_UPDATE_RESPONSE_TYPE,
-            cls.__snr_update_response_struct)[-1]
+            cls.__snr_update_response_struct)
 
     @classmethod
     def send_pos_update(cls, pos, mob):
@@ -912,10 +1071,10 @@ class w_server(object):
         #debug("%s Updating Pos of %s to x=%s, y=%s, z=%s\n" % (
         #    w_cst.LOG_PREFIX, pos.staintf.get_mac(),
         #    posX, posY, posZ))
-        cls.sock.send(cls.__create_pos_update_request(pos, posX, posY, posZ))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_pos_update_request(pos, posX, posY, posZ),
             w_cst.WSERVER_POS_UPDATE_RESPONSE_TYPE,
-            cls.__pos_update_response_struct)[-1]
+            cls.__pos_update_response_struct)
 
     @classmethod
     def send_txpower_update(cls, txpower):
@@ -929,10 +1088,10 @@ class w_server(object):
         #debug("%s Updating TxPower of %s to %d\n" % (
         #    w_cst.LOG_PREFIX, txpower.staintf.get_mac(),
         #    txpower_))
-        cls.sock.send(cls.__create_txpower_update_request(txpower))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_txpower_update_request(txpower),
             w_cst.WSERVER_TXPOWER_UPDATE_RESPONSE_TYPE,
-            cls.__txpower_update_response_struct)[-1]
+            cls.__txpower_update_response_struct)
 
     @classmethod
     def send_gain_update(cls, gain):
@@ -946,10 +1105,10 @@ class w_server(object):
         #debug("%s Updating Antenna Gain of %s to %d\n" % (
         #    w_cst.LOG_PREFIX, gain.staintf.get_mac(),
         #    gain_))
-        cls.sock.send(cls.__create_gain_update_request(gain))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_gain_update_request(gain),
             w_cst.WSERVER_GAIN_UPDATE_RESPONSE_TYPE,
-            cls.__gain_update_response_struct)[-1]
+            cls.__gain_update_response_struct)
 
     @classmethod
     def send_gaussian_random_update(cls, gRandom):
@@ -963,10 +1122,10 @@ class w_server(object):
         #debug("%s Updating Gaussian Random of %s to %s\n" % (
         #    w_cst.LOG_PREFIX, gRandom.staintf.get_mac(),
         #    gRandom_))
-        cls.sock.send(cls.__create_gaussian_random_update_request(gRandom))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_gaussian_random_update_request(gRandom),
             w_cst.WSERVER_GAUSSIAN_RANDOM_UPDATE_RESPONSE_TYPE,
-            cls.__gaussian_random_update_response_struct)[-1]
+            cls.__gaussian_random_update_response_struct)
 
     @classmethod
     def send_height_update(cls, height):
@@ -980,10 +1139,10 @@ class w_server(object):
         #debug("%s Updating Antenna Height of %s to %d\n" % (
         #    w_cst.LOG_PREFIX, height.staintf.get_mac(),
         #    height_))
-        cls.sock.send(cls.__create_height_update_request(height))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_height_update_request(height),
             w_cst.WSERVER_HEIGHT_UPDATE_RESPONSE_TYPE,
-            cls.__height_update_response_struct)[-1]
+            cls.__height_update_response_struct)
 
     @classmethod
     def send_errprob_update(cls, link):
@@ -998,10 +1157,10 @@ class w_server(object):
         #          w_cst.LOG_PREFIX, link.sta1intf.get_mac(),
         #          link.sta2intf.get_mac(),
         #          link.errprob))
-        cls.sock.send(cls.__create_errprob_update_request(link))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_errprob_update_request(link),
             w_cst.WSERVER_ERRPROB_UPDATE_RESPONSE_TYPE,
-            cls.__errprob_update_response_struct)[-1]
+            cls.__errprob_update_response_struct)
 
     @classmethod
     def send_specprob_update(cls, link):
@@ -1014,10 +1173,10 @@ class w_server(object):
         #debug("\n%s Updating SPECPROB from interface %s to interface %s" % (
         #    w_cst.LOG_PREFIX, link.sta1intf.get_mac(),
         #    link.sta2intf.get_mac()))
-        cls.sock.send(cls.__create_specprob_update_request(link))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_specprob_update_request(link),
             w_cst.WSERVER_SPECPROB_UPDATE_RESPONSE_TYPE,
-            cls.__specprob_update_response_struct)[-1]
+            cls.__specprob_update_response_struct)
 
     @classmethod
     def send_del_by_mac(cls, mac):
@@ -1027,10 +1186,10 @@ class w_server(object):
         :param mac: The mac address of the interface to be deleted
         :return: A WUPDATE_* constant
         """
-        cls.sock.send(cls.__create_station_del_by_mac_request(mac))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_station_del_by_mac_request(mac),
             w_cst.WSERVER_DEL_BY_MAC_RESPONSE_TYPE,
-            cls.__station_del_by_mac_response_struct)[-1]
+            cls.__station_del_by_mac_response_struct)
 
     @classmethod
     def send_del_by_id(cls, sta_id):
@@ -1040,10 +1199,10 @@ class w_server(object):
         :param sta_id: The wmediumd index of the station
         :return: A WUPDATE_* constant
         """
-        cls.sock.send(cls.__create_station_del_by_id_request(sta_id))
-        return cls.__parse_response(
+        return cls.__send_request(
+            cls.__create_station_del_by_id_request(sta_id),
             w_cst.WSERVER_DEL_BY_ID_RESPONSE_TYPE,
-            cls.__station_del_by_id_response_struct)[-1]
+            cls.__station_del_by_id_response_struct)
 
     @classmethod
     def send_add(cls, mac):
@@ -1054,10 +1213,15 @@ class w_server(object):
         :return: A WUPDATE_* constant and on success at the second pos
         the index
         """
-        cls.sock.send(cls.__create_station_add_request(mac))
-        resp = cls.__parse_response(
-            w_cst.WSERVER_ADD_RESPONSE_TYPE,
-            cls.__station_add_response_struct)
+        request = cls.__create_station_add_request(mac)
+        if cls.client:
+            resp = cls.client.send(request)
+        else:
+            with cls.lock:
+                cls.sock.send(request)
+                resp = cls.__parse_response(
+                    w_cst.WSERVER_ADD_RESPONSE_TYPE,
+                    cls.__station_add_response_struct)
         return resp[-1], resp[-2]
 
     @classmethod
@@ -1199,13 +1363,17 @@ class w_server(object):
         "parse response"
         # type: (int, struct.Struct) -> tuple
         recvd_data = cls.sock.recv(resp_struct.size)
-        # recvd_type = cls.__base_struct.unpack(recvd_data[0])[0]
-        # if recvd_type != expected_type:
-        #    raise WmediumdException(
-        #        "Received response of unknown type %d, expected %d" % (recvd_type,
-        # expected_type))
+        cls.__check_type(recvd_data, 0, expected_type)
         return resp_struct.unpack(recvd_data)
 
+    @classmethod
+    def __check_type(cls, data, offset, expected_type):
+        recvd_type = cls.__base_struct.unpack_from(data, offset)[0]
+        if recvd_type != expected_type:
+            raise WmediumdException(
+                "Received response of unknown type %d, expected %d"
+                % (recvd_type, expected_type))
+
     @classmethod
     def __conv_float_to_fixed_point(cls, d):
         shift_amount = 31
@@ -0,0 +1,197 @@
+"""Edges of the mac802154_hwsim radios. The changes are sent in one
+netlink message batch through the MAC802154_HWSIM generic netlink family
+or, when it is not available, in one shell running wpan-hwsim"""
+
+import os
+import socket
+import struct
+import subprocess
+
+from mininet.log import debug, error
+
+NETLINK_GENERIC = 16
+NLM_F_REQUEST = 1
+NLM_F_ACK = 4
+NLMSG_ERROR = 2
+NLA_F_NESTED = 1 << 15
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+# drivers/net/ieee802154/mac802154_hwsim.h
+HWSIM_FAMILY = b'MAC802154_HWSIM'
+HWSIM_CMD_SET_EDGE = 6
+HWSIM_CMD_DEL_EDGE = 7
+HWSIM_CMD_NEW_EDGE = 8
+HWSIM_ATTR_RADIO_ID = 1
+HWSIM_ATTR_RADIO_EDGE = 2
+HWSIM_EDGE_ATTR_ENDPOINT_ID = 1
+HWSIM_EDGE_ATTR_LQI = 2
+
+
+class hwsimEdges(object):
+    "Applies edge changes to mac802154_hwsim"
+
+    sock = None
+    family = None
+    seq = 0
+    use_netlink = True
+
+    @classmethod
+    def connect(cls):
+        "Opens the generic netlink socket and resolves the hwsim family"
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_GENERIC)
+            sock.bind((0, 0))
+            cls.sock = sock
+            payload = cls.attr(CTRL_ATTR_FAMILY_NAME, HWSIM_FAMILY + b'\0')
+            sock.send(cls.message(GENL_ID_CTRL, CTRL_CMD_GETFAMILY,
+                                  payload, flags=NLM_F_REQUEST))
+            data = sock.recv(65536)
+            cls.family = cls.get_family_id(data)
+        except (AttributeError, OSError, struct.error):
+            cls.family = None
+        if cls.family is None:
+            debug('mac802154_hwsim netlink family not found. '
+                  'Using wpan-hwsim\n')
+            cls.close()
+            cls.use_netlink = False
+
+    @classmethod
+    def close(cls):
+        if cls.sock:
+            cls.sock.close()
+        cls.sock = None
+
+    @classmethod
+    def get_family_id(cls, data):
+        msg_type = struct.unpack_from('H', data, 4)[0]
+        if msg_type == NLMSG_ERROR:
+            return None
+        offset = 20  # nlmsghdr + genlmsghdr
+        while offset < len(data):
+            length, attr_type = struct.unpack_from('HH', data, offset)
+            if attr_type == CTRL_ATTR_FAMILY_ID:
+                return struct.unpack_from('H', data, offset + 4)[0]
+            offset += (length + 3) & ~3
+        return None
+
+    @staticmethod
+    def attr(attr_type, payload):
+        length = 4 + len(payload)
+        pad = b'\0' * (((length + 3) & ~3) - length)
+        return struct.pack('HH', length, attr_type) + payload + pad
+
+    @classmethod
+    def message(cls, family, cmd, payload, flags=NLM_F_REQUEST | NLM_F_ACK):
+        cls.seq += 1
+        return struct.pack('IHHIIBBH', 20 + len(payload), family, flags,
+                           cls.seq, 0, cmd, 1, 0) + payload
+
+    @classmethod
+    def edge_message(cls, cmd, src, dst, lqi=None):
+        edge = cls.attr(HWSIM_EDGE_ATTR_ENDPOINT_ID, struct.pack('I', dst))
+        if lqi is not None:
+            edge += cls.attr(HWSIM_EDGE_ATTR_LQI, struct.pack('B', lqi))
+        payload = cls.attr(HWSIM_ATTR_RADIO_ID, struct.pack('I', src)) + \
+            cls.attr(HWSIM_ATTR_RADIO_EDGE | NLA_F_NESTED, edge)
+        return cls.message(cls.family, cmd, payload)
+
+    @staticmethod
+    def get_ops(added, removed, lqi):
+        "Returns the (cmd, src, dst, lqi) changes, in both directions"
+        ops = []
+        for src, dst in removed:
+            ops.append((HWSIM_CMD_DEL_EDGE, src, dst, None))
+            ops.append((HWSIM_CMD_DEL_EDGE, dst, src, None))
+        for src, dst in added:
+            ops.append((HWSIM_CMD_NEW_EDGE, src, dst, None))
+            ops.append((HWSIM_CMD_NEW_EDGE, dst, src, None))
+        for src, dst, value in lqi:
+            value = min(max(int(value), 0), 255)
+            ops.append((HWSIM_CMD_SET_EDGE, src, dst, value))
+            ops.append((HWSIM_CMD_SET_EDGE, dst, src, value))
+        return ops
+
+    @classmethod
+    def apply(cls, added, removed, lqi):
+        """Applies the edge changes in both directions
+        :param added: list of (src id, dst id) edges to add
+        :param removed: list of (src id, dst id) edges to remove
+        :param lqi: list of (src id, dst id, lqi) edges to set"""
+        if not (added or removed or lqi):
+            return
+        if cls.use_netlink and cls.sock is None:
+            cls.connect()
+        ops = cls.get_ops(added, removed, lqi)
+        if cls.use_netlink:
+            ops = cls.apply_netlink(ops)
+        if ops:
+            cls.apply_wpan_hwsim(ops)
+
+    @classmethod
+    def apply_netlink(cls, ops):
+        """Sends the changes through netlink
+        :return: changes that failed, to be retried with wpan-hwsim"""
+        failed = []
+        pending = {}  # seq -> op
+        msgs = []
+        for op in ops:
+            cmd, src, dst, value = op
+            msgs.append(cls.edge_message(cmd, src, dst, value))
+            pending[cls.seq] = op
+        try:
+            # the socket buffer limits how many messages can be sent at once
+            for i in range(0, len(msgs), 256):
+                cls.sock.send(b''.join(msgs[i:i + 256]))
+                for seq, err in cls.read_acks(len(msgs[i:i + 256])):
+                    op = pending.pop(seq, None)
+                    if op is not None:
+                        error('*** mac802154_hwsim: %s failed (error %d)\n'
+                              % (cls.wpan_hwsim_cmd(op), err))
+                        failed.append(op)
+        except OSError as e:
+            error('*** mac802154_hwsim netlink error: %s\n' % e)
+            return ops
+        return failed
+
+    @classmethod
+    def read_acks(cls, n):
+        """Reads the acks of n messages
+        :return: list of (seq, error) of the messages that failed"""
+        failed = []
+        while n > 0:
+            data = cls.sock.recv(65536)
+            offset = 0
+            while offset < len(data) and n > 0:
+                length, msg_type, _, seq = struct.unpack_from('IHHI', data,
+                                                              offset)
+                if msg_type == NLMSG_ERROR:
+                    err = struct.unpack_from('i', data, offset + 16)[0]
+                    if err:
+                        failed.append((seq, err))
+                    n -= 1
+                offset += (length + 3) & ~3
+        return failed
+
+    @staticmethod
+    def wpan_hwsim_cmd(op):
+        cmd, src, dst, value = op
+        if cmd == HWSIM_CMD_DEL_EDGE:
+            return 'wpan-hwsim edge del %s %s' % (src, dst)
+        elif cmd == HWSIM_CMD_NEW_EDGE:
+            return 'wpan-hwsim edge add %s %s' % (src, dst)
+        return 'wpan-hwsim edge lqi %s %s %s' % (src, dst, value)
+
+    @classmethod
+    def apply_wpan_hwsim(cls, ops):
+        cmds = [cls.wpan_hwsim_cmd(op) for op in ops]
+        devnull = open(os.devnull, 'w')
+        proc = subprocess.Popen(['sh', '-s'], stdin=subprocess.PIPE,
+                                stdout=devnull, stderr=subprocess.PIPE)
+        err = proc.communicate(('\n'.join(cmds) + '\n').encode())[1]
+        devnull.close()
+        if err:
+            error('*** wpan-hwsim: %s\n' % err.decode(errors='replace'))
@@ -1,15 +1,18 @@
 
-import os
 import re
 from time import sleep
 
+import numpy as np
+
 from threading import Thread as thread
 from mininet.log import debug, info
 from mn_iot.mac80211.plot import plot2d, plot3d, plotGraph
 from mn_iot.mac80211.mobility import mobility
+from mn_iot.mac80211.link import linkShaper, channelEquations
+from mn_iot.mac802154.hwsim import hwsimEdges
 
 
-class Mobility(object):
+class Mobility(channelEquations):
 
     sensors = []
     mobileNodes = []
@@ -17,67 +20,117 @@ class Mobility(object):
     wmediumd_mode = None
     dist = 0
     noise = 0
-    equationLoss = '(dist * 2) / 1000'
-    equationDelay = '(dist / 10) + 1'
-    equationLatency = '(dist / 10)/2'
-    equationBw = ' * (1.01 ** -dist)'
 
-    #def __init__(self, src):
-    #    self.get_edge(src)
+    nslots = 0  # number of rows of the adjacency and lqi matrices
+    adj = None  # adjacency matrix of the edges added to mac802154_hwsim
+    lqi = None  # lqi matrix (-1: not set yet)
+
+    @classmethod
+    def get_edge(cls, src):
+        cls.update_edges([src])
+
+    @classmethod
+    def get_slots(cls):
+        """Returns the slots of the sensors, resizing the matrices when a
+        sensor gets a slot beyond them. Slots are given by addSensor;
+        sensors created otherwise get the next free ones"""
+        slots = [getattr(sensor, 'slot', None) for sensor in cls.sensors]
+        if None in slots or len(set(slots)) != len(slots):
+            next_slot = max([cls.nslots] + [slot + 1 for slot in slots
+                                            if slot is not None])
+            for sensor in cls.sensors:
+                if getattr(sensor, 'slot', None) is None:
+                    sensor.slot = next_slot
+                    next_slot += 1
+            slots = [sensor.slot for sensor in cls.sensors]
+        n = max(slots) + 1 if slots else 0
+        if cls.adj is None or n > cls.nslots:
+            adj = np.zeros((n, n), dtype=bool)
+            lqi = np.full((n, n), -1, dtype=int)
+            if cls.adj is not None:
+                adj[:cls.nslots, :cls.nslots] = cls.adj
+                lqi[:cls.nslots, :cls.nslots] = cls.lqi
+            cls.adj, cls.lqi, cls.nslots = adj, lqi, n
+        return slots
 
     @classmethod
-    def get_edge(self, src):
-        nedges = 0
-        lat = 0
-        loss = 0
-        bw = 0
-        for dst in self.sensors:
-            if src != dst:
-                dist = src.get_distance_to(dst)
-                id_src, id_dst = self.get_node_id(src, dst)
-                if dist > src.params['range'][0]:
-                    if dst in src.edge:
-                        self.handle_edge(id_src, id_dst)
-                        src.edge.remove(dst)
-                        dst.edge.remove(src)
-                    src.set_lqi(dst, 0)
-                    dst.set_lqi(src, 0)
+    def update_edges(cls, nodes):
+        """Computes the edges and lqi of nodes to all the sensors at once.
+        Only the ones that changed since the last update are sent to
+        mac802154_hwsim, in a single batch
+        :param nodes: mobile sensors"""
+        slots = cls.get_slots()
+        if not slots:
+            return
+        sensors = [None] * cls.nslots
+        pos = np.full((cls.nslots, 3), np.nan)
+        for sensor, slot in zip(cls.sensors, slots):
+            sensors[slot] = sensor
+            pos[slot] = [float(c) for c in sensor.params['position'][:3]]
+        last = slots[-1]
+        added, removed, lqis = [], [], []
+        for src in nodes:
+            i = src.slot
+            dists = np.round(np.sqrt(((pos - pos[i]) ** 2).sum(axis=1)), 2)
+            with np.errstate(invalid='ignore'):
+                in_range = dists <= src.params['range'][0]
+            in_range[i] = False
+            lqi = np.zeros(cls.nslots, dtype=int)
+            for j in np.nonzero(in_range)[0]:
+                lqi[j] = int(cls.get_rssi(src, sensors[j], dists[j]))
+            lqi[i] = cls.lqi[i, i]
+
+            for j in np.nonzero(in_range != cls.adj[i])[0]:
+                if in_range[j]:
+                    added.append((cls.get_id(src), cls.get_id(sensors[j])))
+                    src.edge.add(sensors[j])
+                    sensors[j].edge.add(src)
                 else:
-                    if dst not in src.edge:
-                        self.handle_edge(id_src, id_dst, act='add')
-                        src.edge.append(dst)
-                        dst.edge.append(src)
-                    lqi = int(self.get_rssi(src, dst, dist))
-                    self.set_lqi(id_src, id_dst, lqi)
-                    src.set_lqi(dst, lqi)
-                    dst.set_lqi(src, lqi)
-                    nedges += 1
-
-                if self.sensors.index(dst) == (len(self.sensors)-1) or \
-                                self.sensors.index(src) == (len(self.sensors)-1):
-                    lat = (self.getLatency(dist)+lat)/nedges
-                    loss = (self.getLoss(dist)+loss)/nedges
-                    bw = (self.getBW(dist=dist)+bw)/nedges
-
-        if nedges:
-            self.config_tc(src, 0, bw, loss, lat)
+                    removed.append((cls.get_id(src), cls.get_id(sensors[j])))
+                    src.edge.discard(sensors[j])
+                    sensors[j].edge.discard(src)
+            # new edges get the default lqi in hwsim, so set theirs as well
+            changed = (lqi != cls.lqi[i]) | (in_range & ~cls.adj[i])
+            for j in np.nonzero(changed)[0]:
+                if sensors[j] is None:
+                    continue
+                if in_range[j]:
+                    lqis.append((cls.get_id(src), cls.get_id(sensors[j]),
+                                 lqi[j]))
+                src.set_lqi(sensors[j], int(lqi[j]))
+            cls.adj[i, :] = cls.adj[:, i] = in_range
+            cls.lqi[i, :] = cls.lqi[:, i] = lqi
+
+            # tc params: running average over the edges, as before
+            nedges = np.cumsum(in_range)
+            lat = loss = bw = 0
+            cols = slots if i == last else [last]
+            for j in cols:
+                if j != i and nedges[j]:
+                    dist = dists[j]
+                    lat = (cls.getLatency(dist) + lat) / nedges[j]
+                    loss = (cls.getLoss(dist) + loss) / nedges[j]
+                    bw = (cls.getBW(dist=dist) + bw) / nedges[j]
+            if nedges[-1]:
+                cls.config_tc(src, 0, bw, loss, lat)
+        hwsimEdges.apply(added, removed, lqis)
 
     @classmethod
     def getDelay(cls, dist):
-        return eval(cls.equationDelay)
+        return cls.get_equation('equationDelay')(dist)
 
     @classmethod
     def getLatency(cls, dist):
-        return eval(cls.equationLatency)
+        return cls.get_equation('equationLatency')(dist)
 
     @classmethod
     def getLoss(cls, dist):
-        return eval(cls.equationLoss)
+        return cls.get_equation('equationLoss')(dist)
 
     @classmethod
     def getBW(cls, dist=0):
         custombw = 2
-        rate = eval(str(custombw) + cls.equationBw)
+        rate = cls.get_equation('equationBw')(dist, custombw)
 
         if rate <= 0.0:
             rate = 0.1
@@ -96,27 +149,25 @@ class Mobility(object):
 
     @classmethod
     def tc(cls, node, iface, bw, loss, latency):
-        cmd = "tc qdisc replace dev %s root handle 2: netem " % iface
-        rate = "rate %.4fmbit " % bw
-        cmd += rate
-        if latency > 0.1:
-            latency = "latency %.2fms " % latency
-            cmd += latency
-        if loss > 0.1:
-            loss = "loss %.1f%% " % loss
-            cmd += loss
-        node.pexec(cmd)
+        linkShaper.apply(node, iface, bw, loss, latency)
 
     @classmethod
-    def get_node_id(self, src, dst):
-        id_src = int(re.findall(r'\d+', src.name)[0]) - 1
-        id_dst = int(re.findall(r'\d+', dst.name)[0]) - 1
-        return id_src, id_dst
+    def get_id(cls, node):
+        "Returns the hwsim radio id, given by addSensor"
+        if getattr(node, 'id', None) is None:
+            node.id = int(re.findall(r'\d+', node.name)[0]) - 1
+        return node.id
+
+    @classmethod
+    def get_node_id(cls, src, dst):
+        return cls.get_id(src), cls.get_id(dst)
 
     @classmethod
     def handle_edge(self, src, dst, act='del'):
-        os.system('wpan-hwsim edge %s %s %s >/dev/null 2>&1' % (act, src, dst))
-        os.system('wpan-hwsim edge %s %s %s >/dev/null 2>&1' % (act, dst, src))
+        if act == 'add':
+            hwsimEdges.apply([(src, dst)], [], [])
+        else:
+            hwsimEdges.apply([], [(src, dst)], [])
 
     @classmethod
     def get_rssi(self, src, dst, dist):
@@ -126,8 +177,7 @@ class Mobility(object):
 
     @classmethod
     def set_lqi(self, src, dst, lqi):
-        os.system('wpan-hwsim edge lqi %s %s %s' % (src, dst, lqi))
-        os.system('wpan-hwsim edge lqi %s %s %s' % (dst, src, lqi))
+        hwsimEdges.apply([], [], [(src, dst, lqi)])
 
     @classmethod
     def stop(cls, **kwargs):
@@ -154,9 +204,8 @@ class Mobility(object):
 
     @classmethod
     def configureLinks(cls, nodes):
-        for node in nodes:
-            for wif in range(len(node.params['wif'])):
-                cls.get_edge(node)
+        sensors = set(cls.sensors)
+        cls.update_edges([node for node in nodes if node in sensors])
         sleep(0.0001)
 
     @classmethod
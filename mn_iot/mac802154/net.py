@@ -16,6 +16,8 @@ from mininet.log import error, debug, output
 from mn_iot.mac802154.node import Sixlowpan
 from mn_iot.mac802154.module import module
 from mn_iot.mac802154.link import SixLowpan as SixLowpanLink
+from mn_iot.mac80211.pinger import pinger
+from mn_iot.mac80211.iperf import iperfFlows
 
 
 class Mininet_mac802154(Mininet):
@@ -263,6 +265,9 @@ class Mininet_mac802154(Mininet):
 
         self.addParameters(node, defaults, **params)
 
+        # hwsim radio id and row in the link engine matrices
+        node.id = int(re.findall(r'\d+', name)[0]) - 1
+        node.slot = len(self.sensors)
         self.sensors.append(node)
         self.nameToNode[name] = node
 
@@ -333,16 +338,17 @@ class Mininet_mac802154(Mininet):
         if not hosts:
             hosts = self.sensors
             output('*** Ping: testing ping reachability\n')
+        pairs = [(node, dest) for node in hosts for dest in hosts
+                 if node != dest and dest.intfs]
+        results = {}
+        for node, dest, result in pinger.run(pairs, 'ping6', timeout):
+            results[(node, dest)] = result
         for node in hosts:
             output('%s -> ' % node.name)
             for dest in hosts:
                 if node != dest:
-                    opts = ''
-                    if timeout:
-                        opts = '-W %s' % timeout
-                    if dest.intfs:
-                        result = node.cmdPrint('ping6 -c1 %s %s'
-                                               % (opts, dest.IP()))
+                    if (node, dest) in results:
+                        result = results[(node, dest)]
                         sent, received = self._parsePing(result)
                     else:
                         sent, received = 0, 0
@@ -400,22 +406,24 @@ class Mininet_mac802154(Mininet):
         """Ping between all specified hosts and return all data.
            hosts: list of hosts
            timeout: time to wait for a response, as string
-           returns: all ping data; see function body."""
+           returns: all ping data; see function body.
+           The pings run concurrently (see pinger)"""
         # should we check if running?
         # Each value is a tuple: (src, dsd, [all ping outputs])
         all_outputs = []
         if not hosts:
-            hosts = self.hosts
+            hosts = self.sensors
             output('*** Ping: testing ping reachability\n')
+        pairs = [(node, dest) for node in hosts for dest in hosts
+                 if node != dest]
+        results = {}
+        for node, dest, result in pinger.run(pairs, 'ping6', timeout):
+            results[(node, dest)] = self._parseFull(result)
         for node in hosts:
             output('%s -> ' % node.name)
             for dest in hosts:
                 if node != dest:
-                    opts = ''
-                    if timeout:
-                        opts = '-W %s' % timeout
-                    result = node.cmd('ping -c1 %s %s' % (opts, dest.IP()))
-                    outputs = self._parsePingFull(result)
+                    outputs = results[(node, dest)]
                     sent, received, rttmin, rttavg, rttmax, rttdev = outputs
                     all_outputs.append((node, dest, outputs))
                     output(('%s ' % dest.name) if received else 'X ')
@@ -501,6 +509,30 @@ class Mininet_mac802154(Mininet):
         output('*** Results: %s\n' % result)
         return result
 
+    def iperfMulti(self, pairs=None, l4Type='TCP', udpBw='10M', seconds=10,
+                   stagger=0, port=5201, filename=None):
+        """Run many iperf3 flows at once.
+           pairs: list of (client, server); if None, every sensor
+           sends to the first sensor
+           l4Type: string, one of [ TCP, UDP ]
+           udpBw: bandwidth target of each UDP flow
+           seconds: duration of each flow
+           stagger: delay between the starts of two flows (s)
+           port: port of the first flow
+           filename: saves the result as JSON
+           returns: dict with the throughput, jitter, loss and link state
+           of each flow and the aggregate"""
+        if not pairs:
+            pairs = [(sensor, self.sensors[0])
+                     for sensor in self.sensors[1:]]
+        output('*** Iperf: testing', l4Type, 'bandwidth of %d flows\n'
+               % len(pairs))
+        result = iperfFlows(pairs, l4Type=l4Type, udpBw=udpBw,
+                            seconds=seconds, stagger=stagger,
+                            port=port).run()
+        iperfFlows.report(result, filename)
+        return result
+
     @classmethod
     def addParamsToNode(self, node):
         "Add func and wpanPhyID"
@@ -46,7 +46,7 @@ class Node_mac802154(Node):
 
         self.func = []
         self.isStationary = True
-        self.edge = []
+        self.edge = set()  # sensors with an edge to this one
 
         # Make pylint happy
         (self.shell, self.execed, self.pid, self.stdin, self.stdout,
@@ -226,9 +226,7 @@ class Node_mac802154(Node):
             cls = plot3d
         if cls.fig_exists():
             cls.updateCircleRadius(self)
-            cls.updateLine(self)
             cls.update(self)
-            cls.pause()
 
 
 class Sixlowpan(Node_mac802154):
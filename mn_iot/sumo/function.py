@@ -1,6 +1,11 @@
 # !/bin/bash
 
-import traci
+try:
+    import traci
+except ImportError:
+    # imported as mn_iot.sumo.function instead of from the sumo dir
+    from mn_iot.sumo import traci
+import numpy as np
 
 
 def intersect(a, b):
@@ -8,73 +13,99 @@ def intersect(a, b):
     return list(set(a) & set(b))
 
 
-def initialisation(ListVeh, ListTravelTime, ListVisited, Visited,
+def initialisation(ListTravelTime, ListVisited, Visited,
 				   time, speed, vehID, vehicleCommands):
+	# les etats des vehicules sont des dictionnaires indexes par vehID
 	# enregistrement de chaque vehicule qui apparait et initialisation des Lists
-	ListVeh.append(vehID)
-	ListTravelTime.append([])
-	ListVisited.append([])
+	ListTravelTime[vehID] = []
 
 	# enregistrement pour chaque vehicule du premier lien visite
-	ListVisited[ListVeh.index(vehID)].append(vehicleCommands.getRoadID(vehID))
-	Visited.append([])
+	road = vehicleCommands.getRoadID(vehID)
+	ListVisited[vehID] = [road]
 
 	# initialisation du premier lien visite pour chaque vehicule
-	Visited[ListVeh.index(vehID)] = vehicleCommands.getRoadID(vehID)
-	time.append(0)
-	speed.append(0)
+	Visited[vehID] = road
+	time[vehID] = 0
 
 	# initialisation de la vitesse du vehicule sur le lien actuel
-	speed[ListVeh.index(vehID)] = vehicleCommands.getSpeed(vehID)
+	speed[vehID] = vehicleCommands.getSpeed(vehID)
 
-	return ListVeh, ListTravelTime, ListVisited, Visited, time, speed
 
-
-def noChangeSaveTimeAndSpeed(Visited, ListVeh, time, speed,
-							 vehID, vehicleCommands):
+def noChangeSaveTimeAndSpeed(Visited, time, speed, vehID, vehicleCommands):
+	road = vehicleCommands.getRoadID(vehID)
 
 	# si le vehicule est toujours sur le meme lien ou sur un de changement de lien : enregistrement du temps et de la vitesse
-	if Visited[ListVeh.index(vehID)] == vehicleCommands.getRoadID(vehID) or (Visited[ListVeh.index(vehID)] != vehicleCommands.getRoadID(vehID)) and not(vehicleCommands.getRoadID(vehID) in vehicleCommands.getRoute(vehID)):
-		time[ListVeh.index(vehID)] = time[ListVeh.index(vehID)] + 1
-		speed[ListVeh.index(vehID)] = speed[ListVeh.index(vehID)] + vehicleCommands.getSpeed(vehID)
+	if Visited[vehID] == road or (Visited[vehID] != road and not(road in vehicleCommands.getRoute(vehID))):
+		time[vehID] = time[vehID] + 1
+		speed[vehID] = speed[vehID] + vehicleCommands.getSpeed(vehID)
 
 	# si le vehicule change de lien sur un pas de temps : enregistrement du temps et de la vitesse
-	if time[ListVeh.index(vehID)] == 0 and Visited[ListVeh.index(vehID)] != vehicleCommands.getRoadID(vehID):
-		time[ListVeh.index(vehID)] = time[ListVeh.index(vehID)] + 1
-		speed[ListVeh.index(vehID)] = speed[ListVeh.index(vehID)] + vehicleCommands.getSpeed(vehID)
-	return Visited, time, speed
+	if time[vehID] == 0 and Visited[vehID] != road:
+		time[vehID] = time[vehID] + 1
+		speed[vehID] = speed[vehID] + vehicleCommands.getSpeed(vehID)
 
 
-def changeSaveTimeAndSpeed(Visited, ListVeh, time, speed, ListVisited,
+def changeSaveTimeAndSpeed(Visited, time, speed, ListVisited,
 						   vehID, ListTravelTime, vehicleCommands):
+	road = vehicleCommands.getRoadID(vehID)
+
 	# le vehicule change de lien
-	if (Visited[ListVeh.index(vehID)] != vehicleCommands.getRoadID(vehID)) and (vehicleCommands.getRoadID(vehID) in vehicleCommands.getRoute(vehID)):
-		S = speed[ListVeh.index(vehID)]
-		T = time[ListVeh.index(vehID)]
+	if Visited[vehID] != road and road in vehicleCommands.getRoute(vehID):
+		S = speed[vehID]
+		T = time[vehID]
 		if S > 0 and T > 0:
 
 			# enregistrement du temps de parcours du lien precedent
-			ListTravelTime[ListVeh.index(vehID)].append(S / T)
+			ListTravelTime[vehID].append(S / T)
 
 		# mis a jour du nouveau lien
-		Visited[ListVeh.index(vehID)] = vehicleCommands.getRoadID(vehID)
+		Visited[vehID] = road
 
 		# enregistrement du parcours
-		ListVisited[ListVeh.index(vehID)].append(vehicleCommands.getRoadID(vehID))
+		ListVisited[vehID].append(road)
 
 		# mis a jour du temps et de a vitesse
-		time[ListVeh.index(vehID)] = 0
-		speed[ListVeh.index(vehID)] = 0
-	return Visited, time, speed, ListVisited, ListTravelTime
-
-
-def reroutage(VisitedEdge2, ListTravelTime, vehID1, vehID2, ListVeh, vehicleCommands):
+		time[vehID] = 0
+		speed[vehID] = 0
+
+
+def closePairs(positions, roads, max_dist=20):
+	"""Returns the (vehID2, vehID1) pairs of vehicles on opposite roads
+	(road and -road) whose x distance is below max_dist. The vehicles of
+	each road are sorted by x and the neighbours are found by binary
+	search, instead of testing every pair
+	:param positions: dict of vehID -> (x, y)
+	:param roads: dict of vehID -> road id"""
+	groups = {}
+	for vehID, road in roads.items():
+		groups.setdefault(road, []).append(vehID)
+
+	pairs = []
+	for road, ids in groups.items():
+		others = groups.get('-' + road)
+		if not others:
+			continue
+		xa = np.array([positions[vehID][0] for vehID in ids])
+		xb = np.array([positions[vehID][0] for vehID in others])
+		order = np.argsort(xb)
+		xs = xb[order]
+		low = np.searchsorted(xs, xa - max_dist, side='right')
+		high = np.searchsorted(xs, xa + max_dist, side='left')
+		for i in np.nonzero(high > low)[0]:
+			for j in order[low[i]:high[i]]:
+				if xa[i] != xb[j]:
+					pairs.append((ids[i], others[j]))
+					pairs.append((others[j], ids[i]))
+	return pairs
+
+
+def reroutage(VisitedEdge2, ListTravelTime, vehID1, vehID2, vehicleCommands):
 	if len(VisitedEdge2) > 0:
 
 		# reroutage du vehicule 1 en fonction des donnees collectees
-		for edge in VisitedEdge2 :
-			TravelTime = ListTravelTime[ListVeh.index(vehID2)]
-			traci.edge.adaptTraveltime(edge, TravelTime[VisitedEdge2.index(edge)])
+		TravelTime = ListTravelTime[vehID2]
+		for edge, travelTime in zip(VisitedEdge2, TravelTime):
+			traci.edge.adaptTraveltime(edge, travelTime)
 			vehicleCommands.rerouteTraveltime(vehID1)
 
 		# mis a jour du temps de parcours des liens modifies pour le reroutage
@@ -84,4 +115,4 @@ def reroutage(VisitedEdge2, ListTravelTime, vehID1, vehID2, ListVeh, vehicleComm
 			S = traci.lane.getMaxSpeed(lane)
 			# poids initial : longueur/Vitesse max
 			T = L / S
-			traci.edge.adaptTraveltime(edge, T)
\ No newline at end of file
+			traci.edge.adaptTraveltime(edge, T)
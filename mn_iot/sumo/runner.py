@@ -4,6 +4,7 @@ import threading
 
 from threading import Thread as thread
 from mn_iot.mac80211.mobility import mobility
+from mn_iot.sumo.traci import constants as tc
 from mininet.log import info
 from sys import version_info as py_version_info
 
@@ -12,7 +13,48 @@ if py_version_info < (3, 0):
     from sumolib.sumulib import checkBinary
     from traci import trace
     from function import initialisation, noChangeSaveTimeAndSpeed,\
-        changeSaveTimeAndSpeed, reroutage
+        changeSaveTimeAndSpeed, closePairs, reroutage
+
+
+class vehicleSubscriptions(object):
+    """Vehicle variables received through TraCI subscriptions. Each
+    vehicle is subscribed to when it departs, so the variables of all
+    vehicles arrive with the response of every simulationStep. The
+    getters mirror the ones of the vehicle domain used by function.py"""
+
+    variables = (tc.VAR_POSITION, tc.VAR_ROAD_ID, tc.VAR_EDGES,
+                 tc.VAR_SPEED)
+
+    def __init__(self, connection):
+        self.vehicle = connection.vehicle
+        self.simulation = connection.simulation
+        self.results = {}
+        self.simulation.subscribe()
+        for vehID in self.vehicle.getIDList():
+            self.vehicle.subscribe(vehID, self.variables)
+
+    def update(self):
+        "Subscribes to the departed vehicles and caches the results"
+        departed = self.simulation.getSubscriptionResults() or {}
+        for vehID in departed.get(tc.VAR_DEPARTED_VEHICLES_IDS, []):
+            self.vehicle.subscribe(vehID, self.variables)
+        # arrived vehicles are no longer in the results
+        self.results = dict(self.vehicle.getSubscriptionResults() or {})
+
+    def getIDList(self):
+        return list(self.results)
+
+    def getPosition(self, vehID):
+        return self.results[vehID][tc.VAR_POSITION]
+
+    def getRoadID(self, vehID):
+        return self.results[vehID][tc.VAR_ROAD_ID]
+
+    def getRoute(self, vehID):
+        return self.results[vehID][tc.VAR_EDGES]
+
+    def getSpeed(self, vehID):
+        return self.results[vehID][tc.VAR_SPEED]
 
 
 class sumo(object):
@@ -51,73 +93,51 @@ class sumo(object):
             trace.setOrder(0)
 
         step = 0
-        speed = []
-        time = []
-        visited = []
-        veh_list = []
-        visited_list = []
-        veh_interact_list = []
-        travel_time_list = []
+        # state of each vehicle, by vehID
+        speed = {}
+        time = {}
+        visited = {}
+        visited_list = {}
+        travel_time_list = {}
+        veh_interact_list = set()
         self.setWifiParameters()
 
+        vehicleCommands = vehicleSubscriptions(
+            trace.getConnection(label="default"))
         while True:
             trace.simulationStep()
-            vehicleCommands = trace._vehicle.VehicleDomain()
-            vehicleCommands._connection = trace.getConnection(label="default")
-            for vehID in vehicleCommands.getIDList():
-                if not(vehID in veh_list):
-                    init=initialisation(veh_list, travel_time_list,
-                                        visited_list, visited, time,
-                                        speed, vehID, vehicleCommands)
-                    veh_list = init[0]
-                    travel_time_list = init[1]
-                    visited_list = init[2]
-                    visited = init[3]
-                    time = init[4]
-                    speed = init[5]
-
-                no_change = noChangeSaveTimeAndSpeed(
-                    visited, veh_list, time, speed, vehID, vehicleCommands)
-                visited = no_change[0]
-                time = no_change[1]
-                speed = no_change[2]
-
-                change = changeSaveTimeAndSpeed(
-                    visited, veh_list, time, speed, visited_list, vehID,
-                    travel_time_list, vehicleCommands)
-                visited = change[0]
-                time = change[1]
-                speed = change[2]
-                visited_list = change[3]
-                travel_time_list = change[4]
-
-            for vehID2 in vehicleCommands.getIDList():
-                for vehID1 in vehicleCommands.getIDList():
-                    road1 = vehicleCommands.getRoadID(vehID1)
-                    road2 = vehicleCommands.getRoadID(vehID2)
-                    opposite_road1 = '-' + road1
-                    opposite_road2 = '-' + road2
-                    if not((vehID2,vehID1) in veh_interact_list):
-                        x1 = vehicleCommands.getPosition(vehID1)[0]
-                        y1 = vehicleCommands.getPosition(vehID1)[1]
-                        x2 = vehicleCommands.getPosition(vehID2)[0]
-                        y2 = vehicleCommands.getPosition(vehID2)[1]
-
-                        if int(vehID1) < len(cars):
-                            cars[int(vehID1)].params['position'] = x1, y1, 0
-                            cars[int(vehID1)].set_pos_wmediumd(cars[int(vehID1)].params['position'])
-
-                        if abs(x1-x2)>0 and abs(x1-x2)<20 \
-                                and (road1 == opposite_road2 or road2 == opposite_road1):
-                            veh_interact_list.append((vehID2,vehID1))
-                            route2 = vehicleCommands.getRoute(vehID2)
-                            route1 = vehicleCommands.getRoute(vehID1)
-                            index2 = route2.index(vehicleCommands.getRoadID(vehID2))
-                            index1 = route1.index(vehicleCommands.getRoadID(vehID1))
-                            visited_edge_2 = visited_list[veh_list.index(vehID2)][0:len(
-                                visited_list[veh_list.index(vehID2)])-1]
-                            reroutage(visited_edge_2, travel_time_list,
-                                      vehID1, vehID2, veh_list)
+            vehicleCommands.update()
+            vehicles = vehicleCommands.getIDList()
+            for vehID in vehicles:
+                if vehID not in visited:
+                    initialisation(travel_time_list, visited_list, visited,
+                                   time, speed, vehID, vehicleCommands)
+                noChangeSaveTimeAndSpeed(visited, time, speed, vehID,
+                                         vehicleCommands)
+                changeSaveTimeAndSpeed(visited, time, speed, visited_list,
+                                       vehID, travel_time_list,
+                                       vehicleCommands)
+
+            moved = []
+            positions = {}
+            roads = {}
+            for vehID in vehicles:
+                positions[vehID] = vehicleCommands.getPosition(vehID)
+                roads[vehID] = vehicleCommands.getRoadID(vehID)
+                if int(vehID) < len(cars):
+                    car = cars[int(vehID)]
+                    x, y = positions[vehID]
+                    car.params['position'] = x, y, 0
+                    car.set_pos_wmediumd(car.params['position'])
+                    moved.append(car)
+            mobility.set_dirty(moved)
+
+            for vehID2, vehID1 in closePairs(positions, roads):
+                if (vehID2, vehID1) not in veh_interact_list:
+                    veh_interact_list.add((vehID2, vehID1))
+                    visited_edge_2 = visited_list[vehID2][:-1]
+                    reroutage(visited_edge_2, travel_time_list,
+                              vehID1, vehID2, vehicleCommands.vehicle)
             step=step+1
         trace.close()
         sys.stdout.flush()
\ No newline at end of file
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Tests of the SUMO helper functions that do not need SUMO."""
+
+import random
+import unittest
+
+from mininet.log import setLogLevel
+from mn_iot.sumo.function import closePairs
+
+
+def bruteForcePairs(positions, roads, max_dist=20):
+    "The O(V^2) check replaced by closePairs"
+    pairs = []
+    for vehID1 in roads:
+        for vehID2 in roads:
+            if roads[vehID2] == '-' + roads[vehID1] \
+                    or roads[vehID1] == '-' + roads[vehID2]:
+                dist = abs(positions[vehID1][0] - positions[vehID2][0])
+                if 0 < dist < max_dist:
+                    pairs.append((vehID2, vehID1))
+    return pairs
+
+
+class testClosePairs(unittest.TestCase):
+    "Test the search of vehicles close to each other on opposite roads"
+
+    def testSmall(self):
+        "Both orders are returned, equal x and same road are excluded"
+        positions = {'a': (0, 0), 'b': (10, 5), 'c': (0, 5), 'd': (19.9, 0),
+                     'e': (20, 5), 'f': (5, 0)}
+        roads = {'a': 'r1', 'b': '-r1', 'c': '-r1', 'd': 'r1', 'e': '-r1',
+                 'f': 'r2'}
+        pairs = sorted(closePairs(positions, roads))
+        self.assertEqual(pairs, sorted([('a', 'b'), ('b', 'a'),
+                                        ('b', 'd'), ('d', 'b'),
+                                        ('c', 'd'), ('d', 'c'),
+                                        ('d', 'e'), ('e', 'd')]))
+
+    def testBruteForce(self):
+        "closePairs matches the brute force check on random vehicles"
+        rand = random.Random(1)
+        for _ in range(20):
+            positions, roads = {}, {}
+            for i in range(rand.randint(0, 200)):
+                vehID = 'veh%d' % i
+                # integer positions, so that some vehicles share their x
+                positions[vehID] = (rand.randint(0, 300), rand.random())
+                roads[vehID] = rand.choice(['r1', '-r1', 'r2', '-r2', 'r3'])
+            self.assertEqual(sorted(closePairs(positions, roads)),
+                             sorted(bruteForcePairs(positions, roads)))
+
+
+if __name__ == '__main__':
+    setLogLevel('warning')
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""Package: mininet
+   Tests of the replayed traces that do not need root."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mininet.log import setLogLevel
+from mn_iot.mac80211.trace import traceCursor, binaryTrace, get_times
+
+
+class testTraceCursor(unittest.TestCase):
+    "Test the cursor over the samples of a node"
+
+    def testAdvance(self):
+        "Each sample is returned once, when it is due"
+        cursor = traceCursor([1, 2, 2, 4], position=[(i, 0, 0)
+                                                     for i in range(4)])
+        self.assertEqual(cursor.advance(0.5), None)
+        self.assertEqual(cursor.advance(1), 0)
+        self.assertEqual(cursor.advance(1.5), None)
+        self.assertEqual(cursor.advance(3), 2)
+        self.assertEqual(list(cursor.get('position', 2)), [2, 0, 0])
+        self.assertFalse(cursor.done())
+        self.assertEqual(cursor.next_time(), 4)
+        self.assertEqual(cursor.advance(10), 3)
+        self.assertTrue(cursor.done())
+        self.assertEqual(cursor.advance(20), None)
+
+
+class testBinaryTrace(unittest.TestCase):
+    "Test the conversion of text traces into binary traces"
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeText(self, name, lines):
+        filename = os.path.join(self.dir, name)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return filename
+
+    def testRoundTrip(self):
+        "The records of each node are read back sorted by time"
+        filename = os.path.join(self.dir, 'trace.bin')
+        files = {'sta1': self.writeText('sta1', ['2 10 20 -50',
+                                                 '1 30 40 -60']),
+                 'sta2': self.writeText('sta2', ['1.5 5 6 -70'])}
+        binaryTrace.convert(filename, files, ['time', 'x', 'y', 'rssi'])
+        trace = binaryTrace(filename)
+        self.assertTrue(trace.timed)
+        self.assertTrue('sta1' in trace and 'sta2' in trace)
+        records = trace.get('sta1')
+        self.assertEqual(list(records['time']), [1, 2])
+        self.assertEqual(records['position'].tolist(),
+                         [[30, 40, 0], [10, 20, 0]])
+        self.assertEqual(list(records['rssi']), [-60, -50])
+        cursor = trace.cursor('sta2', 'position', 'rssi')
+        self.assertEqual(cursor.advance(2), 0)
+        self.assertEqual(cursor.get('rssi', 0), -70)
+
+    def testUntimed(self):
+        "Untimed traces are replayed at the speed of the node"
+        filename = os.path.join(self.dir, 'trace.bin')
+        files = {'sta1': self.writeText('sta1', ['%d 0' % i
+                                                 for i in range(4)])}
+        binaryTrace.convert(filename, files, ['x', 'y'])
+        trace = binaryTrace(filename)
+        self.assertFalse(trace.timed)
+        cursor = trace.cursor('sta1', 'position', speed=2)
+        self.assertEqual(list(cursor.times), list(get_times(4, 2)))
+        self.assertEqual(list(cursor.times), [0.5, 0.5, 1.5, 1.5])
+
+
+if __name__ == '__main__':
+    setLogLevel('warning')
+    unittest.main()
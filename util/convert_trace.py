@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+"""Converts text traces into the memory-mapped binary trace format read by
+the replaying classes (trace= parameter).
+
+Examples:
+  convert_trace.py -o mobility.trace -f x,y sta1=node1.dat sta2=node2.dat
+  convert_trace.py -o rssi.trace -f time,rssi sta1=node1_rssiData.dat"""
+
+from argparse import ArgumentParser
+
+from mn_iot.mac80211.trace import binaryTrace
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', required=True,
+                        help='binary trace file')
+    parser.add_argument('-f', '--fields', required=True,
+                        help='columns of the text traces, e.g. time,x,y or '
+                             'time,bw,loss,latency')
+    parser.add_argument('-i', '--interval', type=float, default=1.0,
+                        help='time between samples without a time column')
+    parser.add_argument('traces', nargs='+', metavar='node=file')
+    args = parser.parse_args()
+
+    files = dict(trace.split('=', 1) for trace in args.traces)
+    binaryTrace.convert(args.output, files, args.fields.split(','),
+                        interval=args.interval)
+
+
+if __name__ == '__main__':
+    main()